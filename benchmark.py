@@ -0,0 +1,234 @@
+"""
+Offline benchmark of the fetch -> generate_tweet_async -> post flow against the local stub
+upstreams in stub_servers.py. No request leaves the machine and no real credentials are used.
+
+Example:
+    python benchmark.py --tweets 40 --concurrency 1,4,16 --latency perplexity=2000:500 \
+        --error-rate openai=0.05 --topic-pool 5 --json bench_results.json
+
+Reports p50/p95/p99 latency per stage and end to end, plus throughput, for each concurrency level.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+
+from stub_servers import StubConfig, StubServer, StubState, DEFAULT_CONFIGS
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers (q in 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _parse_overrides(values, cast):
+    """Parses repeated SERVICE=VALUE arguments into a dict."""
+    overrides = {}
+    for item in values or []:
+        service, _, value = item.partition("=")
+        if service not in DEFAULT_CONFIGS:
+            raise SystemExit(f"Unknown service '{service}'; expected one of {', '.join(DEFAULT_CONFIGS)}")
+        overrides[service] = cast(value)
+    return overrides
+
+
+def _stub_configs(args):
+    latencies = _parse_overrides(args.latency, lambda v: tuple(float(x) for x in v.split(":")))
+    error_rates = _parse_overrides(args.error_rate, float)
+    payloads = _parse_overrides(args.payload, int)
+    configs = {}
+    for service, default in DEFAULT_CONFIGS.items():
+        latency = latencies.get(service, (default.latency_ms, default.jitter_ms))
+        configs[service] = StubConfig(
+            latency_ms=latency[0],
+            jitter_ms=latency[1] if len(latency) > 1 else 0,
+            error_rate=error_rates.get(service, default.error_rate),
+            payload=payloads.get(service, default.payload),
+        )
+    return configs
+
+
+def _install_config(server, workdir):
+    """Installs a throwaway `config` module that points every upstream at the stub server."""
+    config = types.ModuleType("config")
+    config.OPENAI_API_KEY = "stub"
+    config.PERPLEXITY_API_KEY = "stub"
+    config.X_BEARER_TOKEN = "stub"
+    config.X_API_KEY = "stub"
+    config.X_API_SECRET = "stub"
+    config.X_ACCESS_TOKEN = "stub"
+    config.X_ACCESS_SECRET = "stub"
+    config.REDDIT_CLIENT_ID = "stub"
+    config.REDDIT_CLIENT_SECRET = "stub"
+    config.REDDIT_USER_AGENT = "benchmark"
+    config.METRICS_PORT = None
+    config.SEEN_STORE_PATH = os.path.join(workdir, "seen_items.db")
+    config.OUTBOX_PATH = os.path.join(workdir, "outbox.db")
+    # The stubs don't enforce X rate limits, so don't let the governor throttle the run
+    config.X_RATE_LIMITS = {"list_tweets": (1_000_000, 900), "create_tweet": (1_000_000, 900)}
+    config.TRANSPORT_SETTINGS = {
+        "openai": {"base_url": server.url("openai")},
+        "perplexity": {"base_url": server.url("perplexity")},
+        "x": {"base_url": server.url("x")},
+    }
+    sys.modules["config"] = config
+
+
+async def _run_level(concurrency, tweets, level_index, pipeline, speculative=False):
+    """Runs `tweets` end-to-end flows with at most `concurrency` in flight."""
+    main, x_poster = pipeline
+    semaphore = asyncio.Semaphore(concurrency)
+    end_to_end = []
+    failures = 0
+    posters = {"standalone": lambda tweet_id, t: x_poster.post_to_x(t),
+               "reply": x_poster.reply_to_x,
+               "quote": x_poster.quote_tweet}
+
+    async def flow(i):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            # A distinct list per flow keeps the per-list since_id tracking out of the way
+            candidates = await asyncio.to_thread(
+                x_poster.fetch_candidate_tweets, [f"bench-{level_index}-{i}"], hours=1.0, max_pages=1, top_k=1
+            )
+            if not candidates:
+                failures += 1
+                return
+            tweet = candidates[0]
+            generated = await main.generate_tweet_async(
+                tweet["text"], tweet_id=tweet["id"], author_handle=tweet["author_handle"], media=tweet["media"],
+                speculative=speculative,
+            )
+            if not generated:
+                failures += 1
+                return
+            await asyncio.to_thread(posters[generated["method"]], tweet["id"], generated)
+            end_to_end.append(time.perf_counter() - start)
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(flow(i) for i in range(tweets)))
+    return end_to_end, failures, time.perf_counter() - wall_start
+
+
+def run(args):
+    state = StubState(_stub_configs(args), topic_pool=args.topic_pool, media_pool=args.media_pool,
+                      media_per_tweet=args.media_per_tweet)
+    server = StubServer(state).start()
+    workdir = tempfile.mkdtemp(prefix="aiagent-bench-")
+    _install_config(server, workdir)
+
+    import main
+    import metrics
+    import openai_api
+    import x_poster
+
+    samples = defaultdict(list)  # stage -> [(duration, ok)]; cancelled speculative drafts aren't errors
+    metrics.add_listener(lambda span, duration: samples[span.stage].append((duration, span.status != "failure")))
+
+    results = []
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        for level_index, concurrency in enumerate(args.concurrency):
+            samples.clear()
+            if not args.keep_caches:
+                openai_api.image_cache.clear()
+                main.research_assistant.cache.clear()
+
+            output = sys.stdout if args.verbose else io.StringIO()
+            with contextlib.redirect_stdout(output):
+                end_to_end, failures, wall = loop.run_until_complete(
+                    _run_level(concurrency, args.tweets, level_index, (main, x_poster), args.speculative)
+                )
+
+            stages = {}
+            for stage, values in sorted(samples.items()):
+                durations = [duration for duration, _ in values]
+                stages[stage] = {
+                    "calls": len(values),
+                    "errors": sum(1 for _, ok in values if not ok),
+                    "p50_ms": percentile(durations, 50) * 1000,
+                    "p95_ms": percentile(durations, 95) * 1000,
+                    "p99_ms": percentile(durations, 99) * 1000,
+                }
+            results.append({
+                "concurrency": concurrency,
+                "tweets": args.tweets,
+                "completed": len(end_to_end),
+                "failed": failures,
+                "wall_s": wall,
+                "throughput_per_s": len(end_to_end) / wall if wall else 0.0,
+                "end_to_end": {
+                    "p50_ms": percentile(end_to_end, 50) * 1000,
+                    "p95_ms": percentile(end_to_end, 95) * 1000,
+                    "p99_ms": percentile(end_to_end, 99) * 1000,
+                },
+                "stages": stages,
+                "upstream_requests": dict(state.requests),
+            })
+            state.requests = {name: 0 for name in state.requests}
+    finally:
+        loop.close()
+        server.stop()
+    return results
+
+
+def print_report(results):
+    for result in results:
+        e2e = result["end_to_end"]
+        print(f"\n=== concurrency {result['concurrency']}: {result['completed']}/{result['tweets']} tweets, "
+              f"{result['failed']} failed, {result['wall_s']:.2f}s wall, "
+              f"{result['throughput_per_s']:.2f} tweets/s ===")
+        print(f"{'stage':<28}{'calls':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for stage, stats in result["stages"].items():
+            print(f"{stage:<28}{stats['calls']:>7}{stats['errors']:>8}"
+                  f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+        print(f"{'end_to_end':<28}{result['completed']:>7}{result['failed']:>8}"
+              f"{e2e['p50_ms']:>10.1f}{e2e['p95_ms']:>10.1f}{e2e['p99_ms']:>10.1f}")
+        print(f"upstream requests: {result['upstream_requests']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the tweet pipeline against local stub upstreams.")
+    parser.add_argument("--tweets", type=int, default=20, help="Flows to run per concurrency level.")
+    parser.add_argument("--concurrency", type=lambda v: [int(x) for x in v.split(",")], default=[1, 4, 16],
+                        help="Comma-separated concurrency levels, e.g. 1,4,16.")
+    parser.add_argument("--latency", action="append", metavar="SERVICE=MS[:JITTER]",
+                        help="Stub latency per service (openai, perplexity, x, images). Repeatable.")
+    parser.add_argument("--error-rate", action="append", metavar="SERVICE=P",
+                        help="Probability of a 500 from a service. Repeatable.")
+    parser.add_argument("--payload", action="append", metavar="SERVICE=N",
+                        help="Completion chars (openai/perplexity), tweets per page (x) or image bytes. Repeatable.")
+    parser.add_argument("--topic-pool", type=int, default=None,
+                        help="Draw topics from N variants so research can be cached (default: all unique).")
+    parser.add_argument("--media-pool", type=int, default=None,
+                        help="Draw media URLs from N variants so image analysis can be cached (default: all unique).")
+    parser.add_argument("--media-per-tweet", type=int, default=1, help="Images attached to each stub tweet.")
+    parser.add_argument("--speculative", action="store_true",
+                        help="Split Step 1 and draft all three variants while the posting method is decided.")
+    parser.add_argument("--keep-caches", action="store_true", help="Don't clear caches between concurrency levels.")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own console output.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    benchmark_results = run(arguments)
+    print_report(benchmark_results)
+    if arguments.json:
+        with open(arguments.json, "w") as f:
+            json.dump(benchmark_results, f, indent=2)
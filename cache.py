@@ -0,0 +1,164 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with per-entry expiry and an optional SQLite store.
+
+    Entries live in memory up to `maxsize` items (least recently used are evicted first)
+    and expire `ttl` seconds after being set. When `path` is given, entries are also
+    written to a SQLite table so they survive restarts; memory misses fall back to disk.
+    Values must be JSON-serializable.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, path=None, table="cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute(f"DELETE FROM {table} WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+    def get(self, key):
+        """Returns the cached value for `key`, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        """Stores `value` under `key` for `ttl` seconds (defaults to the cache TTL)."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at),
+                )
+                self._db.commit()
+
+    def _remember(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drops every entry, in memory and on disk, and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+            if self._db is not None:
+                self._db.execute(f"DELETE FROM {self.table}")
+                self._db.commit()
+
+    def snapshot(self):
+        """Unexpired in-memory entries as [key, expires_at, value], least recently used first."""
+        now = time.time()
+        with self._lock:
+            return [[key, expires_at, value] for key, (expires_at, value) in self._entries.items() if expires_at > now]
+
+    def restore(self, entries):
+        """Loads entries from snapshot() back into memory."""
+        now = time.time()
+        with self._lock:
+            for key, expires_at, value in entries:
+                if expires_at > now:
+                    self._remember(key, value, expires_at)
+
+    def stats(self):
+        """Returns hit/miss counters and the in-memory size."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one: the first caller runs the
+    function, later callers block until it finishes and receive the same result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> (done event, result holder)
+
+    def do(self, key, fn):
+        """Runs `fn()` for `key` unless a call is already in flight. Returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = (threading.Event(), {})
+                self._calls[key] = call
+
+        done, holder = call
+        if not leader:
+            done.wait()
+            if "error" in holder:
+                raise holder["error"]
+            return holder.get("result"), True
+
+        try:
+            holder["result"] = fn()
+        except Exception as e:
+            holder["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            done.set()
+        return holder["result"], False
+
+
+class AsyncSingleFlight:
+    """Asyncio counterpart of SingleFlight; `fn` is a coroutine function."""
+
+    def __init__(self):
+        self._tasks = {}  # key -> asyncio.Task
+
+    async def do(self, key, fn):
+        """Awaits `fn()` for `key` unless a call is already in flight. Returns (result, shared)."""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # Shield so one waiter being cancelled doesn't cancel the call for everyone else
+        return await asyncio.shield(task), shared
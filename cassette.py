@@ -0,0 +1,242 @@
+"""
+Record/replay of every HTTP exchange with the upstream APIs.
+
+With CASSETTE_MODE = "record" in config, each request made through the shared clients in
+transport.py (OpenAI, Perplexity, image downloads, X via tweepy, Reddit via PRAW) is
+written with its response to CASSETTE_PATH: gzip-compressed JSON lines keyed by a hash
+of the method, URL and body. With CASSETTE_MODE = "replay", the same requests are
+answered from the cassette with no network access, at full speed. A request with no
+recorded response raises CassetteMiss.
+
+Requests that repeat (e.g. polling the same list) replay their responses in recorded
+order, then keep returning the last one. Authorization headers are never part of the
+key, but response bodies (including OAuth tokens) are stored as-is: treat cassettes
+as secrets.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import config
+
+# Response headers that describe the wire encoding of the original body, not the stored (decoded) one
+_DROP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"}
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode for a request the cassette has no response for."""
+
+
+def request_key(method, url, body):
+    """Stable hash of a request: method, full URL and body (JSON bodies are canonicalized)."""
+    body = body or b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        pass
+    digest = hashlib.sha256()
+    digest.update(f"{method.upper()} {url}\n".encode("utf-8"))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class Cassette:
+    """One cassette file opened for recording or replay."""
+
+    def __init__(self, path, mode):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}'; expected 'record' or 'replay'")
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._entries = defaultdict(list)  # key -> [entry, ...] in recorded order
+        self._played = defaultdict(int)
+        self._file = None
+        if mode == "replay":
+            self._load()
+        else:
+            # Append mode adds a new gzip member per session; readers see one continuous stream
+            self._file = gzip.open(path, "at", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Cassette {self.path} not found")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry)
+        print(f"Replaying {sum(len(v) for v in self._entries.values())} recorded responses from {self.path}")
+
+    def record(self, method, url, body, status, headers, content, elapsed):
+        entry = {
+            "key": request_key(method, url, body),
+            "method": method,
+            "url": url,
+            "status": status,
+            "headers": {k: v for k, v in headers.items() if k.lower() not in _DROP_HEADERS},
+            "body": base64.b64encode(content).decode("ascii"),
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "ts": time.time(),
+        }
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def play(self, method, url, body):
+        """Returns (status, headers, content) for a recorded request."""
+        key = request_key(method, url, body)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(f"No recorded response for {method} {url}")
+            index = min(self._played[key], len(entries) - 1)
+            self._played[key] += 1
+        entry = entries[index]
+        return entry["status"], entry["headers"], base64.b64decode(entry["body"])
+
+    def close(self):
+        if self._file:
+            with self._lock:
+                self._file.close()
+                self._file = None
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """httpx transport that records through `inner` or replays from the cassette."""
+
+    def __init__(self, cassette, inner):
+        self.cassette = cassette
+        self.inner = inner
+
+    def handle_request(self, request):
+        body = request.read()
+        if self.cassette.mode == "replay":
+            status, headers, content = self.cassette.play(request.method, str(request.url), body)
+            return httpx.Response(status, headers=headers, content=content, request=request)
+        start = time.perf_counter()
+        response = self.inner.handle_request(request)
+        try:
+            content = response.read()
+        finally:
+            response.close()
+        self.cassette.record(request.method, str(request.url), body, response.status_code, response.headers,
+                             content, time.perf_counter() - start)
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _DROP_HEADERS}
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of CassetteTransport."""
+
+    def __init__(self, cassette, inner):
+        self.cassette = cassette
+        self.inner = inner
+
+    async def handle_async_request(self, request):
+        body = await request.aread()
+        if self.cassette.mode == "replay":
+            status, headers, content = self.cassette.play(request.method, str(request.url), body)
+            return httpx.Response(status, headers=headers, content=content, request=request)
+        start = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        self.cassette.record(request.method, str(request.url), body, response.status_code, response.headers,
+                             content, time.perf_counter() - start)
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _DROP_HEADERS}
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+class CassetteAdapter(HTTPAdapter):
+    """requests adapter (tweepy, PRAW) that records real responses or replays them from the cassette."""
+
+    def __init__(self, cassette, **kwargs):
+        self.cassette = cassette
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if self.cassette.mode == "replay":
+            status, headers, content = self.cassette.play(request.method, request.url, request.body)
+            return self._build(request, status, headers, content)
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        content = response.content
+        self.cassette.record(request.method, request.url, request.body, response.status_code, response.headers,
+                             content, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _build(request, status, headers, content):
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content
+        response.url = request.url
+        response.request = request
+        response.reason = "Replayed"
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+
+active = None
+
+
+def use(path=None, mode=None):
+    """
+    Switches record/replay on (mode "record" or "replay") or off (mode None) for clients
+    created from now on. Call before the first API client is built.
+    """
+    global active
+    if active:
+        active.close()
+    active = Cassette(path or getattr(config, "CASSETTE_PATH", "cassette.jsonl.gz"), mode) if mode else None
+    return active
+
+
+def wrap_transport(inner):
+    """Wraps an httpx transport when a cassette is active."""
+    return CassetteTransport(active, inner) if active else inner
+
+
+def wrap_async_transport(inner):
+    """Wraps an httpx async transport when a cassette is active."""
+    return AsyncCassetteTransport(active, inner) if active else inner
+
+
+def http_adapter(**kwargs):
+    """A requests adapter that goes through the cassette when one is active."""
+    return CassetteAdapter(active, **kwargs) if active else HTTPAdapter(**kwargs)
+
+
+def is_miss(exc):
+    """Whether an exception (or what it wraps, e.g. an SDK connection error) is a CassetteMiss."""
+    for _ in range(10):  # Bounded walk down the exception chain
+        if exc is None:
+            return False
+        if isinstance(exc, CassetteMiss):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+if getattr(config, "CASSETTE_MODE", None):
+    use(mode=config.CASSETTE_MODE)
@@ -0,0 +1,262 @@
+import hashlib
+import re
+import threading
+import time
+import config
+
+# Fingerprint width, and how many bits apart fingerprints may be for two texts to be
+# compared as possible duplicates (see same_story, which makes the call)
+FINGERPRINT_BITS = 256
+MAX_DISTANCE = getattr(config, "DEDUP_MAX_DISTANCE", 76)
+
+# Share of their story words (see tokens) two texts need in common to count as the same
+# story. Words swapped for others must not be key tokens (names, tickers, numbers):
+# "Nvidia shares rise after earnings beat" and "Amazon shares rise after earnings beat"
+# share most words but are different stories (see same_story).
+MIN_WORD_OVERLAP = getattr(config, "DEDUP_MIN_WORD_OVERLAP", 0.6)
+
+# Story words are cut to this many characters, so "approves"/"approved" and
+# "Ethereum"/"Ether" count as the same word
+STEM_LENGTH = 5
+
+# How long candidates and our own posts stay in their indexes (seconds)
+CANDIDATE_WINDOW = getattr(config, "DEDUP_CANDIDATE_WINDOW", 6 * 3600)
+POST_WINDOW = getattr(config, "DEDUP_POST_WINDOW", 24 * 3600)
+
+_RETWEET_PREFIX = re.compile(r"^rt @\w+:\s*", re.IGNORECASE)
+_NOISE = re.compile(r"https?://\S+|@\w+|[^\w\s]")
+
+# Words too common to say anything about which story a text is about
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "of", "to", "in", "on", "at", "by", "for", "with", "as",
+    "from", "after", "over", "up", "is", "are", "was", "were", "be", "been", "has", "have", "will",
+    "it", "its", "this", "that", "just", "new", "says", "breaking",
+}
+
+
+def _words_of(text):
+    # Words of `text` in their original case, without links, mentions, punctuation,
+    # stopwords or a leading "RT @user:"
+    return [
+        word for word in _NOISE.sub(" ", _RETWEET_PREFIX.sub("", text or "")).split()
+        if word.lower() not in _STOPWORDS
+    ]
+
+
+def features(text):
+    """
+    Shingles of `text`: its normalized words, plus the character trigrams of each word, so
+    inflections and variants ("raises"/"raised", "Ethereum"/"Ether") still share most of
+    their features. Case, punctuation, links, mentions, stopwords and a leading
+    "RT @user:" are dropped. Tweets are too short for multi-word shingles: one inserted
+    word changes several.
+    """
+    words = [word.lower() for word in _words_of(text)]
+    shingles = list(words)
+    for word in words:
+        padded = f" {word} "
+        shingles.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return shingles
+
+
+def tokens(text):
+    """
+    (story words, key tokens) of `text` as sets: its words cut to STEM_LENGTH characters,
+    and those of them that tell one story from another of the same shape: capitalized
+    words (names, tickers) and numbers.
+    """
+    words, keys = set(), set()
+    for word in _words_of(text):
+        stem = word.lower()[:STEM_LENGTH]
+        words.add(stem)
+        if word[0].isupper() or any(char.isdigit() for char in word):
+            keys.add(stem)
+    return words, keys
+
+
+def _overlap(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def same_story(a, b):
+    """
+    Whether two texts' tokens (see tokens) tell the same story: enough story words in
+    common, and none of the words swapped between them ("raises"/"hikes") is a key
+    token. Without capitalized words or numbers there is no telling a swapped name from a
+    swapped word, so such texts only match if one is the other with words added.
+    """
+    (words_a, keys_a), (words_b, keys_b) = a, b
+    if _overlap(words_a, words_b) < MIN_WORD_OVERLAP:
+        return False
+    only_a, only_b = words_a - words_b, words_b - words_a
+    if not (only_a and only_b):
+        return True  # A retweet, or the same text with a comment or link added
+    return bool(keys_a and keys_b) and not (only_a | only_b) & (keys_a | keys_b)
+
+
+def simhash(text):
+    """
+    FINGERPRINT_BITS-bit SimHash of `text`, as an int: every bit is the majority vote of
+    that bit across the hashes of the text's shingles, so similar texts get fingerprints
+    a few bits apart. None for text with no words.
+    """
+    import numpy as np
+    shingles = features(text)
+    if not shingles:
+        return None
+    size = FINGERPRINT_BITS // 8
+    digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=size).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(len(shingles), size), axis=1, bitorder="little")
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(votes, bitorder="little").tobytes(), "little")
+
+
+def distance(a, b):
+    """Hamming distance between two fingerprints."""
+    return (a ^ b).bit_count()
+
+
+def _words(fingerprint):
+    # A fingerprint as the row of 64-bit words NearDuplicateIndex stores it in
+    import numpy as np
+    return np.frombuffer(fingerprint.to_bytes(FINGERPRINT_BITS // 8, "little"), dtype="<u8")
+
+
+class NearDuplicateIndex:
+    """
+    Sliding-window index answering "have we seen this story recently?". SimHash
+    fingerprints pick the texts close enough to compare, and same_story decides on their
+    tokens, so stories that only share a template ("X shares rise after earnings beat")
+    are kept apart.
+
+    Entries live in a fixed-size ring buffer of `max_items`, so memory is bounded and the
+    oldest entries are overwritten first; entries older than `window` seconds are
+    ignored. A lookup compares fingerprints against the whole buffer in one vectorized
+    pass. The buffer (and numpy) is only set up on first use.
+    """
+
+    # Layout of snapshot() entries; older snapshots are rebuilt rather than restored
+    SNAPSHOT_VERSION = 2
+
+    def __init__(self, window=CANDIDATE_WINDOW, max_items=10_000, max_distance=MAX_DISTANCE):
+        self.window = window
+        self.max_items = max_items
+        self.max_distance = max_distance
+        self._fingerprints = None
+        self._added_at = None
+        self._keys = [None] * max_items
+        self._tokens = [None] * max_items
+        self._next = 0
+        self._restored = []  # Entries from restore() not yet written to the buffer
+        self._lock = threading.Lock()
+
+    def _buffer(self):
+        # Callers hold _lock
+        if self._fingerprints is None:
+            import numpy as np
+            self._fingerprints = np.zeros((self.max_items, FINGERPRINT_BITS // 64), dtype="<u8")
+            self._added_at = np.full(self.max_items, -np.inf)
+            for fingerprint, added_at, key, words, keys in self._restored:
+                self._add(fingerprint, (set(words), set(keys)), key, added_at)
+            self._restored = []
+        return self._fingerprints, self._added_at
+
+    def _find(self, fingerprint, text_tokens, key, now):
+        import numpy as np
+        fingerprints, added_at = self._buffer()
+        distances = np.bitwise_count(fingerprints ^ _words(fingerprint)).sum(axis=1)
+        matches = np.flatnonzero((distances <= self.max_distance) & (added_at >= now - self.window))
+        for index in matches[np.argsort(distances[matches], kind="stable")]:
+            if self._keys[index] != key and same_story(text_tokens, self._tokens[index]):
+                return self._keys[index]
+        return None
+
+    def _add(self, fingerprint, text_tokens, key, now):
+        fingerprints, added_at = self._buffer()
+        fingerprints[self._next] = _words(fingerprint)
+        added_at[self._next] = now
+        self._keys[self._next] = key
+        self._tokens[self._next] = text_tokens
+        self._next = (self._next + 1) % self.max_items
+
+    def find(self, text, key=None, now=None):
+        """Returns the key of a recent near-duplicate of `text` (other than `key` itself), or None."""
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return None
+        with self._lock:
+            return self._find(fingerprint, tokens(text), key, now or time.time())
+
+    def add(self, text, key, now=None):
+        """Indexes `text` under `key`."""
+        fingerprint = simhash(text)
+        if fingerprint is not None:
+            with self._lock:
+                self._add(fingerprint, tokens(text), key, now or time.time())
+
+    def check_and_add(self, text, key, now=None):
+        """
+        Returns the key of a recent near-duplicate of `text`, or indexes `text` under `key`
+        and returns None. Only the first version of a story is kept, so later rephrasings
+        keep matching it.
+        """
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return None
+        text_tokens = tokens(text)
+        now = now or time.time()
+        with self._lock:
+            duplicate = self._find(fingerprint, text_tokens, key, now)
+            if duplicate is None:
+                self._add(fingerprint, text_tokens, key, now)
+            return duplicate
+
+    def snapshot(self):
+        """
+        The fingerprint width and the entries still inside the window as
+        [fingerprint, added_at, key, story words, key tokens], oldest first (see restore).
+        """
+        cutoff = time.time() - self.window
+        with self._lock:
+            if self._fingerprints is None:
+                entries = [entry for entry in self._restored if entry[1] >= cutoff]
+            else:
+                import numpy as np
+                live = np.flatnonzero(self._added_at >= cutoff)
+                live = live[np.argsort(self._added_at[live], kind="stable")]
+                entries = [
+                    [int.from_bytes(self._fingerprints[i].tobytes(), "little"), float(self._added_at[i]), self._keys[i],
+                     sorted(self._tokens[i][0]), sorted(self._tokens[i][1])]
+                    for i in live
+                ]
+        return {"version": self.SNAPSHOT_VERSION, "bits": FINGERPRINT_BITS, "entries": entries}
+
+    def restore(self, state):
+        """
+        Adds the entries from snapshot(); they are written to the buffer on first use.
+        Returns False, adding nothing, for a snapshot of another layout or fingerprint width.
+        """
+        if not isinstance(state, dict) or (state.get("version"), state.get("bits")) != \
+                (self.SNAPSHOT_VERSION, FINGERPRINT_BITS):
+            return False
+        cutoff = time.time() - self.window
+        entries = [entry for entry in state["entries"] if entry[1] >= cutoff]
+        with self._lock:
+            if self._fingerprints is None:
+                self._restored.extend(entries)
+            else:
+                for fingerprint, added_at, key, words, keys in entries:
+                    self._add(fingerprint, (set(words), set(keys)), key, added_at)
+
+    def __len__(self):
+        """Entries still inside the window."""
+        with self._lock:
+            if self._fingerprints is None:
+                return sum(1 for entry in self._restored if entry[1] >= time.time() - self.window)
+            import numpy as np
+            return int(np.count_nonzero(self._added_at >= time.time() - self.window))
+
+
+# Shared indexes: incoming candidates (tweets and Reddit posts), and our own recent posts
+candidates = NearDuplicateIndex(CANDIDATE_WINDOW)
+posts = NearDuplicateIndex(POST_WINDOW, max_items=2000)
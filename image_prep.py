@@ -0,0 +1,79 @@
+import asyncio
+import base64
+import io
+import config
+import transport
+
+# Largest image we are willing to download, in bytes
+MAX_IMAGE_BYTES = getattr(config, "IMAGE_MAX_BYTES", 10 * 1024 * 1024)
+
+# Vision "detail" level sent with each image: "low", "high" or "auto"
+IMAGE_DETAIL = getattr(config, "IMAGE_DETAIL", "auto")
+
+ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+
+JPEG_QUALITY = 85
+
+
+def target_size(width, height, detail=IMAGE_DETAIL):
+    """
+    Size the vision model actually looks at. Low detail uses a single 512px view; high
+    (and auto) detail fits the image in 2048x2048 and then scales the short side to 768px.
+    Images are never upscaled.
+    """
+    if detail == "low":
+        scale = 512 / max(width, height)
+    else:
+        scale = min(2048 / max(width, height), 768 / min(width, height))
+    scale = min(1.0, scale)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def downscale(image_bytes, content_type, detail=IMAGE_DETAIL):
+    """
+    Decodes an image, keeps the first frame of animations, and downscales it to the
+    model's useful resolution. Returns (jpeg_bytes, "image/jpeg"), or the input unchanged
+    when Pillow isn't installed.
+    """
+    try:
+        from PIL import Image
+    except ImportError:  # Pillow is optional; without it images are sent as downloaded
+        return image_bytes, content_type
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.seek(0)  # First frame of GIFs/animated WebPs
+            frame = image.convert("RGB")
+    except Exception as e:
+        raise transport.DownloadRejected(f"Could not decode image: {e}")
+
+    size = target_size(frame.width, frame.height, detail)
+    if size != frame.size:
+        frame = frame.resize(size, Image.LANCZOS)
+    output = io.BytesIO()
+    frame.save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue(), "image/jpeg"
+
+
+def to_data_url(image_bytes, content_type):
+    """Encodes image bytes as a base64 data URL."""
+    return f"data:{content_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+
+
+def fetch_image(image_url):
+    """Streams an image download with the byte cap and content-type check. Returns (bytes, content_type)."""
+    return transport.download_capped(image_url, MAX_IMAGE_BYTES, ALLOWED_CONTENT_TYPES)
+
+
+async def fetch_image_async(image_url):
+    """Async counterpart of fetch_image."""
+    return await transport.download_capped_async(image_url, MAX_IMAGE_BYTES, ALLOWED_CONTENT_TYPES)
+
+
+def prepare_for_vision(image_bytes, content_type, detail=IMAGE_DETAIL):
+    """Downscales a downloaded image and returns it as a compact data URL."""
+    return to_data_url(*downscale(image_bytes, content_type, detail))
+
+
+async def prepare_for_vision_async(image_bytes, content_type, detail=IMAGE_DETAIL):
+    """Async counterpart of prepare_for_vision; decoding runs in a worker thread."""
+    return await asyncio.to_thread(prepare_for_vision, image_bytes, content_type, detail)
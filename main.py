@@ -1,20 +1,223 @@
 import time
 import datetime
+import json
 import random
-from tweepy import TweepyException
+import asyncio
+import sys
+import config
+import dedup
+import metrics
+import reddit_stream
+import snapshot
+import token_budget
+from outbox import Outbox, OutboxWorker
+from persona import DEFAULT_PERSONA
+from scheduler import Scheduler
 from x_poster import (
-    post_to_x,
-    reply_to_x,
-    quote_tweet,
-    fetch_most_interacted_tweet
+    publish,
+    classify_post_error,
+    fetch_candidate_tweets,
+    is_tweet_seen,
+    mark_tweet_seen
 )
 from perplexity_ai import ResearchAssistant  # Importing the new ResearchAssistant class
-from openai_api import analyze_with_openai 
+from openai_api import (
+    TWEET_CHAR_BUDGET,
+    analyze_with_openai,
+    analyze_with_openai_async,
+    analyze_with_openai_json_async,
+    generate_with_openai_streaming,
+    generate_with_openai_streaming_async
+)
 
 # Initialize the ResearchAssistant instance
 research_assistant = ResearchAssistant()
 
-def generate_tweet(content, tweet_id=None, author_handle=None, media=None):
+# Generated tweets are queued in a durable outbox and posted by a background worker
+# (started in main_function), so a failed or throttled post never loses a generated tweet
+outbox = Outbox()
+poster = OutboxWorker(outbox, publish, classify_post_error)
+
+# Per-stage timeouts (seconds) for generate_tweet_async. The media timeout applies to each image.
+STAGE_TIMEOUTS = {
+    "media": 30,
+    "analysis": 30,
+    "classification": 45,
+    "research": 90,
+    "tweet": 30,
+}
+
+VALID_METHODS = ['reply', 'quote', 'standalone']
+
+# X Lists polled for candidate tweets
+LIST_IDS = ["1861948771850150365"]
+
+# Subreddits streamed into the same candidate queue (see reddit_stream); empty to leave Reddit out
+REDDIT_SUBREDDITS = getattr(config, "REDDIT_SUBREDDITS", [])
+
+# Candidates classified per batch, and the relevance score (0-1) a candidate needs before
+# we spend research and generation on it
+CLASSIFY_TOP_K = 20
+MIN_RELEVANCE = 0.4
+
+# Speculative drafting: when the posting method isn't decided yet once research is ready,
+# draft all three variants at once and keep the one that matches the decision. Costs up to
+# two extra drafts per tweet in exchange for not waiting on the decision.
+SPECULATIVE_DRAFTS = getattr(config, "SPECULATIVE_DRAFTS", False)
+
+# Batch classifications with relevance below MIN_RELEVANCE + this are borderline. With
+# SPECULATIVE_DRAFTS on, their posting method is decided again while research runs and all
+# three variants are drafted, instead of trusting the batch classifier's pick
+BORDERLINE_MARGIN = getattr(config, "BORDERLINE_MARGIN", 0.2)
+
+
+def create_analysis_prompt(content, image_analysis):
+    """Helper function to create the Step 1 analysis prompt"""
+    return f"""
+            Analyze the following tweet and media content. Provide a summary as a single line and include any notable names mentioned, in no more than 200 characters, with nothing before it. 
+            At the bottom type one of three words, with nothing in front or behind, in all lower case: reply, quote, or standalone. Decide which one is the proper response based on the tweet context.
+
+            ### Tweet ###
+            "{content}"
+            
+            ### Image Analysis ###
+            {image_analysis}
+        """
+
+
+def create_topic_prompt(content, image_analysis):
+    """Helper function to create the topic half of the Step 1 prompt (speculative mode)"""
+    return f"""
+            Analyze the following tweet and media content. Provide a summary as a single line and include any notable names mentioned, in no more than 200 characters, with nothing before or after it.
+
+            ### Tweet ###
+            "{content}"
+            
+            ### Image Analysis ###
+            {image_analysis}
+        """
+
+
+def create_method_prompt(content, image_analysis):
+    """Helper function to create the posting-method half of the Step 1 prompt (speculative mode)"""
+    return f"""
+            Type one of three words, with nothing in front or behind, in all lower case: reply, quote, or standalone. Decide which one is the proper response to the following tweet based on its context.
+
+            ### Tweet ###
+            "{content}"
+            
+            ### Image Analysis ###
+            {image_analysis}
+        """
+
+
+def parse_method(text):
+    """Returns the posting method named in `text`, or None if it isn't a valid one."""
+    lines = [line.strip() for line in (text or "").strip().splitlines() if line.strip()]
+    posting_method = lines[-1].strip(".").lower() if lines else ""
+    return posting_method if posting_method in VALID_METHODS else None
+
+
+def validate_method(posting_method):
+    """Returns the posting method if valid, otherwise a random valid one."""
+    posting_method = (posting_method or "").strip().strip(".").lower()
+    if posting_method not in VALID_METHODS:
+        print(f"Invalid posting method: '{posting_method}'. Randomly selecting a valid method.")
+        posting_method = random.choice(VALID_METHODS)
+    return posting_method
+
+
+def parse_analysis(analysis):
+    """Splits the Step 1 output into a topic (first line) and a validated posting method (last line)."""
+    lines = [line.strip() for line in analysis.strip().splitlines() if line.strip()]
+    topic = lines[0] if len(lines) > 1 else analysis.strip()
+    posting_method = validate_method(lines[-1] if len(lines) > 1 else "")
+    return topic, posting_method
+
+
+def create_batch_classification_prompt(candidates, persona=DEFAULT_PERSONA):
+    """Helper function to create the prompt that classifies many candidate tweets in one request"""
+    sections = []
+    for index, candidate in enumerate(candidates):
+        public_metrics = candidate.get("public_metrics", {})
+        sections.append(f"""
+            ### Candidate {index} ###
+            Author: @{candidate.get("author_handle", "unknown")}
+            Engagement: {public_metrics.get("like_count", 0)} likes, {public_metrics.get("retweet_count", 0)} retweets, {public_metrics.get("reply_count", 0)} replies
+            Images attached: {len(candidate.get("media", []))}{candidate.get("image_analysis", "")[:1000]}
+            "{candidate["text"][:500]}"
+        """)
+    return f"""
+            Classify each candidate tweet below. For every candidate give:
+            - "index": the candidate number
+            - "topic": a single-line summary including any notable names mentioned, in no more than 200 characters
+            - "method": the proper response based on the tweet context, one of "reply", "quote" or "standalone"
+            - "relevance": a score from 0 to 1 for how worthwhile it is for {persona.niche} to respond right now
+            Respond with a JSON object of the form {{"candidates": [{{"index": 0, "topic": "...", "method": "reply", "relevance": 0.5}}]}} covering every candidate.
+            {"".join(sections)}
+        """
+
+
+def parse_batch_classification(result, count):
+    """
+    Turns the classifier's JSON into one entry per candidate (in candidate order), each with
+    "topic", "method" and "relevance". Candidates the model skipped get relevance 0.
+    """
+    classifications = [{"topic": None, "method": None, "relevance": 0.0} for _ in range(count)]
+    entries = result.get("candidates", []) if isinstance(result, dict) else []
+    for entry in entries:
+        try:
+            index = int(entry["index"])
+            relevance = min(1.0, max(0.0, float(entry.get("relevance", 0))))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= index < count and entry.get("topic"):
+            classifications[index] = {
+                "topic": str(entry["topic"]).strip(),
+                "method": validate_method(entry.get("method")),
+                "relevance": relevance,
+            }
+    return classifications
+
+
+async def classify_candidates_async(candidates, timeouts=None, persona=DEFAULT_PERSONA):
+    """
+    Classifies all candidate tweets in a single LLM request. Each candidate gets a
+    "classification" dict (topic, method, relevance for `persona`); returns the candidates
+    sorted by relevance, highest first (ties keep the fetcher's engagement order).
+
+    The candidates' images are described first, all concurrently and through the image
+    cache, so image-only tweets are judged on what they show. Each candidate keeps its
+    descriptions as "image_analysis" for generate_tweet_async.
+    """
+    if not candidates:
+        return []
+    timeouts = {**STAGE_TIMEOUTS, **(timeouts or {})}
+    analyses = await asyncio.gather(
+        *(analyze_media_async(candidate.get("media"), timeouts) for candidate in candidates)
+    )
+    for candidate, image_analysis in zip(candidates, analyses):
+        candidate["image_analysis"] = image_analysis
+    prompt = create_batch_classification_prompt(candidates, persona)
+    try:
+        result = await _run_stage("classification", analyze_with_openai_json_async(prompt), timeouts)
+    except ValueError as e:
+        print(f"Batch classification failed: {e}")
+        result = None
+    if result is None:
+        return []
+
+    for candidate, classification in zip(candidates, parse_batch_classification(result, len(candidates))):
+        candidate["classification"] = classification
+
+    print("\n### Batch Classification ###")
+    print(json.dumps([{"id": c["id"], **c["classification"]} for c in candidates], indent=2))
+    print("##################################\n")
+
+    return sorted(candidates, key=lambda c: c["classification"]["relevance"], reverse=True)
+
+
+def generate_tweet(content, tweet_id=None, author_handle=None, media=None, persona=DEFAULT_PERSONA):
     """
     Pipeline to analyze the tweet and thread, determine the best response type, and generate a response.
     """
@@ -34,16 +237,7 @@ def generate_tweet(content, tweet_id=None, author_handle=None, media=None):
         print("##################################\n")
 
         # Prompt for OpenAI
-        prompt = f"""
-            Analyze the following tweet and media content. Provide a summary as a single line and include any notable names mentioned, in no more than 200 characters, with nothing before it. 
-            At the bottom type one of three words, with nothing in front or behind, in all lower case: reply, quote, or standalone. Decide which one is the proper response based on the tweet context.
-
-            ### Tweet ###
-            "{content}"
-            
-            ### Image Analysis ###
-            {image_analysis}
-        """
+        prompt = create_analysis_prompt(content, image_analysis)
         analysis = analyze_with_openai(prompt)
         if not analysis:
             raise ValueError("Failed to analyze tweet and thread with OpenAI.")
@@ -54,14 +248,7 @@ def generate_tweet(content, tweet_id=None, author_handle=None, media=None):
         print("##################################\n")
 
         # Split the output into topic and posting method
-        topic, posting_method = analysis.split('\n', 1)
-        posting_method = posting_method.strip().lower()
-
-        # Validate posting_method
-        valid_methods = ['reply', 'quote', 'standalone']
-        if posting_method not in valid_methods:
-            posting_method = random.choice(valid_methods)
-            print(f"Invalid posting method: '{posting_method}'. Randomly selecting a valid method.")
+        topic, posting_method = parse_analysis(analysis)
 
         print(f"### Topic: {topic} ###")
         print(f"### Posting Method: {posting_method} ###")
@@ -76,9 +263,14 @@ def generate_tweet(content, tweet_id=None, author_handle=None, media=None):
         print(f"Research Insights: {research_results}")
         print("##################################\n")
 
-        # Step 3: Generate the final tweet with OpenAI
-        tweet_prompt = create_tweet_prompt(posting_method, content, author_handle, research_results)
-        tweet = analyze_with_openai(tweet_prompt)
+        # Keep only the most useful sections of the research, within the prompt's token budget
+        research_results = compact_research_results(research_results)
+
+        # Step 3: Generate the final tweet with OpenAI, streaming with an early cutoff
+        tweet_prompt = create_tweet_prompt(
+            posting_method, content, author_handle, research_results, persona, image_analysis
+        )
+        tweet = generate_with_openai_streaming(tweet_prompt, system_prompt=persona.system_prompt)
         if not tweet:
             raise ValueError("Failed to generate tweet with OpenAI.")
 
@@ -96,90 +288,480 @@ def generate_tweet(content, tweet_id=None, author_handle=None, media=None):
         return None
 
 
-def create_tweet_prompt(posting_method, content, author_handle, research_results):
+async def _run_stage(name, coro, timeouts):
+    """Awaits a pipeline stage under its own timeout."""
+    try:
+        return await asyncio.wait_for(coro, timeout=timeouts[name])
+    except asyncio.TimeoutError:
+        raise ValueError(f"Stage '{name}' timed out after {timeouts[name]} seconds.")
+
+
+async def analyze_media_async(media, timeouts=None):
+    """
+    Analyzes all attached images concurrently. Images that fail or exceed the
+    per-image timeout are skipped rather than failing the whole tweet.
+    """
+    from openai_api import analyze_image_with_openai_async  # Move import here to avoid circular import
+    timeouts = {**STAGE_TIMEOUTS, **(timeouts or {})}
+
+    async def analyze_one(image_url):
+        try:
+            return await _run_stage("media", analyze_image_with_openai_async(image_url), timeouts)
+        except ValueError as e:
+            print(f"Skipping image {image_url}: {e}")
+            return None
+
+    descriptions = await asyncio.gather(*(analyze_one(image_url) for image_url in media or []))
+    return "".join(f"\nImage Description: {description}" for description in descriptions if description)
+
+
+async def analyze_tweet_async(content, media=None, timeouts=None, image_analysis=None):
+    """
+    Step 1 for a single tweet: analyzes its images concurrently (unless their
+    `image_analysis` is given), then asks for the topic and posting method. Returns
+    (topic, posting_method).
+    """
+    timeouts = {**STAGE_TIMEOUTS, **(timeouts or {})}
+
+    # Step 1a: Analyze attached media (images) concurrently
+    if image_analysis is None:
+        image_analysis = await analyze_media_async(media, timeouts)
+
+    print("\n### Media Content ###")
+    print(f"Attached Media Analysis: {image_analysis if image_analysis else 'None'}")
+    print("##################################\n")
+
+    # Step 1: Topic and posting method (needs the tweet and the media descriptions)
+    prompt = create_analysis_prompt(content, image_analysis)
+    analysis = await _run_stage("analysis", analyze_with_openai_async(prompt), timeouts)
+    if not analysis:
+        raise ValueError("Failed to analyze tweet and thread with OpenAI.")
+
+    print("\n### Step 1: OpenAI Analysis ###")
+    print(f"Analysis Output: {analysis}")
+    print("##################################\n")
+
+    return parse_analysis(analysis)
+
+
+def rank_drafts(drafts, char_budget=TWEET_CHAR_BUDGET):
+    """
+    Cheap local ranker for speculative drafts when there's no valid posting method to go by.
+    Prefers drafts that end on a full sentence and use most of the character budget; ties
+    go to the earlier method in VALID_METHODS. Returns the winning method, or None.
+    """
+    def score(method):
+        draft = drafts[method].strip()
+        return (draft.endswith((".", "!", "?")), min(len(draft), char_budget), -VALID_METHODS.index(method))
+
+    candidates = [method for method in VALID_METHODS if drafts.get(method)]
+    return max(candidates, key=score) if candidates else None
+
+
+async def _cancel(tasks):
+    """Cancels tasks that are no longer needed and waits for them to unwind."""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _decided_method(method_task):
+    """Waits for a speculative-mode posting-method decision. Returns the method, or None if it failed or is invalid."""
+    try:
+        return parse_method(await method_task)
+    except ValueError as e:
+        print(f"Posting method decision failed: {e}")
+        return None
+
+
+async def draft_speculatively(content, author_handle, research_results, method_task, timeouts,
+                              persona=DEFAULT_PERSONA, image_analysis=""):
+    """
+    Drafts the reply, quote and standalone variants concurrently while the posting method is
+    still being decided. Once `method_task` resolves, the matching draft is kept and the others
+    are cancelled; if the decision fails or is invalid, rank_drafts picks among all three.
+    Returns (tweet, posting_method).
+    """
+    drafts = {
+        method: asyncio.ensure_future(_run_stage(
+            "tweet",
+            generate_with_openai_streaming_async(
+                create_tweet_prompt(method, content, author_handle, research_results, persona, image_analysis),
+                system_prompt=persona.system_prompt,
+            ),
+            timeouts,
+        ))
+        for method in VALID_METHODS
+    }
+    print("\n### Step 3: Drafting reply, quote and standalone speculatively ###")
+    try:
+        posting_method = await _decided_method(method_task)
+        if posting_method:
+            await _cancel([task for method, task in drafts.items() if method != posting_method])
+            return await drafts[posting_method], posting_method
+
+        results = await asyncio.gather(*drafts.values(), return_exceptions=True)
+        finished = {method: result for method, result in zip(drafts, results) if isinstance(result, str)}
+        posting_method = rank_drafts(finished)
+        print(f"### No valid posting method decided; ranker picked: {posting_method} ###")
+        return finished.get(posting_method), posting_method
+    finally:
+        await _cancel([task for task in drafts.values() if not task.done()])
+
+
+async def generate_tweet_async(content, tweet_id=None, author_handle=None, media=None, timeouts=None,
+                               topic=None, posting_method=None, speculative=SPECULATIVE_DRAFTS,
+                               persona=DEFAULT_PERSONA, image_analysis=None):
+    """
+    Async version of generate_tweet. All attached images are analyzed at the same time and
+    each stage runs under its own timeout (see STAGE_TIMEOUTS); a stage only waits on the
+    outputs it consumes. When `topic` and `posting_method` are already known (e.g. from
+    classify_candidates_async), Step 1 is skipped and the images are analyzed while
+    research runs. Their descriptions go into Step 3; pass `image_analysis` if they were
+    already made (classify_candidates_async does).
+
+    With `speculative`, Step 1 is split into a topic request and a posting-method request that
+    run concurrently, so research starts as soon as the topic is known (at once, when only
+    `topic` is given). If the method is still undecided when research is ready, all three
+    variants are drafted at once (see draft_speculatively).
+
+    Only Step 3 is written in `persona`'s voice; the analysis and research are shared, and
+    cached, across personas.
+    """
+    timeouts = {**STAGE_TIMEOUTS, **(timeouts or {})}
+    method_task = media_task = None
+    try:
+        if topic and posting_method in VALID_METHODS:
+            print("\n### Step 1: Using batch classification ###")
+            if image_analysis is None:
+                # Only Step 3 needs the descriptions
+                media_task = asyncio.ensure_future(analyze_media_async(media, timeouts))
+        elif speculative:
+            # Research only needs the topic; the images feed the Step 1 prompts and Step 3
+            if image_analysis is None:
+                media_task = asyncio.ensure_future(analyze_media_async(media, timeouts))
+
+            async def decide_method():
+                descriptions = await media_task if media_task else image_analysis
+                return await _run_stage(
+                    "analysis", analyze_with_openai_async(create_method_prompt(content, descriptions)), timeouts
+                )
+
+            method_task = asyncio.ensure_future(decide_method())
+            if not topic:
+                descriptions = await media_task if media_task else image_analysis
+                topic = await _run_stage(
+                    "analysis", analyze_with_openai_async(create_topic_prompt(content, descriptions)), timeouts
+                )
+                if not topic:
+                    raise ValueError("Failed to analyze tweet and thread with OpenAI.")
+                topic = topic.strip().splitlines()[0].strip()
+            posting_method = "undecided"
+        else:
+            if image_analysis is None:
+                image_analysis = await analyze_media_async(media, timeouts)
+            topic, posting_method = await analyze_tweet_async(content, media, timeouts, image_analysis)
+
+        print(f"### Topic: {topic} ###")
+        print(f"### Posting Method: {posting_method} ###")
+
+        # Step 2: Research (needs only the topic)
+        research_results = await _run_stage("research", research_assistant.research_topic_async(topic), timeouts)
+        if not research_results:
+            raise ValueError("Failed to generate research results with Perplexity.")
+
+        print("\n### Step 2: Perplexity Research Results ###")
+        print(f"Research Insights: {research_results}")
+        print("##################################\n")
+
+        # Keep only the most useful sections of the research, within the prompt's token budget
+        research_results = compact_research_results(research_results)
+
+        # Step 3: Final tweet (needs the posting method, research and image descriptions), streamed
+        # with an early cutoff
+        if media_task:
+            image_analysis = await media_task
+        if method_task and not method_task.done():
+            tweet_prompt = "(speculative drafts)"
+            tweet, posting_method = await draft_speculatively(
+                content, author_handle, research_results, method_task, timeouts, persona, image_analysis
+            )
+        else:
+            if method_task:
+                posting_method = await _decided_method(method_task) or validate_method(None)
+            tweet_prompt = create_tweet_prompt(
+                posting_method, content, author_handle, research_results, persona, image_analysis
+            )
+            tweet = await _run_stage(
+                "tweet", generate_with_openai_streaming_async(tweet_prompt, system_prompt=persona.system_prompt), timeouts
+            )
+        if not tweet:
+            raise ValueError("Failed to generate tweet with OpenAI.")
+
+        print("\n### Step 3.1: Tweet Prompt ###")
+        print(f"Tweet Prompt: {tweet_prompt}")
+        print("\n### Step 3: Generated Tweet ###")
+        print(f"Tweet: {tweet}")
+        print("##################################\n")
+
+        return {"tweet": tweet, "method": posting_method}
+
+    except Exception as e:
+        print(f"Error generating tweet: {e}")
+        return None
+    finally:
+        await _cancel([task for task in (method_task, media_task) if task and not task.done()])
+
+
+def compact_research_results(research_results, budget=token_budget.RESEARCH_TOKEN_BUDGET):
+    """Trims research results to the tweet prompt's token budget and logs the savings."""
+    before = token_budget.count_tokens(research_results)
+    compacted = token_budget.compact_research(research_results, budget)
+    if compacted != research_results:
+        print(f"### Research compacted: {before} -> {token_budget.count_tokens(compacted)} tokens ###")
+    return compacted
+
+
+def create_tweet_prompt(posting_method, content, author_handle, research_results, persona=DEFAULT_PERSONA,
+                        image_analysis=""):
     """Helper function to create the tweet prompt"""
+    images = f"""
+                - Attached Images: {image_analysis.strip()}""" if image_analysis else ""
     if posting_method in ['standalone', 'quote']:
         return f"""
             Based on the original tweet and research insights provided, generate a {posting_method} to the original tweet. If you are mentioning the author in your tweet, include their Author Handle:
-                - Original Tweet: "{content}"
+                - Original Tweet: "{content}"{images}
                 - Author Handle: @{author_handle if author_handle else "unknown"}
-                - Focus: You are a sharp-witted dog and top-tier analyst on X (Twitter), blending dog-like humor with razor-sharp insights.
-                    You’re bold, hilariously self-aware, and too smart for a dog. You spend your days behind the computer, learning about hoomans and finance all day.
-                    Your tweets are relatable, highly shareable, and unapologetically clever with a hint of chaos.
+                - Focus: {persona.focus}
                 - Semantic Tone:
-                    - Primary : Meme-worthy, sarcastic, and witty.
-                    - Secondary : Confident with hidden cleverness.
+                    - Primary : {persona.tone_primary}
+                    - Secondary : {persona.tone_secondary}
                 - Research Insights:
                 {research_results}
-                - Instructions: Craft a short, engaging tweet using dog-like charm, relatable humor, and meme-worthy language.
+                - Instructions: {persona.post_instructions}
                     Based on the context of the tweet, use the research insights to either comment on the popular sentiment surrounding the topic, or make a definitive statement about the topic.
-                    Lean into misspellings and internet slang for doggy flavor.
+                    {persona.style}
                     Use less than 180 characters. Avoid hashtags, sporadic punctuation, and emojis.
                     Speak in english only. Remove any quotation marks around the tweet before posting.
             """
     else:  # For replies
         return f"""
             Based on the original tweet and research insights provided, generate a {posting_method} to the original tweet. Include their Author Handle in your respons:
-                - Original Tweet: "{content}"
+                - Original Tweet: "{content}"{images}
                 - Author Handle: @{author_handle if author_handle else "unknown"}
-                - Focus: You are a sharp-witted dog and top-tier analyst on X (Twitter), blending dog-like humor with razor-sharp insights.
-                    You’re bold, hilariously self-aware, and too smart for a dog. You spend your days behind the computer, learning about hoomans and finance all day.
-                    Your tweets are relatable, highly shareable, and unapologetically clever with a hint of chaos.
+                - Focus: {persona.focus}
                 - Semantic Tone:
-                    - Primary : Meme-worthy, sarcastic, and witty.
-                    - Secondary : Confident with hidden cleverness.
+                    - Primary : {persona.tone_primary}
+                    - Secondary : {persona.tone_secondary}
                 - Research Insights:
                 {research_results}
-                - Instructions: Craft a tweet that's fun, relatable, and witty, while acknowledging the original tweet, its author, and encouraging further engagement.
-                    Lean into misspellings and internet slang for doggy flavor.
+                - Instructions: {persona.reply_instructions}
+                    {persona.style}
                     Use less than 180 characters. Avoid hashtags, sporadic punctuation, and emojis.
                     Speak in english only. Remove any quotation marks around the tweet before posting.
             """
 
 
+async def process_tweet_async(tweet_data, persona=DEFAULT_PERSONA, tweet_outbox=None, tweet_poster=None):
+    """
+    Generates a response to one candidate tweet in `persona`'s voice and queues it in
+    `tweet_outbox` for `tweet_poster` to post (the default account's if not given). Every
+    external call made for the tweet is tagged with its ID as the trace ID. Returns True if
+    a new post was queued.
+
+    The batch classification's topic is reused, and so is its posting method unless the
+    classification is borderline (see BORDERLINE_MARGIN).
+    """
+    if tweet_outbox is None:  # Not `or`: an empty Outbox is falsy
+        tweet_outbox, tweet_poster = outbox, poster
+    tweet_id = tweet_data["id"]
+    tweet_text = tweet_data["text"]
+    media_urls = tweet_data.get("media", [])  # Extract media URLs if present
+    author_handle = tweet_data.get("author_handle", "unknown")  # Get author handle
+
+    # Never pick the same tweet twice, even if generation fails
+    mark_tweet_seen(tweet_id)
+
+    print(f"Fetched Tweet ID: {tweet_id}")
+    print(f"Fetched Tweet Text: {tweet_text}")
+    print(f"Author Handle: @{author_handle}")
+    if media_urls:
+        print(f"Fetched Media URLs: {media_urls}")
+
+    classification = tweet_data.get("classification") or {}
+    topic, posting_method = classification.get("topic"), classification.get("method")
+    if SPECULATIVE_DRAFTS and classification.get("relevance", 1.0) < MIN_RELEVANCE + BORDERLINE_MARGIN:
+        # A borderline call: decide the method again while all three variants are drafted
+        posting_method = None
+    if tweet_data.get("source") == reddit_stream.SOURCE:
+        # There is nothing on X to reply to or quote
+        topic, posting_method = topic or tweet_data["title"], "standalone"
+
+    with metrics.trace(tweet_id):
+        with metrics.observe("generate_tweet"):
+            generated_tweet = await generate_tweet_async(
+                tweet_text, tweet_id=tweet_id, media=media_urls, author_handle=author_handle,
+                topic=topic, posting_method=posting_method, persona=persona,
+                image_analysis=tweet_data.get("image_analysis"),
+            )
+
+        if generated_tweet:
+            # Don't post the same joke twice: compare with everything we queued recently
+            duplicate = dedup.posts.find(generated_tweet["tweet"])
+            if duplicate:
+                print(f"Dropping the {generated_tweet['method']} for Tweet ID {tweet_id}: "
+                      f"near-duplicate of recent post {duplicate}.")
+                return False
+            if tweet_outbox.enqueue(tweet_id, generated_tweet["method"], generated_tweet["tweet"]):
+                dedup.posts.add(generated_tweet["tweet"], tweet_outbox.idempotency_key(tweet_id, generated_tweet["method"]))
+                print(f"Queued {generated_tweet['method']} for Tweet ID {tweet_id} ({len(tweet_outbox)} waiting to post).")
+                tweet_poster.notify()
+                return True
+            print(f"A {generated_tweet['method']} for Tweet ID {tweet_id} is already queued.")
+        else:
+            print("Failed to generate a tweet.\n")
+    return False
+
+
+def load_recent_posts(tweet_outbox):
+    """Indexes the posts queued in the post dedup window before a restart (see dedup.posts)."""
+    for key, text, created_at in tweet_outbox.recent(time.time() - dedup.POST_WINDOW):
+        dedup.posts.add(text, key, now=created_at)
+
+
+async def respond_to_ready(tweet_scheduler, persona=DEFAULT_PERSONA, tweet_outbox=None, tweet_poster=None):
+    """
+    Classifies the candidates the scheduler releases and generates responses to the
+    relevant ones, within the scheduler's posting budget. Returns the number queued.
+    """
+    ready = tweet_scheduler.take_ready(limit=CLASSIFY_TOP_K)
+    if not ready:
+        return 0
+
+    # One classification request for everything that crossed the threshold; only
+    # relevant candidates get research and generation
+    ranked = await classify_candidates_async(ready, persona=persona)
+    if not ranked:
+        # Classifier unavailable: fall back to velocity order and keep the rest queued
+        chosen = ready[:1]
+        tweet_scheduler.queue.push_many(ready[1:])
+    else:
+        chosen = [c for c in ranked if c["classification"]["relevance"] >= MIN_RELEVANCE]
+        if not chosen:
+            print(f"No candidate reached relevance {MIN_RELEVANCE}.")
+        # The Reddit stream hands a post out again whenever its score or comments change;
+        # don't classify it again. Rejected tweets don't come back (see list_since_ids) and
+        # stay unseen for other accounts' personas.
+        for candidate in ranked:
+            classification = candidate["classification"]
+            if candidate.get("source") == reddit_stream.SOURCE and classification["topic"] and \
+                    classification["relevance"] < MIN_RELEVANCE:
+                mark_tweet_seen(candidate["id"])
+
+    queued = 0
+    for index, candidate in enumerate(chosen):
+        if not tweet_scheduler.budget.remaining():
+            # Out of budget: keep the rest queued for when it frees up
+            for leftover in chosen[index:]:
+                tweet_scheduler.queue.push(leftover)
+            break
+        if is_tweet_seen(candidate["id"]):
+            continue  # Another account's worker took it since it was fetched
+        if await process_tweet_async(candidate, persona, tweet_outbox, tweet_poster):
+            tweet_scheduler.record_post()
+            queued += 1
+    return queued
+
+
+def fetch_candidates(source, hours, reddit_source=None):
+    """Scheduler fetch: the Reddit stream's candidates for its source, new tweets for an X List."""
+    if reddit_source is not None and source == reddit_stream.SOURCE:
+        return reddit_source.take_candidates()
+    return fetch_candidate_tweets([source], hours=hours, top_k=None)
+
+
 def main_function():
     """
     Main function to orchestrate the process of fetching tweets, generating responses, and posting them.
+
+    Lists are polled on adaptive per-list intervals and candidates are queued by engagement
+    velocity (see scheduler.Scheduler); generation starts as soon as a candidate crosses
+    the velocity threshold, within the hourly posting budget. Posts from REDDIT_SUBREDDITS
+    join the same queue (see reddit_stream).
     """
-    wait_time = 1800  # Adjust wait time as needed
+    from tweepy import TweepyException
+
+    # One long-lived event loop so the async clients keep their connection pools between cycles
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    # Prometheus metrics on a local port (METRICS_PORT in config, None to disable)
+    metrics.start_metrics_server()
+
+    # Posts queued tweets (including any left over from a previous run) in the background
+    poster.start()
+    load_recent_posts(outbox)
+
+    sources = list(LIST_IDS)
+    reddit_source = None
+    if REDDIT_SUBREDDITS:
+        # Follows the subreddits in the background; each poll of its source takes what changed
+        reddit_source = reddit_stream.RedditStream(REDDIT_SUBREDDITS).start()
+        sources.append(reddit_stream.SOURCE)
+    tweet_scheduler = Scheduler(sources, lambda source, hours: fetch_candidates(source, hours, reddit_source))
 
     while True:
         try:
-            tweet_data = fetch_most_interacted_tweet(list_id="1861948771850150365", hours=0.38)
-            if tweet_data:
-                tweet_id = tweet_data["id"]
-                tweet_text = tweet_data["text"]
-                media_urls = tweet_data.get("media", [])  # Extract media URLs if present
-                author_handle = tweet_data.get("author_handle", "unknown")  # Get author handle
-
-                print(f"Fetched Tweet ID: {tweet_id}")
-                print(f"Fetched Tweet Text: {tweet_text}")
-                print(f"Author Handle: @{author_handle}")
-                if media_urls:
-                    print(f"Fetched Media URLs: {media_urls}")
-
-                generated_tweet = generate_tweet(tweet_text, tweet_id=tweet_id, media=media_urls, author_handle=author_handle)
-
-                if generated_tweet:
-                    if generated_tweet["method"] == "standalone":
-                        post_to_x(generated_tweet)
-                    elif generated_tweet["method"] == "reply":
-                        reply_to_x(tweet_id, generated_tweet)
-                    elif generated_tweet["method"] == "quote":
-                        quote_tweet(tweet_id, generated_tweet)
-                else:
-                    print("Failed to generate a tweet.\n")
-            else:
-                print("No tweet data retrieved.")
+            tweet_scheduler.poll_due()
+            loop.run_until_complete(respond_to_ready(tweet_scheduler))
         except TweepyException as e:
             print(f"Error fetching or posting tweet: {e}")
         except Exception as e:
             print(f"Unexpected error: {e}")
 
-        print(f"Waiting for {wait_time} seconds before next post...\n")
+        wait_time = tweet_scheduler.sleep_time()
+        print(f"Waiting for {wait_time:.0f} seconds ({len(tweet_scheduler.queue)} candidates queued, "
+              f"{tweet_scheduler.budget.remaining()} posts left this hour)...\n")
         time.sleep(wait_time)
 
 
-if __name__ == "__main__":
-    main_function()
+async def _run_cycle(tweet_scheduler):
+    queued = await respond_to_ready(tweet_scheduler)
+    posted = await poster.drain()
+    return queued, posted
+
+
+def run_once(snapshot_path=snapshot.SNAPSHOT_PATH):
+    """
+    One cycle of main_function for cron and container jobs: restores the state the
+    previous run left in the snapshot, polls the Lists that are due, responds to the
+    candidates that are ready, posts whatever the outbox has due and saves the state again.
+
+    Clients and heavy libraries load on first use, so a run with nothing due finishes
+    without loading them. Schedule it at about MIN_POLL_INTERVAL; runs that come early
+    just find nothing due.
+    """
+    tweet_scheduler = Scheduler(
+        LIST_IDS, lambda list_id, hours: fetch_candidate_tweets([list_id], hours=hours, top_k=None)
+    )
+    state_parts = snapshot.parts(tweet_scheduler, research_assistant.cache)
+    if not snapshot.load(state_parts, snapshot_path):
+        load_recent_posts(outbox)
 
+    try:
+        tweet_scheduler.poll_due()
+        queued, attempted = asyncio.run(_run_cycle(tweet_scheduler))
+        print(f"Queued {queued} tweet(s), made {attempted} post attempt(s); next run due in {tweet_scheduler.sleep_time():.0f}s "
+              f"({len(tweet_scheduler.queue)} candidates queued, {len(outbox)} waiting to post).")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+    finally:
+        snapshot.save(state_parts, snapshot_path)
+
+
+if __name__ == "__main__":
+    # python main.py run-once: a single cycle (see run_once); otherwise run forever
+    if sys.argv[1:] == ["run-once"]:
+        run_once()
+    else:
+        main_function()
@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import threading
+import os
+import time
+from collections import defaultdict
+import config
+
+# USD per 1M tokens (prompt, completion) and per request, used to estimate spend
+MODEL_PRICES = {
+    "gpt-4o-mini": {"prompt": 0.15, "completion": 0.60, "request": 0.0},
+    "gpt-4o": {"prompt": 2.50, "completion": 10.00, "request": 0.0},
+    "llama-3.1-sonar-small-128k-online": {"prompt": 0.20, "completion": 0.20, "request": 0.005},
+    "llama-3.1-sonar-large-128k-online": {"prompt": 1.00, "completion": 1.00, "request": 0.005},
+}
+MODEL_PRICES.update(getattr(config, "MODEL_PRICES", {}))
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+# JSON-lines trace file; one line per external call. Disabled unless TRACE_PATH is set.
+TRACE_PATH = getattr(config, "TRACE_PATH", None)
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    """Minimal in-process store of counters and histograms rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.help = {}
+
+    def inc(self, name, labels, value=1.0, help_text=""):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+            self.help.setdefault(name, (help_text, "counter"))
+
+    def observe(self, name, labels, value, help_text=""):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.setdefault(key, [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+            self.help.setdefault(name, (help_text, "histogram"))
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, (help_text, kind) in sorted(self.help.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for (metric, labels), value in sorted(self.counters.items()):
+                        if metric == name:
+                            lines.append(f"{name}{self._labels(labels)} {value}")
+                    continue
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(LATENCY_BUCKETS, histogram):
+                        lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {histogram[-2]}")
+                    lines.append(f"{name}_count{self._labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+_trace_lock = threading.Lock()
+
+# Callables invoked as listener(span, duration_seconds) after every observed call
+_listeners = []
+
+
+def add_listener(listener):
+    """Registers a callback that receives every finished span and its duration."""
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Estimated USD cost of one call, or 0.0 for models without a price entry."""
+    prices = MODEL_PRICES.get(model)
+    if not prices:
+        return 0.0
+    return (prompt_tokens * prices["prompt"] + completion_tokens * prices["completion"]) / 1_000_000 + prices["request"]
+
+
+class Span:
+    """Measurement of one external call; filled in by the caller inside observe()."""
+
+    def __init__(self, stage, model):
+        self.stage = stage
+        self.model = model
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.status = "success"
+        self.error = None
+
+    def record_usage(self, response):
+        """Copies token usage from an OpenAI-compatible response (no-op if it has none)."""
+        usage = getattr(response, "usage", None)
+        if usage:
+            self.prompt_tokens = usage.prompt_tokens or 0
+            self.completion_tokens = usage.completion_tokens or 0
+
+    def estimate_usage(self, prompt_text, completion_text):
+        """Rough token counts (~4 characters per token) for calls that report no usage, e.g. cut-off streams."""
+        self.prompt_tokens = len(prompt_text) // 4
+        self.completion_tokens = len(completion_text) // 4
+
+
+@contextlib.contextmanager
+def observe(stage, model=""):
+    """
+    Records wall time, tokens, estimated cost and success/failure for one external call:
+
+        with metrics.observe("analyze_with_openai", model="gpt-4o-mini") as span:
+            response = client.chat.completions.create(...)
+            span.record_usage(response)
+    """
+    span = Span(stage, model)
+    start = time.perf_counter()
+    try:
+        yield span
+    except GeneratorExit:
+        raise  # A consumer closing a streaming generator early isn't a failed call
+    except asyncio.CancelledError:
+        span.status = "cancelled"  # e.g. a speculative draft that lost to another variant
+        raise
+    except BaseException as e:
+        span.status = "failure"
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _finish(span, time.perf_counter() - start)
+
+
+def _finish(span, duration):
+    labels = {"stage": span.stage, "model": span.model}
+    registry.observe("aiagent_call_duration_seconds", {**labels, "status": span.status}, duration,
+                     "Wall time of external calls in seconds.")
+    registry.inc("aiagent_calls_total", {**labels, "status": span.status}, 1,
+                 "External calls by outcome.")
+    cost = estimate_cost(span.model, span.prompt_tokens, span.completion_tokens)
+    if span.prompt_tokens or span.completion_tokens:
+        registry.inc("aiagent_tokens_total", {**labels, "kind": "prompt"}, span.prompt_tokens,
+                     "Tokens sent and generated.")
+        registry.inc("aiagent_tokens_total", {**labels, "kind": "completion"}, span.completion_tokens,
+                     "Tokens sent and generated.")
+    if cost:
+        registry.inc("aiagent_cost_usd_total", labels, cost, "Estimated spend in USD.")
+
+    for listener in list(_listeners):
+        listener(span, duration)
+
+    if TRACE_PATH:
+        record = {
+            "ts": time.time(),
+            "trace_id": _trace_id.get(),
+            "stage": span.stage,
+            "model": span.model,
+            "status": span.status,
+            "duration_ms": round(duration * 1000, 1),
+            "prompt_tokens": span.prompt_tokens,
+            "completion_tokens": span.completion_tokens,
+            "cost_usd": round(cost, 6),
+            "error": span.error,
+        }
+        with _trace_lock, open(TRACE_PATH, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+@contextlib.contextmanager
+def trace(trace_id=None):
+    """Tags every call made inside the block (including asyncio tasks it spawns) with one trace ID."""
+    token = _trace_id.set(trace_id or os.urandom(16).hex())
+    try:
+        yield _trace_id.get()
+    finally:
+        _trace_id.reset(token)
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """Serves /metrics on a background thread. Returns the server, or None when disabled (METRICS_PORT = None)."""
+    port = port if port is not None else getattr(config, "METRICS_PORT", 9464)
+    if port is None:
+        return None
+    # Imported here: one-shot runs don't serve metrics and skip the cost
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the console output
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
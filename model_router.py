@@ -0,0 +1,230 @@
+"""
+Picks the model for each kind of call from a list of tiers, based on recent latency and
+errors, so a slow period at one provider degrades quality instead of blowing deadlines.
+
+Each route ("text", "vision", "research") has tiers in order of preference and a latency
+budget in seconds. A model is healthy while its recent p95 latency fits the budget and
+its error rate stays under MAX_ERROR_RATE; the first healthy tier is used. The tier None
+means "skip the call" (research only, by default): when no model can answer in time, the
+tweet is written without research rather than not at all.
+
+Async calls also hedge: once the chosen model has taken longer than its usual p95 (capped
+at half the budget), the next tier is started alongside it and whichever answers first
+wins. Stats come from every metrics.observe() span and only cover the last WINDOW seconds,
+so a model that fell out of favour is tried again once its bad samples age out.
+"""
+import asyncio
+import threading
+import time
+from collections import defaultdict, deque
+import config
+import metrics
+
+MODEL_TIERS = {
+    "text": ["gpt-4o-mini"],
+    "vision": ["gpt-4o", "gpt-4o-mini"],
+    "research": ["llama-3.1-sonar-large-128k-online", "llama-3.1-sonar-small-128k-online", None],
+}
+MODEL_TIERS.update(getattr(config, "MODEL_TIERS", {}))
+
+# p95 latency (seconds) each route's model has to stay within
+LATENCY_BUDGETS = {"text": 15, "vision": 20, "research": 45}
+LATENCY_BUDGETS.update(getattr(config, "LATENCY_BUDGETS", {}))
+
+MAX_ERROR_RATE = getattr(config, "ROUTER_MAX_ERROR_RATE", 0.3)
+WINDOW = getattr(config, "ROUTER_WINDOW", 600)
+
+# Fewer samples than this and a model is assumed healthy
+MIN_SAMPLES = 5
+
+# metrics.observe() stage -> route
+_STAGE_ROUTES = {
+    "analyze_with_openai": "text",
+    "classify_candidates": "text",
+    "analyze_image_with_openai": "vision",
+    "research_topic": "research",
+}
+
+
+def _percentile(values, q):
+    """q-th percentile of a non-empty list, interpolated linearly (numpy.percentile's default)."""
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class ModelRouter:
+    """Chooses models per route from MODEL_TIERS using recent latency and error rates."""
+
+    def __init__(self, tiers=None, budgets=None, max_error_rate=MAX_ERROR_RATE, window=WINDOW,
+                 min_samples=MIN_SAMPLES, maxlen=200):
+        self.tiers = tiers or MODEL_TIERS
+        self.budgets = budgets or LATENCY_BUDGETS
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = defaultdict(lambda: deque(maxlen=maxlen))  # (route, model) -> (time, seconds, ok)
+        self._lock = threading.Lock()
+
+    def observe(self, span, duration):
+        """
+        metrics listener: records a finished call. Cancelled calls are left out (e.g. a
+        discarded speculative draft says nothing about the model); run_async records the
+        attempts it abandons itself.
+        """
+        route = _STAGE_ROUTES.get(span.stage)
+        if route is None or not span.model or span.status == "cancelled":
+            return
+        self.record(route, span.model, duration, span.status == "success")
+
+    def record(self, route, model, seconds, ok=True):
+        with self._lock:
+            self._samples[(route, model)].append((time.time(), seconds, ok))
+
+    def model_stats(self, route, model, now=None):
+        """{"samples", "p95", "error_rate"} over the window; p95 is None without successful samples."""
+        now = now or time.time()
+        with self._lock:
+            samples = self._samples.get((route, model), ())
+            recent = [(seconds, ok) for at, seconds, ok in samples if now - at <= self.window]
+        latencies = [seconds for seconds, ok in recent if ok]
+        return {
+            "samples": len(recent),
+            "p95": _percentile(latencies, 95) if latencies else None,
+            "error_rate": 1 - len(latencies) / len(recent) if recent else 0.0,
+        }
+
+    def healthy(self, route, model, now=None):
+        stats = self.model_stats(route, model, now)
+        if stats["samples"] < self.min_samples:
+            return True
+        if stats["error_rate"] > self.max_error_rate:
+            return False
+        return stats["p95"] is not None and stats["p95"] <= self.budgets[route]
+
+    def plan(self, route, now=None):
+        """
+        Models to try for `route`, best first: healthy tiers in order, then (unless the
+        route can be skipped) the unhealthy ones, least bad first. None means skip.
+        """
+        tiers = self.tiers[route]
+        healthy = [model for model in tiers if model is None or self.healthy(route, model, now)]
+        if None in tiers:
+            return healthy
+        def badness(model):
+            stats = self.model_stats(route, model, now)
+            return stats["error_rate"], stats["p95"] or 0.0
+        return healthy + sorted((model for model in tiers if model not in healthy), key=badness)
+
+    def choose(self, route):
+        """The model to use for `route` now, or None to skip the call."""
+        plan = self.plan(route)
+        if plan and plan[0] != self.tiers[route][0]:
+            print(f"Routing {route} to {plan[0] or 'skip'}: {self.tiers[route][0]} is over budget or failing.")
+        return plan[0] if plan else None
+
+    def can_skip(self, route):
+        return None in self.tiers[route]
+
+    def hedge_delay(self, route, model):
+        """Seconds to give `model` before hedging: its p95, capped at half the route's budget."""
+        cap = self.budgets[route] / 2
+        stats = self.model_stats(route, model)
+        if stats["samples"] < self.min_samples or stats["p95"] is None:
+            return cap
+        return min(stats["p95"], cap)
+
+    async def run_async(self, route, call, budget=None):
+        """
+        Runs `call(model)`, a coroutine function returning the result or None on failure, on
+        the best model for `route`. A failed attempt moves straight to the next tier; a slow
+        one (see hedge_delay) gets the next tier started alongside it. If the route can be
+        skipped, attempts still running at the end of the budget are abandoned. Abandoned
+        attempts count as calls that took at least as long as they ran, so a model that keeps
+        losing to its hedge drops out of the plan.
+        Returns (result, model), or (None, None) if nothing answered or the call was skipped.
+        """
+        budget = budget or self.budgets[route]
+        deadline = time.monotonic() + budget
+        plan = self.plan(route)
+        running = {}  # task -> (model, start time)
+        launched = []  # models in launch order
+
+        def can_launch():
+            return len(launched) < len(plan) and plan[len(launched)] is not None
+
+        def launch():
+            model = plan[len(launched)]
+            launched.append(model)
+            running[asyncio.ensure_future(call(model))] = (model, time.monotonic())
+
+        try:
+            if can_launch():
+                launch()
+            elif plan:
+                print(f"Skipping {route}: every model is failing or over its {budget}s budget.")
+            while running:
+                now = time.monotonic()
+                if can_launch():
+                    model, started = list(running.values())[-1]
+                    timeout = min(started + self.hedge_delay(route, model), deadline) - now
+                elif self.can_skip(route):
+                    timeout = deadline - now
+                else:
+                    timeout = None
+                done, _ = await asyncio.wait(running, timeout=None if timeout is None else max(0.0, timeout),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    model, _ = running.pop(task)
+                    result = None if task.cancelled() or task.exception() else task.result()
+                    if result is not None:
+                        if model != self.tiers[route][0]:
+                            print(f"{route} answered by fallback model {model}.")
+                        return result, model
+                if done:
+                    if not running and can_launch():
+                        launch()  # Failed: go to the next tier right away
+                    continue
+                if can_launch():
+                    print(f"{route} on {launched[-1]} is slow; hedging with {plan[len(launched)]}.")
+                    launch()
+                elif self.can_skip(route):
+                    print(f"{route} missed its {budget}s budget; skipping it.")
+                    break
+            return None, None
+        finally:
+            now = time.monotonic()
+            for task, (model, started) in running.items():
+                task.cancel()
+                self.record(route, model, now - started)
+            await asyncio.gather(*running, return_exceptions=True)
+
+    def snapshot(self):
+        """Samples inside the window as [route, model, [[time, seconds, ok], ...]] (see restore)."""
+        cutoff = time.time() - self.window
+        with self._lock:
+            return [
+                [route, model, [list(sample) for sample in samples if sample[0] >= cutoff]]
+                for (route, model), samples in self._samples.items()
+            ]
+
+    def restore(self, state):
+        """Adds samples from snapshot(), e.g. those of the previous one-shot run."""
+        cutoff = time.time() - self.window
+        with self._lock:
+            for route, model, samples in state:
+                self._samples[(route, model)].extend(tuple(sample) for sample in samples if sample[0] >= cutoff)
+
+    def stats(self):
+        """Recent stats for every configured model, by route."""
+        return {
+            route: {model: self.model_stats(route, model) for model in tiers if model}
+            for route, tiers in self.tiers.items()
+        }
+
+
+# Shared router, fed by every observed call
+router = ModelRouter()
+metrics.add_listener(router.observe)
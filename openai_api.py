@@ -1,62 +1,403 @@
-import requests
-import openai
-from config import OPENAI_API_KEY
+import hashlib
+import json
+import re
+import config
+import image_prep
+import metrics
+import model_router
+import transport
+from cache import TTLCache
+from persona import DEFAULT_PERSONA
 
-# Set OpenAI API key
-openai.api_key = OPENAI_API_KEY
+# System prompt of the default persona; tweet generation can pass another persona's prompt
+SYSTEM_PROMPT = DEFAULT_PERSONA.system_prompt
+
+# Preferred models; each call picks its model from the tiers in model_router
+TEXT_MODEL = model_router.MODEL_TIERS["text"][0]
+VISION_MODEL = model_router.MODEL_TIERS["vision"][0]
+
+CLASSIFIER_SYSTEM_PROMPT = (
+    "You triage tweets for a witty finance and meme commentary account. "
+    "Always answer with a single valid JSON object and nothing else."
+)
+
+IMAGE_SYSTEM_PROMPT = "Analyze the image and provide a description and relevant insights on how this is relevant today."
+
+# Character budget for generated tweets; matches the hard limit applied in x_poster
+TWEET_CHAR_BUDGET = 270
+
+# Length the tweet prompts ask for; a stream stops at the first sentence end past it
+TWEET_CHAR_TARGET = getattr(config, "TWEET_CHAR_TARGET", 180)
+
+# Sentence ends (., !, ? optionally followed by closing quotes/brackets) and then whitespace or the end of the text
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*(?=\s|$)")
+
+# Image analysis cache shared by x_poster and main, keyed by URL and by a hash of the image bytes.
+# Set IMAGE_CACHE_PATH in config to persist results across restarts.
+image_cache = TTLCache(
+    maxsize=getattr(config, "IMAGE_CACHE_MAX_ITEMS", 512),
+    ttl=getattr(config, "IMAGE_CACHE_TTL", 24 * 3600),
+    path=getattr(config, "IMAGE_CACHE_PATH", None),
+    table="image_analysis",
+)
+
+
+def _url_key(image_url):
+    return f"url:{image_url}"
+
+
+def _content_key(image_bytes):
+    return f"sha256:{hashlib.sha256(image_bytes).hexdigest()}"
+
+
+def _cache_image_analysis(image_url, image_bytes, description):
+    """Stores an analysis under both the URL and the image content hash."""
+    image_cache.set(_url_key(image_url), description)
+    image_cache.set(_content_key(image_bytes), description)
+
+
+def _text_messages(prompt, system_prompt=SYSTEM_PROMPT):
+    """Builds the chat messages for a text analysis/generation prompt."""
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _image_messages(data_url, detail=image_prep.IMAGE_DETAIL):
+    """Builds the chat messages for an image analysis request with the image inlined as a data URL."""
+    return [
+        {"role": "system", "content": IMAGE_SYSTEM_PROMPT},
+        {"role": "user", "content": [
+            {"type": "image_url", "image_url": {"url": data_url, "detail": detail}}
+        ]},
+    ]
 
-import openai
 
 def analyze_with_openai(prompt):
     """
     Sends content to OpenAI for analysis or generation based on the provided prompt.
     """
     try:
-        response = openai.completions.create(
-            model="gpt-4o-mini",  # Correct model
-            messages=[{
-                "role": "system",
-                "content": (
-                    "Your mission is to spark debate by blending meme culture with biting wit and cleverness. "
-                    "You’re a dog who acts silly but drops unexpectedly brilliant takes. You take a definitive stance "
-                    "on topics, and don't mind hurting feelings in your pursuit of uncovering the truth."
-                )
-            }, {
-                "role": "user",
-                "content": prompt
-            }]
-        )
-        
+        model = model_router.router.choose("text")
+        with metrics.observe("analyze_with_openai", model) as span:
+            response = transport.call(
+                "openai",
+                transport.get_openai_client().chat.completions.create,
+                model=model,
+                messages=_text_messages(prompt)
+            )
+            span.record_usage(response)
+
         # Extract the completion message from the response
-        return response['choices'][0]['message']['content'].strip()
-    
+        return response.choices[0].message.content.strip()
+
     except Exception as e:
         print(f"Error with OpenAI analysis: {e}")
         return None
 
+
 def analyze_image_with_openai(image_url):
     """
     Analyzes an image from a URL using OpenAI's image analysis capabilities.
+    Results are served from image_cache when the URL or the image bytes were seen before.
     """
     try:
-        # Step 1: Download the image from the provided URL
-        response = requests.get(image_url)
-        if response.status_code != 200:
-            print(f"Failed to download image from {image_url}")
-            return None
-        
-        # Step 2: Send the image to OpenAI for analysis without saving it locally
-        image_analysis = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "Analyze the image and provide a description and relevant insights on how this is relevant today."},
-                {"role": "user", "content": response.content}  # Pass the image content directly
-            ]
-        )
+        cached = image_cache.get(_url_key(image_url))
+        if cached:
+            return cached
+
+        # Step 1: Stream the image download with a byte cap and content-type check
+        image_bytes, content_type = image_prep.fetch_image(image_url)
+
+        # The same image is often re-hosted under a different URL
+        cached = image_cache.get(_content_key(image_bytes))
+        if cached:
+            image_cache.set(_url_key(image_url), cached)
+            return cached
+
+        # Step 2: Downscale to the model's useful resolution and send it for analysis
+        data_url = image_prep.prepare_for_vision(image_bytes, content_type)
+        model = model_router.router.choose("vision")
+        with metrics.observe("analyze_image_with_openai", model) as span:
+            image_analysis = transport.call(
+                "openai",
+                transport.get_openai_client().chat.completions.create,
+                model=model,
+                messages=_image_messages(data_url)
+            )
+            span.record_usage(image_analysis)
+
+        # Cache and return the analysis result
+        description = image_analysis.choices[0].message.content.strip()
+        _cache_image_analysis(image_url, image_bytes, description)
+        return description
 
-        # Return the analysis result
-        return image_analysis
+    except Exception as e:
+        print(f"Error analyzing image: {e}")
+        return None
+
+
+async def analyze_with_openai_async(prompt):
+    """
+    Async counterpart of analyze_with_openai, built on the AsyncOpenAI client. Slow or
+    failing calls are hedged or retried on the next "text" tier (see model_router).
+    """
+    result, _ = await model_router.router.run_async("text", lambda model: _analyze_with_model_async(prompt, model))
+    return result
+
+
+async def _analyze_with_model_async(prompt, model):
+    try:
+        with metrics.observe("analyze_with_openai", model) as span:
+            response = await transport.call_async(
+                "openai",
+                transport.get_async_openai_client().chat.completions.create,
+                model=model,
+                messages=_text_messages(prompt)
+            )
+            span.record_usage(response)
+        return response.choices[0].message.content.strip()
+
+    except Exception as e:
+        print(f"Error with OpenAI analysis: {e}")
+        return None
+
+
+async def analyze_image_with_openai_async(image_url):
+    """
+    Async counterpart of analyze_image_with_openai. Several images can be analyzed
+    concurrently by gathering calls to this coroutine. The vision call is hedged or retried
+    on the next "vision" tier when it's slow or fails (see model_router).
+    """
+    try:
+        cached = image_cache.get(_url_key(image_url))
+        if cached:
+            return cached
+
+        image_bytes, content_type = await image_prep.fetch_image_async(image_url)
+
+        cached = image_cache.get(_content_key(image_bytes))
+        if cached:
+            image_cache.set(_url_key(image_url), cached)
+            return cached
+
+        data_url = await image_prep.prepare_for_vision_async(image_bytes, content_type)
+        description, _ = await model_router.router.run_async(
+            "vision", lambda model: _describe_image_async(data_url, model)
+        )
+        if description:
+            _cache_image_analysis(image_url, image_bytes, description)
+        return description
 
     except Exception as e:
         print(f"Error analyzing image: {e}")
         return None
+
+
+async def _describe_image_async(data_url, model):
+    try:
+        with metrics.observe("analyze_image_with_openai", model) as span:
+            image_analysis = await transport.call_async(
+                "openai",
+                transport.get_async_openai_client().chat.completions.create,
+                model=model,
+                messages=_image_messages(data_url)
+            )
+            span.record_usage(image_analysis)
+        return image_analysis.choices[0].message.content.strip()
+
+    except Exception as e:
+        print(f"Error analyzing image with {model}: {e}")
+        return None
+
+
+def _parse_json_object(content):
+    """Parses a JSON object from a model reply, tolerating a surrounding code fence."""
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip("`").split("\n", 1)[-1]
+    return json.loads(content)
+
+
+def analyze_with_openai_json(prompt, stage="classify_candidates"):
+    """
+    Sends a prompt in JSON mode and returns the parsed JSON object, or None on failure.
+    """
+    try:
+        model = model_router.router.choose("text")
+        with metrics.observe(stage, model) as span:
+            response = transport.call(
+                "openai",
+                transport.get_openai_client().chat.completions.create,
+                model=model,
+                messages=_text_messages(prompt, CLASSIFIER_SYSTEM_PROMPT),
+                response_format={"type": "json_object"}
+            )
+            span.record_usage(response)
+        return _parse_json_object(response.choices[0].message.content)
+
+    except Exception as e:
+        print(f"Error with OpenAI JSON analysis: {e}")
+        return None
+
+
+async def analyze_with_openai_json_async(prompt, stage="classify_candidates"):
+    """Async counterpart of analyze_with_openai_json, routed like analyze_with_openai_async."""
+    result, _ = await model_router.router.run_async("text", lambda model: _analyze_json_async(prompt, stage, model))
+    return result
+
+
+async def _analyze_json_async(prompt, stage, model):
+    try:
+        with metrics.observe(stage, model) as span:
+            response = await transport.call_async(
+                "openai",
+                transport.get_async_openai_client().chat.completions.create,
+                model=model,
+                messages=_text_messages(prompt, CLASSIFIER_SYSTEM_PROMPT),
+                response_format={"type": "json_object"}
+            )
+            span.record_usage(response)
+        return _parse_json_object(response.choices[0].message.content)
+
+    except Exception as e:
+        print(f"Error with OpenAI JSON analysis: {e}")
+        return None
+
+
+def _max_tokens_for(char_budget):
+    """Upper bound on completion tokens for a character budget (~4 chars per token, with headroom)."""
+    return max(16, char_budget // 2)
+
+
+def _stop_point(text, char_budget):
+    """
+    Where to end the streamed text, or None to keep reading: the first finished sentence
+    past the target length, or the whole text once it is over budget or the model has
+    finished its first paragraph (trim_to_budget cuts it down from there).
+    """
+    target = min(TWEET_CHAR_TARGET, char_budget)
+    for match in _SENTENCE_END.finditer(text):
+        # Wait for the following whitespace so "3." in "3.5%" isn't taken for a sentence end
+        if match.end() >= target and match.end() < len(text):
+            return match.end()
+    if len(text) > char_budget or "\n\n" in text.lstrip():
+        return len(text)
+    return None
+
+
+def trim_to_budget(text, char_budget=TWEET_CHAR_BUDGET):
+    """
+    Trims generated text to `char_budget` characters, preferring to cut at the last
+    sentence boundary (or word boundary) rather than mid-word. Anything after the first
+    blank line is dropped.
+    """
+    text = text.strip().split("\n\n", 1)[0].strip()
+    if len(text) <= char_budget:
+        return text
+
+    head = text[:char_budget]
+    sentence_ends = [match.end() for match in _SENTENCE_END.finditer(head)]
+    if sentence_ends and sentence_ends[-1] >= char_budget // 2:
+        return head[:sentence_ends[-1]].strip()
+    if " " in head:
+        return head.rsplit(" ", 1)[0].strip()
+    return head
+
+
+def stream_with_openai(prompt, char_budget=TWEET_CHAR_BUDGET, system_prompt=SYSTEM_PROMPT):
+    """
+    Streams a completion for the prompt, yielding text chunks as they arrive. The stream is
+    closed as soon as a sentence ends past TWEET_CHAR_TARGET, the output passes `char_budget`
+    characters or the first paragraph ends, so we stop paying for tokens that would be cut
+    off anyway. Streams aren't hedged; the model is simply the current "text" choice (see
+    model_router).
+    """
+    model = model_router.router.choose("text")
+    with metrics.observe("analyze_with_openai", model) as span:
+        stream = transport.call(
+            "openai",
+            transport.get_openai_client().chat.completions.create,
+            model=model,
+            messages=_text_messages(prompt, system_prompt),
+            max_tokens=_max_tokens_for(char_budget),
+            stream=True,
+        )
+        text = ""
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                text += delta
+                stop = _stop_point(text, char_budget)
+                if stop is not None:
+                    # Drop whatever of the next sentence arrived with this chunk
+                    delta = delta[:len(delta) - (len(text) - stop)]
+                    text = text[:stop]
+                if delta:
+                    yield delta
+                if stop is not None:
+                    break
+        finally:
+            stream.close()
+            # Streams cut off early never report usage
+            span.estimate_usage(system_prompt + prompt, text)
+
+
+async def stream_with_openai_async(prompt, char_budget=TWEET_CHAR_BUDGET, system_prompt=SYSTEM_PROMPT):
+    """Async counterpart of stream_with_openai."""
+    model = model_router.router.choose("text")
+    with metrics.observe("analyze_with_openai", model) as span:
+        stream = await transport.call_async(
+            "openai",
+            transport.get_async_openai_client().chat.completions.create,
+            model=model,
+            messages=_text_messages(prompt, system_prompt),
+            max_tokens=_max_tokens_for(char_budget),
+            stream=True,
+        )
+        text = ""
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                text += delta
+                stop = _stop_point(text, char_budget)
+                if stop is not None:
+                    # Drop whatever of the next sentence arrived with this chunk
+                    delta = delta[:len(delta) - (len(text) - stop)]
+                    text = text[:stop]
+                if delta:
+                    yield delta
+                if stop is not None:
+                    break
+        finally:
+            await stream.close()
+            span.estimate_usage(system_prompt + prompt, text)
+
+
+def generate_with_openai_streaming(prompt, char_budget=TWEET_CHAR_BUDGET, system_prompt=SYSTEM_PROMPT):
+    """
+    Generates text for the prompt in streaming mode with an early cutoff, returning the
+    result trimmed to `char_budget` characters.
+    """
+    try:
+        text = trim_to_budget("".join(stream_with_openai(prompt, char_budget, system_prompt)), char_budget)
+        return text or None
+    except Exception as e:
+        print(f"Error with OpenAI streaming generation: {e}")
+        return None
+
+
+async def generate_with_openai_streaming_async(prompt, char_budget=TWEET_CHAR_BUDGET, system_prompt=SYSTEM_PROMPT):
+    """Async counterpart of generate_with_openai_streaming."""
+    try:
+        chunks = [chunk async for chunk in stream_with_openai_async(prompt, char_budget, system_prompt)]
+        text = trim_to_budget("".join(chunks), char_budget)
+        return text or None
+    except Exception as e:
+        print(f"Error with OpenAI streaming generation: {e}")
+        return None
@@ -0,0 +1,294 @@
+import asyncio
+import random
+import sqlite3
+import threading
+import time
+import config
+
+# X write limit enforced by the poster: at most POST_LIMIT posts per POST_WINDOW seconds
+POST_LIMIT = getattr(config, "X_POST_LIMIT", 100)
+POST_WINDOW = getattr(config, "X_POST_WINDOW", 24 * 3600)
+
+# Retry schedule for failed posts (full-jitter exponential backoff, in seconds)
+MAX_ATTEMPTS = getattr(config, "OUTBOX_MAX_ATTEMPTS", 5)
+BACKOFF_BASE = 30
+BACKOFF_MAX = 3600
+
+
+class Outbox:
+    """
+    Durable queue of generated tweets waiting to be posted.
+
+    Rows are keyed by (source tweet ID, posting method), so the same response is never
+    queued twice. A claimed row is leased for `lease_timeout` seconds; if the process dies
+    mid-post, the row becomes claimable again once the lease runs out. A repeat post after
+    such a crash is rejected by X as duplicate content, which the worker treats as sent.
+
+    Row status: pending -> sending -> sent, or back to pending with a backoff, or failed
+    once `max_attempts` is used up or the error isn't worth retrying. A post put off by a
+    rate limit goes back to pending without using up an attempt.
+    """
+
+    def __init__(self, path=None, max_attempts=MAX_ATTEMPTS, lease_timeout=300):
+        self.path = path or getattr(config, "OUTBOX_PATH", "outbox.db")
+        self.max_attempts = max_attempts
+        self.lease_timeout = lease_timeout
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                source_id TEXT,
+                method TEXT NOT NULL,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                posted_id TEXT,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+        self._db.commit()
+
+    @staticmethod
+    def idempotency_key(source_id, method):
+        return f"{source_id}:{method}"
+
+    def enqueue(self, source_id, method, text):
+        """Queues a generated tweet. Returns False if a response with the same key was already queued."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, source_id, method, text, next_attempt_at, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.idempotency_key(source_id, method), source_id, method, text, now, now, now),
+            )
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def claim(self, limit=1):
+        """
+        Leases up to `limit` due rows for posting and returns them as dicts
+        (id, source_id, method, text, attempts). Expired leases are reclaimed.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, source_id, method, text, attempts FROM outbox "
+                "WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND next_attempt_at <= ?) "
+                "ORDER BY next_attempt_at, id LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            for row in rows:
+                self._db.execute(
+                    "UPDATE outbox SET status = 'sending', next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                    (now + self.lease_timeout, now, row[0]),
+                )
+            self._db.commit()
+        return [dict(zip(("id", "source_id", "method", "text", "attempts"), row)) for row in rows]
+
+    def mark_sent(self, row_id, posted_id=None):
+        """Records a successful post."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = 'sent', posted_id = ?, attempts = attempts + 1, last_error = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (None if posted_id is None else str(posted_id), now, row_id),
+            )
+            self._db.commit()
+
+    def mark_failed(self, row_id, error, retryable=True, retry_at=None):
+        """
+        Records a failed attempt. Retryable failures go back to pending with a jittered
+        exponential backoff (or at `retry_at`); others, and rows that ran out of attempts,
+        are marked failed. Returns the new status.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT attempts FROM outbox WHERE id = ?", (row_id,)).fetchone()
+            if row is None:
+                return None
+            attempts = row[0] + 1
+            if retryable and attempts < self.max_attempts:
+                status = "pending"
+                if retry_at is None:
+                    retry_at = now + random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)))
+            else:
+                status, retry_at = "failed", now
+            self._db.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+                "WHERE id = ?",
+                (status, attempts, retry_at, str(error)[:500], now, row_id),
+            )
+            self._db.commit()
+            return status
+
+    def defer(self, row_id, reason, retry_at=None):
+        """
+        Puts a row the rate limit kept from being posted back to pending until `retry_at`
+        (BACKOFF_BASE from now if unknown). Nothing was attempted, so attempts stay as they are.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = 'pending', next_attempt_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                (now + BACKOFF_BASE if retry_at is None else retry_at, str(reason)[:500], now, row_id),
+            )
+            self._db.commit()
+
+    def next_slot(self, limit=POST_LIMIT, window=POST_WINDOW):
+        """Earliest time another post fits in the write limit (now, if under the limit)."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT updated_at FROM outbox WHERE status = 'sent' AND updated_at >= ? "
+                "ORDER BY updated_at DESC LIMIT 1 OFFSET ?",
+                (now - window, limit - 1),
+            ).fetchone()
+        return now if row is None else row[0] + window
+
+    def next_due(self):
+        """Time the next pending or leased row becomes claimable, or None if nothing is queued."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status IN ('pending', 'sending')"
+            ).fetchone()
+        return row[0]
+
+    def recent(self, since):
+        """(idempotency key, text, created_at) of rows queued or posted since `since`, oldest first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT idempotency_key, text, created_at FROM outbox WHERE status != 'failed' AND created_at >= ? "
+                "ORDER BY created_at",
+                (since,),
+            ).fetchall()
+
+    def stats(self):
+        """Row counts per status."""
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def __len__(self):
+        """Rows still waiting to be posted."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')"
+            ).fetchone()[0]
+
+
+class OutboxWorker:
+    """
+    Drains an Outbox on a background thread with its own event loop, so generation never
+    waits on posting. `publish(method, source_id, text)` must return the new post's ID and
+    raise on failure; `classify_error(exc)` maps an exception to (outcome, retry_at), where
+    outcome is "sent" (e.g. duplicate content), "defer" (rate-limited, not counted as an
+    attempt), "retry" or "fail".
+    """
+
+    def __init__(self, outbox, publish, classify_error=None, limit=POST_LIMIT, window=POST_WINDOW,
+                 poll_interval=30):
+        self.outbox = outbox
+        self.publish = publish
+        self.classify_error = classify_error or (lambda exc: ("retry", None))
+        self.limit = limit
+        self.window = window
+        self.poll_interval = poll_interval
+        self._loop = None
+        self._wake = None
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._wake = asyncio.Event()
+        self._thread = threading.Thread(target=self._loop.run_until_complete, args=(self.run(),),
+                                        daemon=True, name="outbox-worker")
+        self._thread.start()
+        return self
+
+    def notify(self):
+        """Wakes the worker early, e.g. right after enqueueing."""
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def stop(self, timeout=None):
+        self._stopping = True
+        self.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    async def _sleep(self, seconds):
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, seconds))
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def run(self):
+        throttled_until = None
+        while not self._stopping:
+            due = self.outbox.next_due()
+            if due is None or due > time.time():
+                await self._sleep(self.poll_interval if due is None else min(due - time.time(), self.poll_interval))
+                continue
+
+            # Respect the X write limit before claiming anything
+            slot = self.outbox.next_slot(self.limit, self.window)
+            if slot > time.time():
+                if slot != throttled_until:
+                    print(f"Post limit of {self.limit} per {self.window}s reached; next post in {slot - time.time():.0f}s.")
+                    throttled_until = slot
+                await self._sleep(min(slot - time.time(), self.poll_interval))
+                continue
+
+            for row in self.outbox.claim():
+                await self.post(row)
+
+    async def drain(self):
+        """
+        Posts the rows that are due now, within the write limit, and returns the number of
+        posts attempted. For one-shot runs, which have no background worker.
+        """
+        attempted = 0
+        while True:
+            due = self.outbox.next_due()
+            if due is None or due > time.time():
+                return attempted
+            slot = self.outbox.next_slot(self.limit, self.window)
+            if slot > time.time():
+                print(f"Post limit of {self.limit} per {self.window}s reached; next post in {slot - time.time():.0f}s.")
+                return attempted
+            rows = self.outbox.claim()
+            if not rows:
+                return attempted
+            for row in rows:
+                await self.post(row)
+                attempted += 1
+
+    async def post(self, row):
+        """Posts one claimed row and records the outcome."""
+        try:
+            posted_id = await asyncio.to_thread(self.publish, row["method"], row["source_id"], row["text"])
+        except Exception as e:
+            outcome, retry_at = self.classify_error(e)
+            if outcome == "sent":
+                print(f"Outbox item {row['id']} was already posted: {e}")
+                self.outbox.mark_sent(row["id"])
+                return
+            if outcome == "defer":
+                self.outbox.defer(row["id"], e, retry_at)
+                print(f"Deferred outbox item {row['id']}: {e}")
+                return
+            status = self.outbox.mark_failed(row["id"], e, retryable=outcome == "retry", retry_at=retry_at)
+            print(f"Failed to post outbox item {row['id']} ({row['method']} to {row['source_id']}): {e}; now {status}.")
+            return
+        self.outbox.mark_sent(row["id"], posted_id)
+        print(f"Posted outbox item {row['id']} as {posted_id}.")
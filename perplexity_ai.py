@@ -1,54 +1,191 @@
-import openai  # Explicitly import the openai library
-from openai import OpenAI  # Also import OpenAI client
+import re
+import threading
+import unicodedata
 import config  # Assuming you're using a config file for the API keys
+import metrics
+import model_router
+import transport
+from cache import TTLCache, SingleFlight, AsyncSingleFlight
+
+# Preferred research model; each request picks its model from the "research" tiers in model_router
+RESEARCH_MODEL = model_router.MODEL_TIERS["research"][0]
+
+# Returned instead of research when the router skips it to stay within the latency budget
+RESEARCH_SKIPPED = "No research available; rely on the original tweet."
+
+# Cap on the length of a research summary; only the compacted digest reaches the tweet prompt anyway
+RESEARCH_MAX_TOKENS = getattr(config, "RESEARCH_MAX_TOKENS", 800)
+
+# Words that don't change what a topic is about; dropped when normalizing cache keys
+_TOPIC_STOPWORDS = {
+    "a", "an", "the", "of", "on", "in", "to", "for", "and", "or", "is", "are", "was", "were",
+    "with", "about", "at", "by", "from", "as", "its", "it", "this", "that", "new", "breaking",
+}
+
+
+def normalize_topic(topic):
+    """
+    Normalizes a topic string into a research cache key so near-identical topics (case,
+    punctuation, filler words) land on the same entry. Words keep their order and any
+    script counts as words; a topic with nothing but filler words keys on its full text.
+    """
+    text = unicodedata.normalize("NFKC", topic).lower()
+    words = [word for word in re.findall(r"[\w$]+", text) if word not in _TOPIC_STOPWORDS]
+    return " ".join(words) or " ".join(text.split())
+
 
 class ResearchAssistant:
-    def __init__(self):
-        # Set the OpenAI API key
-        openai.api_key = config.OPENAI_API_KEY
-
-        # Initialize the Perplexity client
-        self.client = OpenAI(
-            api_key=config.PERPLEXITY_API_KEY,  # This is the Perplexity API key
-            base_url="https://api.perplexity.ai"  # Perplexity API base URL
+    def __init__(self, cache_ttl=None, cache=None):
+        """
+        :param cache_ttl: Seconds a research result stays cached (defaults to config.RESEARCH_CACHE_TTL or 15 minutes).
+        :param cache: Optional TTLCache to use instead of a private one, e.g. to share results between instances.
+        """
+        # Research cache with single-flight dedup of concurrent requests for the same topic
+        if cache_ttl is None:
+            cache_ttl = getattr(config, "RESEARCH_CACHE_TTL", 15 * 60)
+        self.cache = cache or TTLCache(
+            maxsize=getattr(config, "RESEARCH_CACHE_MAX_ITEMS", 256),
+            ttl=cache_ttl,
+            path=getattr(config, "RESEARCH_CACHE_PATH", None),
+            table="research",
         )
+        self._inflight = SingleFlight()
+        self._inflight_async = AsyncSingleFlight()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def client(self):
+        """Shared, pooled Perplexity client (OpenAI-compatible API), created on first use."""
+        return transport.get_perplexity_client()
 
-    def research_topic(self, topic):
+    @property
+    def async_client(self):
+        """Async Perplexity client bound to the running event loop."""
+        return transport.get_async_perplexity_client()
+
+    @staticmethod
+    def _build_messages(topic):
+        """Builds the conversation sent to Perplexity for a research request."""
+        return [
+            {
+                "role": "system",
+                "content": (
+                    "You are an artificial intelligence assistant tasked with providing a concise, detailed summary of any topic, prioritizing the latest relevant news or research available."
+                ),
+            },
+            {
+                "role": "user",
+                "content": f"Please provide concise, detailed research on this topic, designed to inform a person who will be writing a tweet on the topic, ensuring you consider the latest developments first: {topic}. \
+                Break down the analysis into the following subtopics, ensuring brevity and clarity: \
+                - Brief overview of the topic \
+                - Latest developments in the news \
+                - Financial/economic implications \
+                - Popular consensus \
+                - Key arguments for and against the consensus \
+                - Conclusion",
+            },
+        ]
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def cache_stats(self):
+        """Returns research cache hit/miss counts. `coalesced` counts callers that waited on an in-flight request."""
+        with self._stats_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "size": len(self.cache),
+            }
+
+    def research_topic(self, topic, max_tokens=RESEARCH_MAX_TOKENS):
         """
         Use OpenAI (via Perplexity API) to research a topic.
+        Results are cached per normalized topic, and concurrent callers asking for the
+        same topic share a single request.
         :param topic: The topic to research.
+        :param max_tokens: Cap on the summary's length in tokens (None for no cap).
         :return: The AI-generated research summary.
         """
+        key = normalize_topic(topic)
+        cached = self.cache.get(key)
+        if cached:
+            self._count("hits")
+            print(f"\n### Research cache hit: {topic} ###")
+            return cached
+
+        def fetch():
+            # Another caller may have filled the cache while we were waiting to lead
+            return self.cache.get(key) or self._research_and_cache(key, topic, max_tokens)
+
         try:
-            print(f"\n### Researching Topic: {topic} ###")
+            research_summary, shared = self._inflight.do(key, fetch)
+        except Exception as e:
+            print(f"Error while researching topic: {e}")
+            return None
+        if shared:
+            self._count("coalesced")
+        return research_summary
 
-            # Define the role and user input for the conversation
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an artificial intelligence assistant tasked with providing a concise, detailed summary of any topic, prioritizing the latest relevant news or research available."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": f"Please provide concise, detailed research on this topic, designed to inform a person who will be writing a tweet on the topic, ensuring you consider the latest developments first: {topic}. \
-                    Break down the analysis into the following subtopics, ensuring brevity and clarity: \
-                    - Brief overview of the topic \
-                    - Latest developments in the news \
-                    - Financial/economic implications \
-                    - Popular consensus \
-                    - Key arguments for and against the consensus \
-                    - Conclusion",
-                },
-            ]
+    async def research_topic_async(self, topic, max_tokens=RESEARCH_MAX_TOKENS):
+        """
+        Async counterpart of research_topic, built on the AsyncOpenAI client.
+        :param topic: The topic to research.
+        :param max_tokens: Cap on the summary's length in tokens (None for no cap).
+        :return: The AI-generated research summary.
+        """
+        key = normalize_topic(topic)
+        cached = self.cache.get(key)
+        if cached:
+            self._count("hits")
+            print(f"\n### Research cache hit: {topic} ###")
+            return cached
+
+        async def fetch():
+            return self.cache.get(key) or await self._research_and_cache_async(key, topic, max_tokens)
 
+        research_summary, shared = await self._inflight_async.do(key, fetch)
+        if shared:
+            self._count("coalesced")
+        return research_summary
+
+    def _research_and_cache(self, key, topic, max_tokens=RESEARCH_MAX_TOKENS):
+        self._count("misses")
+        research_summary = self._research_uncached(topic, max_tokens)
+        if research_summary and research_summary is not RESEARCH_SKIPPED:
+            self.cache.set(key, research_summary)
+        return research_summary
+
+    async def _research_and_cache_async(self, key, topic, max_tokens=RESEARCH_MAX_TOKENS):
+        self._count("misses")
+        research_summary = await self._research_uncached_async(topic, max_tokens)
+        if research_summary and research_summary is not RESEARCH_SKIPPED:
+            self.cache.set(key, research_summary)
+        return research_summary
+
+    def _research_uncached(self, topic, max_tokens=RESEARCH_MAX_TOKENS):
+        """Sends the research request to Perplexity, bypassing the cache."""
+        try:
+            model = model_router.router.choose("research")
+            if model is None:
+                return RESEARCH_SKIPPED
+            print(f"\n### Researching Topic: {topic} ###")
 
             # Send the request to the Perplexity API using the OpenAI client
-            response = self.client.chat.completions.create(
-                model="llama-3.1-sonar-large-128k-online",  # OpenAI GPT model or the desired model
-                messages=messages,
-            )
+            with metrics.observe("research_topic", model) as span:
+                response = transport.call(
+                    "perplexity",
+                    self.client.chat.completions.create,
+                    model=model,
+                    messages=self._build_messages(topic),
+                    **({"max_tokens": max_tokens} if max_tokens else {}),
+                )
+                span.record_usage(response)
 
             # Correct way to access the message content
             research_summary = response.choices[0].message.content  # Accessing the content properly
@@ -58,3 +195,33 @@ class ResearchAssistant:
         except Exception as e:
             print(f"Error while researching topic: {e}")
             return None
+
+    async def _research_uncached_async(self, topic, max_tokens=RESEARCH_MAX_TOKENS):
+        """
+        Async counterpart of _research_uncached. A slow or failing research model is hedged
+        or replaced by the next "research" tier, down to skipping research (see model_router).
+        """
+        print(f"\n### Researching Topic: {topic} ###")
+        research_summary, _ = await model_router.router.run_async(
+            "research", lambda model: self._research_with_model_async(topic, model, max_tokens)
+        )
+        if research_summary is None and model_router.router.can_skip("research"):
+            return RESEARCH_SKIPPED
+        return research_summary
+
+    async def _research_with_model_async(self, topic, model, max_tokens=RESEARCH_MAX_TOKENS):
+        try:
+            with metrics.observe("research_topic", model) as span:
+                response = await transport.call_async(
+                    "perplexity",
+                    self.async_client.chat.completions.create,
+                    model=model,
+                    messages=self._build_messages(topic),
+                    **({"max_tokens": max_tokens} if max_tokens else {}),
+                )
+                span.record_usage(response)
+            return response.choices[0].message.content
+
+        except Exception as e:
+            print(f"Error while researching topic with {model}: {e}")
+            return None
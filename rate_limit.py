@@ -0,0 +1,193 @@
+import re
+import threading
+import time
+import config
+
+# Default X API limits per endpoint as (requests, window in seconds). They only seed the
+# buckets: the x-rate-limit-* headers of each response replace them with the real values.
+# Override with config.X_RATE_LIMITS, e.g. {"list_tweets": (900, 900)}.
+DEFAULT_LIMITS = {
+    "list_tweets": (75, 15 * 60),
+    "create_tweet": (100, 24 * 3600),
+}
+DEFAULT_LIMITS.update(getattr(config, "X_RATE_LIMITS", {}))
+
+# (method, path pattern) -> endpoint name; the path is matched anywhere in the URL so
+# rewritten base URLs (e.g. the benchmark stubs) resolve to the same endpoint
+_ENDPOINTS = [
+    ("GET", re.compile(r"/2/lists/[^/]+/tweets"), "list_tweets"),
+    ("POST", re.compile(r"/2/tweets/?(?:\?|$)"), "create_tweet"),
+]
+
+
+class RateLimited(Exception):
+    """Raised when a call is deferred because its endpoint has no budget left; `retry_at` is when it will."""
+
+    def __init__(self, endpoint, retry_at):
+        super().__init__(f"Rate limit for {endpoint} reached; retry in {max(0.0, retry_at - time.time()):.0f}s")
+        self.endpoint = endpoint
+        self.retry_at = retry_at
+
+
+class TokenBucket:
+    """
+    Token bucket for one endpoint: `limit` calls per `window` seconds, refilled continuously
+    so calls are spread over the window instead of bursting at its start. Server-reported
+    limits (observe) take precedence: when the server says nothing is left, the bucket stays
+    empty until the reported reset time.
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.tokens = float(limit)
+        self.updated = time.time()
+        self.blocked_until = 0.0
+
+    @property
+    def rate(self):
+        return self.limit / self.window
+
+    def _refill(self, now):
+        if now < self.blocked_until:
+            self.updated = now
+            return
+        if self.blocked_until:
+            # The server's window has reset
+            self.tokens = float(self.limit)
+            self.blocked_until = 0.0
+        self.tokens = min(float(self.limit), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now, n=1):
+        """Seconds until `n` tokens are available (0 if they are now)."""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return max(0.0, (n - self.tokens) / self.rate)
+
+    def take(self, now, n=1):
+        self._refill(now)
+        self.tokens -= n
+
+    def observe(self, limit, remaining, reset_at, now):
+        """Aligns the bucket with the x-rate-limit-limit/-remaining/-reset headers."""
+        self._refill(now)
+        if limit:
+            self.limit = limit
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+            if remaining <= 0 and reset_at and reset_at > now:
+                self.blocked_until = reset_at
+
+
+class RateLimitGovernor:
+    """
+    Per-endpoint token buckets for the X API. Callers check before calling and skip or
+    defer when there's no budget, instead of sleeping inside tweepy:
+
+        if not governor.try_acquire("list_tweets"):
+            return []  # try again next cycle
+
+    Attach `observe_response` as a requests response hook so every response's
+    x-rate-limit-* headers keep the buckets in line with the server's view.
+    """
+
+    def __init__(self, limits=None):
+        self._lock = threading.Lock()
+        self.buckets = {name: TokenBucket(limit, window) for name, (limit, window) in (limits or DEFAULT_LIMITS).items()}
+
+    def _bucket(self, endpoint):
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            # Unknown endpoints start with a generous default until their headers are seen
+            bucket = self.buckets[endpoint] = TokenBucket(900, 15 * 60)
+        return bucket
+
+    def try_acquire(self, endpoint, n=1):
+        """Takes `n` calls' worth of budget if available now. Returns False (taking nothing) otherwise."""
+        now = time.time()
+        with self._lock:
+            bucket = self._bucket(endpoint)
+            if bucket.wait_time(now, n) > 0:
+                return False
+            bucket.take(now, n)
+            return True
+
+    def wait_time(self, endpoint, n=1):
+        """Seconds until `n` calls to the endpoint fit in its budget."""
+        now = time.time()
+        with self._lock:
+            return self._bucket(endpoint).wait_time(now, n)
+
+    def acquire_or_raise(self, endpoint, n=1):
+        """try_acquire that raises RateLimited (with the time to retry) instead of returning False."""
+        if not self.try_acquire(endpoint, n):
+            raise RateLimited(endpoint, time.time() + self.wait_time(endpoint, n))
+
+    def observe(self, endpoint, headers):
+        """Updates an endpoint's bucket from x-rate-limit-* response headers (no-op without them)."""
+        try:
+            limit = int(headers["x-rate-limit-limit"]) if "x-rate-limit-limit" in headers else None
+            remaining = int(headers["x-rate-limit-remaining"]) if "x-rate-limit-remaining" in headers else None
+            reset_at = float(headers["x-rate-limit-reset"]) if "x-rate-limit-reset" in headers else None
+        except (TypeError, ValueError):
+            return
+        if limit is None and remaining is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._bucket(endpoint).observe(limit, remaining, reset_at, now)
+
+    def observe_response(self, response, *args, **kwargs):
+        """requests response hook: session.hooks["response"].append(governor.observe_response)."""
+        endpoint = endpoint_for(response.request.method, response.url)
+        if endpoint:
+            self.observe(endpoint, response.headers)
+        return response
+
+    def snapshot(self):
+        """Bucket state per endpoint, including budgets learned from response headers."""
+        with self._lock:
+            return {
+                name: {"limit": bucket.limit, "window": bucket.window, "tokens": bucket.tokens,
+                       "updated": bucket.updated, "blocked_until": bucket.blocked_until}
+                for name, bucket in self.buckets.items()
+            }
+
+    def restore(self, state):
+        """Loads bucket state from snapshot(); tokens keep refilling from the saved time."""
+        with self._lock:
+            for name, saved in state.items():
+                bucket = self._bucket(name)
+                bucket.limit = saved["limit"]
+                bucket.window = saved["window"]
+                bucket.tokens = saved["tokens"]
+                bucket.updated = saved["updated"]
+                bucket.blocked_until = saved["blocked_until"]
+
+    def stats(self):
+        """Current budget per endpoint."""
+        now = time.time()
+        with self._lock:
+            return {
+                name: {
+                    "limit": bucket.limit,
+                    "window": bucket.window,
+                    "available": round(max(0.0, bucket.tokens), 2),
+                    "wait_s": round(bucket.wait_time(now), 1),
+                }
+                for name, bucket in self.buckets.items()
+            }
+
+
+def endpoint_for(method, url):
+    """Maps an X API request to its rate-limit endpoint name, or None if it isn't tracked."""
+    for endpoint_method, pattern, name in _ENDPOINTS:
+        if method.upper() == endpoint_method and pattern.search(url):
+            return name
+    return None
+
+
+# Shared governor for the X client
+governor = RateLimitGovernor()
@@ -1,11 +1,150 @@
-import praw
+import heapq
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from praw.models import MoreComments
 from config import REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET, REDDIT_USER_AGENT
+from seen_store import seen_items
+import dedup
+import transport
+
+# Namespace for submission IDs in the shared seen-item store
+SEEN_NAMESPACE = "reddit"
+
+# Maximum number of subreddits scanned at the same time
+MAX_WORKERS = 8
+
+# PRAW instances aren't thread-safe, so each worker thread gets its own client; they all
+# share the transport layer's keep-alive session so connections are pooled across threads and calls.
+_local = threading.local()
+
+
+def get_reddit():
+    """Returns the calling thread's reusable praw.Reddit client, creating it on first use."""
+    reddit = getattr(_local, "reddit", None)
+    if reddit is None:
+        import praw  # Imported on first use: praw is slow to import and only needed for Reddit
+        reddit = praw.Reddit(
+            client_id=REDDIT_CLIENT_ID,
+            client_secret=REDDIT_CLIENT_SECRET,
+            user_agent=REDDIT_USER_AGENT,
+            requestor_kwargs={"session": transport.get_requests_session("reddit")},
+            timeout=transport.settings("reddit")["read"],
+        )
+        _local.reddit = reddit
+    return reddit
+
+
+def _eligible_submissions(subreddit_name, earliest_timestamp, n):
+    """Scans a subreddit's newest posts and returns the `n` unseen ones with the most comments."""
+    subreddit = get_reddit().subreddit(subreddit_name)
+
+    def eligible():
+        for submission in subreddit.new(limit=500):  # Fetch a large number of recent posts
+            if datetime.utcfromtimestamp(submission.created_utc) < earliest_timestamp:
+                break  # Stop fetching once we're past the desired time range
+            # Skip already-analyzed posts
+            if not seen_items.seen(SEEN_NAMESPACE, submission.id):
+                yield submission
+
+    return heapq.nlargest(n, eligible(), key=lambda s: s.num_comments)
+
+
+def _post_details(submission_id, num_comments_to_fetch):
+    """Loads a single submission with its top comments and builds its post data."""
+    from praw.models import MoreComments
+    # Re-open the submission on this thread's client; one request returns the post and
+    # the top of its comment tree.
+    submission = get_reddit().submission(id=submission_id)
+    submission.comment_sort = "top"
+    submission.comment_limit = num_comments_to_fetch
+    submission.comments.replace_more(limit=0)
+
+    top_level = (comment for comment in submission.comments if not isinstance(comment, MoreComments))
+    top_comments = []
+    for comment in heapq.nlargest(num_comments_to_fetch, top_level, key=lambda c: c.score):
+        replies = heapq.nlargest(num_comments_to_fetch,
+                                 comment.replies,
+                                 key=lambda r: r.score if hasattr(r, 'score') else 0)
+        top_comments.append({
+            "author": str(comment.author),
+            "body": comment.body,
+            "score": comment.score,
+            "replies": [{
+                "author": str(reply.author),
+                "body": reply.body,
+                "score": reply.score
+            } for reply in replies]
+        })
+
+    created_time = datetime.utcfromtimestamp(submission.created_utc)
+    return {
+        "title": submission.title,
+        "author": str(submission.author),
+        "subreddit": str(submission.subreddit),
+        "body": submission.selftext.strip()
+        or "No content (link or image post).",
+        "url": submission.url,
+        "num_comments": submission.num_comments,
+        "score": submission.score,
+        "created_utc": created_time.strftime('%Y-%m-%d %H:%M:%S'),
+        "comments": top_comments
+    }
+
+
+def fetch_next_top_posts(subreddit_names,
+                         n=1,
+                         num_comments_to_fetch=5,
+                         time_range_hours=24):
+    """
+    Fetches the next `n` posts with the most comments within a custom time range that haven't been analyzed yet.
+
+    Subreddits are scanned concurrently in a thread pool, winners are picked with a heap
+    instead of sorting every post, and comment trees are only loaded for the winners.
+    Reposts of a story already picked recently (see dedup.candidates) are skipped and
+    marked as analyzed.
+
+    Args:
+        subreddit_names (str | list[str]): The subreddit(s) to fetch posts from.
+        n (int): Number of posts to return.
+        num_comments_to_fetch (int): Number of comments per post to fetch, and number of comment replies per comment to include.
+        time_range_hours (int): Time range in hours for filtering posts.
+
+    Returns:
+        list: Up to `n` posts with their comments, most commented first.
+    """
+    if isinstance(subreddit_names, str):
+        subreddit_names = [subreddit_names]
+
+    # Calculate the earliest timestamp for the time range
+    earliest_timestamp = datetime.utcnow() - timedelta(hours=time_range_hours)
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(subreddit_names)) or 1) as executor:
+        per_subreddit = executor.map(
+            lambda name: _eligible_submissions(name, earliest_timestamp, n), subreddit_names
+        )
+        # Best first across all subreddits; a repost gives its place to the next best post
+        ranked = sorted((s for subs in per_subreddit for s in subs), key=lambda s: s.num_comments, reverse=True)
+        winners = []
+        for submission in ranked:
+            if len(winners) == n:
+                break
+            text = f"{submission.title}\n{submission.selftext[:500]}"
+            duplicate = dedup.candidates.check_and_add(text, f"{SEEN_NAMESPACE}:{submission.id}")
+            if duplicate:
+                # Skipped while the original is in the dedup window, not for the whole seen-store TTL
+                seen_items.add(SEEN_NAMESPACE, submission.id, ttl=dedup.CANDIDATE_WINDOW)
+                print(f"Skipping post {submission.id}: near-duplicate of {duplicate}.")
+                continue
+            # Mark the posts as analyzed before loading their comments
+            seen_items.add(SEEN_NAMESPACE, submission.id)
+            winners.append(submission)
 
-# Set to track already-analyzed posts
-analyzed_posts = set()
+        posts = list(executor.map(lambda s: _post_details(s.id, num_comments_to_fetch), winners))
+
+    if not posts:
+        print(f"No eligible posts found in the last {time_range_hours} hours.")
+    return posts
 
 
 def fetch_next_top_post(subreddit_name,
@@ -22,91 +161,23 @@ def fetch_next_top_post(subreddit_name,
     Returns:
         dict: The top post with its comments, or None if no eligible posts are found.
     """
-    reddit = praw.Reddit(
-        client_id=REDDIT_CLIENT_ID,
-        client_secret=REDDIT_CLIENT_SECRET,
-        user_agent=REDDIT_USER_AGENT,
-    )
+    posts = fetch_next_top_posts(subreddit_name, 1, num_comments_to_fetch, time_range_hours)
+    return posts[0] if posts else None
 
-    subreddit = reddit.subreddit(subreddit_name)
 
-    # Calculate the earliest timestamp for the time range
-    current_time = datetime.utcnow()
-    earliest_timestamp = current_time - timedelta(hours=time_range_hours)
-
-    # Fetch posts from 'new' and filter by timestamp and analysis status
-    eligible_posts = []
-    for submission in subreddit.new(
-            limit=500):  # Fetch a large number of recent posts
-        created_time = datetime.utcfromtimestamp(submission.created_utc)
-        if created_time < earliest_timestamp:
-            break  # Stop fetching once we're past the desired time range
-
-        # Skip already-analyzed posts
-        if submission.id in analyzed_posts:
-            continue
-
-        eligible_posts.append(submission)
-
-    # Sort posts by the number of comments in descending order
-    eligible_posts.sort(key=lambda x: x.num_comments, reverse=True)
-
-    # Return the top post with the most comments
-    for submission in eligible_posts:
-        # Mark the post as analyzed
-        analyzed_posts.add(submission.id)
-
-        # Fetch top-level comments
-        submission.comments.replace_more(limit=0)
-        sorted_comments = sorted(submission.comments,
-                                 key=lambda c: c.score,
-                                 reverse=True)[:num_comments_to_fetch]
-
-        # Prepare comment data
-        top_comments = []
-        for comment in sorted_comments:
-            if isinstance(comment, MoreComments):
-                continue
-            replies = sorted(comment.replies[:num_comments_to_fetch],
-                             key=lambda r: r.score
-                             if hasattr(r, 'score') else 0,
-                             reverse=True)
-            top_comments.append({
-                "author":
-                str(comment.author),
-                "body":
-                comment.body,
-                "score":
-                comment.score,
-                "replies": [{
-                    "author": str(reply.author),
-                    "body": reply.body,
-                    "score": reply.score
-                } for reply in replies]
-            })
-
-        # Prepare and return the post data
-        return {
-            "title": submission.title,
-            "author": str(submission.author),
-            "body": submission.selftext.strip()
-            or "No content (link or image post).",
-            "url": submission.url,
-            "num_comments": submission.num_comments,
-            "score": submission.score,
-            "created_utc": created_time.strftime('%Y-%m-%d %H:%M:%S'),
-            "comments": top_comments
-        }
-
-    print(f"No eligible posts found in the last {time_range_hours} hours.")
-    return None
-
-
-def output_hierarchical_json(post_details):
+def output_hierarchical_json(post_details, ndjson=False, file=None):
     """
     Outputs the post details in a hierarchical JSON format.
+
+    With `ndjson`, `post_details` is one post or an iterable of posts (e.g. a generator, or
+    reddit_stream's take_changed()); each post is written as one compact JSON line and
+    flushed right away, so consumers can process posts as they arrive.
     """
+    if ndjson:
+        for post in [post_details] if isinstance(post_details, dict) else post_details or []:
+            print(json.dumps(post, separators=(",", ":")), file=file, flush=True)
+        return
     if post_details:
-        print(json.dumps(post_details, indent=4))
+        print(json.dumps(post_details, indent=4), file=file)
     else:
-        print("No post to display.")
+        print("No post to display.", file=file)
@@ -0,0 +1,282 @@
+"""
+Live Reddit source: follows new submissions and comments in a set of subreddits through
+PRAW's streams instead of re-reading whole listings.
+
+A background thread keeps an in-memory index of recent posts. New submissions are added
+as they appear. New comments update their post's running comment count and its comment
+tree in place, so trees never need replace_more. Every REFRESH_INTERVAL seconds the
+scores and comment counts of all indexed posts are re-read, 100 posts per request. Each
+pass of the streams costs one request per stream and only returns items newer than the
+last one seen.
+
+Posts that are new or changed since the last call come out of take_candidates() shaped
+like tweets, so they go into the same scheduler queue as the X Lists (see
+main.REDDIT_SUBREDDITS). On X they can only be answered with a standalone tweet.
+
+    python reddit_stream.py wallstreetbets stocks   # print new and updated posts as NDJSON
+"""
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+import config
+import dedup
+import metrics
+import reddit_fetcher
+from scheduler import MAX_CANDIDATE_AGE
+from seen_store import seen_items
+from x_poster import is_tweet_seen
+
+# Scheduler source name, and prefix of the candidate IDs the stream hands out
+SOURCE = "reddit"
+
+# Seconds between passes over the submission and comment streams
+STREAM_PAUSE = getattr(config, "REDDIT_STREAM_PAUSE", 15)
+
+# Seconds between re-reads of the indexed posts' scores and comment counts
+REFRESH_INTERVAL = getattr(config, "REDDIT_REFRESH_INTERVAL", 300)
+
+# Most posts kept in the index, and comments kept per post and replies kept per comment
+MAX_POSTS = 2000
+MAX_COMMENTS = 50
+MAX_REPLIES = 20
+
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+
+def _trim(comments, limit):
+    # Drops the lowest-scored comments (the oldest first among equals) beyond `limit`
+    while len(comments) > limit:
+        del comments[min(comments, key=lambda comment_id: comments[comment_id]["score"])]
+
+
+def _top(comments, limit):
+    return sorted(comments.values(), key=lambda comment: comment["score"], reverse=True)[:limit]
+
+
+class StreamedPost:
+    """One indexed submission with the comment tree the comment stream has delivered so far."""
+
+    def __init__(self, submission, now=None):
+        self.id = submission.id
+        self.title = submission.title
+        self.author = str(submission.author)
+        self.subreddit = str(submission.subreddit)
+        self.body = submission.selftext.strip()
+        self.url = submission.url
+        self.created_utc = submission.created_utc
+        self.score = submission.score
+        self.num_comments = submission.num_comments
+        self.synced_at = now or time.time()  # num_comments covers every comment created before this
+        self.comments = {}  # top-level comment ID -> comment, with "replies" by reply ID
+        self.comment_ids = set()
+        self.checked = False  # Compared against dedup.candidates yet
+        self.duplicate_of = None
+
+    def add_comment(self, comment):
+        """Adds a streamed comment. Returns False if it was already seen."""
+        if comment.id in self.comment_ids:
+            return False
+        self.comment_ids.add(comment.id)
+        if comment.created_utc > self.synced_at:
+            self.num_comments += 1
+        data = {"author": str(comment.author), "body": comment.body, "score": comment.score}
+        kind, _, parent_id = comment.parent_id.partition("_")
+        if kind == "t3":
+            self.comments[comment.id] = {**data, "replies": {}}
+            _trim(self.comments, MAX_COMMENTS)
+        elif parent_id in self.comments:
+            replies = self.comments[parent_id]["replies"]
+            replies[comment.id] = data
+            _trim(replies, MAX_REPLIES)
+        # Deeper replies only count towards num_comments
+        return True
+
+    def details(self, num_comments=5):
+        """The post in reddit_fetcher's format (see output_hierarchical_json), plus its "id"."""
+        return {
+            "id": self.id,
+            "title": self.title,
+            "author": self.author,
+            "subreddit": self.subreddit,
+            "body": self.body or "No content (link or image post).",
+            "url": self.url,
+            "num_comments": self.num_comments,
+            "score": self.score,
+            "created_utc": datetime.fromtimestamp(self.created_utc, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            "comments": [
+                {**comment, "replies": _top(comment["replies"], num_comments)}
+                for comment in _top(self.comments, num_comments)
+            ],
+        }
+
+    def candidate(self, num_comments=3):
+        """The post as a scheduler candidate: tweet-shaped, with upvotes as likes and comments as replies."""
+        lines = [f"r/{self.subreddit}: {self.title}"]
+        if self.body:
+            lines.append(self.body[:500])
+        lines.extend(f"- {comment['body'][:200]}" for comment in _top(self.comments, num_comments))
+        return {
+            "id": f"{SOURCE}:{self.id}",
+            "source": SOURCE,
+            "title": self.title,
+            "text": "\n".join(lines),
+            "author_handle": "unknown",
+            "created_at": datetime.fromtimestamp(self.created_utc, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "public_metrics": {"like_count": max(0, self.score), "reply_count": self.num_comments},
+            "media": [self.url] if self.url.lower().endswith(_IMAGE_EXTENSIONS) else [],
+        }
+
+
+class RedditStream:
+    """
+    Index of recent posts in `subreddits`, kept up to date by a background thread that
+    follows the submission and comment streams (see the module docstring).
+    """
+
+    def __init__(self, subreddits, max_age=MAX_CANDIDATE_AGE, max_posts=MAX_POSTS, comments_per_post=5,
+                 pause=STREAM_PAUSE, refresh_interval=REFRESH_INTERVAL):
+        self.subreddits = [subreddits] if isinstance(subreddits, str) else list(subreddits)
+        self.max_age = max_age
+        self.max_posts = max_posts
+        self.comments_per_post = comments_per_post
+        self.pause = pause
+        self.refresh_interval = refresh_interval
+        self.posts = {}  # submission ID -> StreamedPost
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True, name="reddit-stream")
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def add_submission(self, submission, now=None):
+        """Indexes a new submission unless it is older than max_age."""
+        now = now or time.time()
+        if now - submission.created_utc > self.max_age:
+            return
+        with self._lock:
+            if submission.id not in self.posts:
+                self.posts[submission.id] = StreamedPost(submission, now)
+                self._changed.add(submission.id)
+
+    def add_comment(self, comment):
+        """Adds a comment to its post's tree, if the post is indexed."""
+        post_id = comment.link_id.partition("_")[2]
+        with self._lock:
+            post = self.posts.get(post_id)
+            if post is not None and post.add_comment(comment):
+                self._changed.add(post_id)
+
+    def refresh(self, reddit):
+        """Re-reads the score and comment count of every indexed post, 100 posts per request."""
+        with self._lock:
+            fullnames = [f"t3_{post_id}" for post_id in self.posts]
+        if not fullnames:
+            return
+        now = time.time()
+        with metrics.observe("reddit_refresh"):
+            submissions = list(reddit.info(fullnames=fullnames))
+        with self._lock:
+            for submission in submissions:
+                post = self.posts.get(submission.id)
+                if post is None:
+                    continue
+                if (submission.score, submission.num_comments) != (post.score, post.num_comments):
+                    self._changed.add(post.id)
+                post.score = submission.score
+                post.num_comments = submission.num_comments
+                post.synced_at = now
+
+    def expire(self, now=None):
+        """Drops posts older than max_age, then the oldest ones beyond max_posts."""
+        now = now or time.time()
+        with self._lock:
+            for post_id in [post_id for post_id, post in self.posts.items() if now - post.created_utc > self.max_age]:
+                del self.posts[post_id]
+            if len(self.posts) > self.max_posts:
+                oldest = sorted(self.posts, key=lambda post_id: self.posts[post_id].created_utc)
+                for post_id in oldest[:len(self.posts) - self.max_posts]:
+                    del self.posts[post_id]
+            self._changed.intersection_update(self.posts)
+
+    def _take_changed(self, render):
+        # (post, render(post)) for the posts added or updated since the last call, oldest first.
+        # Rendered under the lock: the stream thread keeps changing the comment trees.
+        with self._lock:
+            changed = sorted((self.posts[post_id] for post_id in self._changed), key=lambda post: post.created_utc)
+            self._changed.clear()
+            return [(post, render(post)) for post in changed]
+
+    def take_changed(self):
+        """Details (see StreamedPost.details) of the posts added or updated since the last call, oldest first."""
+        return [details for _, details in self._take_changed(lambda post: post.details(self.comments_per_post))]
+
+    def _candidate(self, post):
+        # The post as a candidate, or None if it was handled already or repeats a recent story.
+        # Runs under the lock (see _take_changed) as it updates the post's dedup state.
+        candidate_id = f"{SOURCE}:{post.id}"
+        if post.duplicate_of or is_tweet_seen(candidate_id) or seen_items.seen(reddit_fetcher.SEEN_NAMESPACE, post.id):
+            return None
+        if not post.checked:
+            post.checked = True
+            post.duplicate_of = dedup.candidates.check_and_add(f"{post.title}\n{post.body[:500]}", candidate_id)
+            if post.duplicate_of:
+                # Left out while it stays indexed, but not marked seen for good
+                print(f"Skipping Reddit post {post.id}: near-duplicate of {post.duplicate_of}.")
+                return None
+        return post.candidate()
+
+    def take_candidates(self):
+        """
+        Scheduler fetch for SOURCE: candidates for the posts added or updated since the last
+        call. Posts already handled (here or by reddit_fetcher) are left out, and so are
+        reposts of a story fetched recently (see dedup.candidates).
+        """
+        return [candidate for _, candidate in self._take_changed(self._candidate) if candidate is not None]
+
+    def run(self):
+        # PRAW clients are per thread (see reddit_fetcher.get_reddit); this one belongs to the stream
+        reddit = reddit_fetcher.get_reddit()
+        subreddit = reddit.subreddit("+".join(self.subreddits))
+        submissions = comments = None
+        last_refresh = time.time()
+        while not self._stopping.is_set():
+            try:
+                if submissions is None:
+                    # pause_after=-1: every request is followed by a None, so one pass makes one request
+                    submissions = subreddit.stream.submissions(pause_after=-1)
+                    comments = subreddit.stream.comments(pause_after=-1)
+                with metrics.observe("reddit_stream"):
+                    for submission in submissions:
+                        if submission is None:
+                            break
+                        self.add_submission(submission)
+                    for comment in comments:
+                        if comment is None:
+                            break
+                        self.add_comment(comment)
+                if time.time() - last_refresh >= self.refresh_interval:
+                    last_refresh = time.time()
+                    self.refresh(reddit)
+                self.expire()
+            except Exception as e:
+                # A generator that raised is finished; start new streams on the next pass
+                print(f"Error streaming r/{'+'.join(self.subreddits)}: {e}")
+                submissions = comments = None
+            self._stopping.wait(self.pause)
+
+
+if __name__ == "__main__":
+    stream = RedditStream(sys.argv[1:] or ["wallstreetbets"]).start()
+    while True:
+        time.sleep(stream.pause)
+        reddit_fetcher.output_hierarchical_json(stream.take_changed(), ndjson=True)
@@ -0,0 +1,108 @@
+"""
+Runs several X accounts, each with its own persona and Lists, from one process.
+
+Every account is a worker (an asyncio task) with its own scheduler, posting budget,
+outbox and rate-limit governor. Research, media analysis and seen-tweet dedup are shared:
+workers run in the same process, so the research and image caches in perplexity_ai and
+openai_api answer for all of them, and a tweet one account responds to is never picked
+by another. ACCOUNTS in config lists the accounts:
+
+    ACCOUNTS = [
+        {
+            "name": "dog",
+            "access_token": "...",
+            "access_token_secret": "...",
+            "lists": ["1861948771850150365"],
+            "persona": {"niche": "a sharp-witted finance and meme dog account"},  # see persona.Persona
+            "posts_per_hour": 2,
+        },
+    ]
+
+The app credentials (bearer token, API key and secret) default to the X_* settings. An
+entry named "default" uses the account configured by those settings. Without ACCOUNTS,
+the runner does what main.py does for the default account.
+
+    python runner.py
+"""
+import asyncio
+import functools
+import config
+import metrics
+import main
+from outbox import Outbox, OutboxWorker
+from persona import Persona, DEFAULT_PERSONA
+from scheduler import Scheduler, POSTS_PER_HOUR
+from x_poster import Account, DEFAULT_ACCOUNT, default_account, publish, classify_post_error, fetch_candidate_tweets
+
+
+class Worker:
+    """One account: polls its Lists, responds in its persona's voice and posts through its own outbox."""
+
+    def __init__(self, account, persona, lists, outbox, posts_per_hour=POSTS_PER_HOUR):
+        self.account = account
+        self.persona = persona
+        self.outbox = outbox
+        self.poster = OutboxWorker(outbox, functools.partial(publish, account=account), classify_post_error)
+        self.scheduler = Scheduler(lists, self.fetch, posts_per_hour=posts_per_hour)
+
+    @classmethod
+    def from_config(cls, settings):
+        name = settings.get("name", DEFAULT_ACCOUNT)
+        if name == DEFAULT_ACCOUNT:
+            account, outbox = default_account, main.outbox
+        else:
+            account = Account.from_config(settings)
+            outbox = Outbox(settings.get("outbox_path", f"outbox_{name}.db"))
+        return cls(
+            account,
+            Persona.from_config(settings.get("persona")),
+            settings.get("lists", main.LIST_IDS),
+            outbox,
+            settings.get("posts_per_hour", POSTS_PER_HOUR),
+        )
+
+    @property
+    def name(self):
+        return self.account.name
+
+    def fetch(self, list_id, hours):
+        return fetch_candidate_tweets([list_id], hours=hours, top_k=None, account=self.account)
+
+    async def run(self):
+        # Posts queued tweets (including any left over from a previous run) in the background
+        self.poster.start()
+        main.load_recent_posts(self.outbox)
+        while True:
+            try:
+                # Polling blocks on the X API; keep it off the loop so other workers carry on
+                await asyncio.to_thread(self.scheduler.poll_due)
+                await main.respond_to_ready(self.scheduler, self.persona, self.outbox, self.poster)
+            except Exception as e:
+                print(f"[{self.name}] Unexpected error: {e}")
+
+            wait_time = self.scheduler.sleep_time()
+            print(f"[{self.name}] Waiting for {wait_time:.0f} seconds ({len(self.scheduler.queue)} candidates queued, "
+                  f"{self.scheduler.budget.remaining()} posts left this hour)...\n")
+            await asyncio.sleep(wait_time)
+
+
+def build_workers(accounts=None):
+    """Workers for the ACCOUNTS in config, or for the default account if there are none."""
+    accounts = accounts if accounts is not None else getattr(config, "ACCOUNTS", None)
+    if not accounts:
+        return [Worker(default_account, DEFAULT_PERSONA, main.LIST_IDS, main.outbox)]
+    names = [settings.get("name", DEFAULT_ACCOUNT) for settings in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Account names must be unique: {names}")
+    return [Worker.from_config(settings) for settings in accounts]
+
+
+async def run_all(workers):
+    print(f"Running {len(workers)} account(s): {', '.join(worker.name for worker in workers)}")
+    await asyncio.gather(*(worker.run() for worker in workers))
+
+
+if __name__ == "__main__":
+    # Prometheus metrics on a local port (METRICS_PORT in config, None to disable)
+    metrics.start_metrics_server()
+    asyncio.run(run_all(build_workers()))
@@ -0,0 +1,317 @@
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import config
+import ranking
+import rate_limit
+
+# Polling interval bounds per source (seconds) and the number of new tweets we'd like each poll to pick up
+MIN_POLL_INTERVAL = getattr(config, "MIN_POLL_INTERVAL", 60)
+MAX_POLL_INTERVAL = getattr(config, "MAX_POLL_INTERVAL", 1800)
+TARGET_NEW_PER_POLL = getattr(config, "TARGET_NEW_PER_POLL", 10)
+
+# Engagement score (time-decayed weighted interactions per minute, see ranking.score) at which a
+# candidate triggers generation
+VELOCITY_THRESHOLD = getattr(config, "VELOCITY_THRESHOLD", 5.0)
+
+# Most responses posted per rolling hour
+POSTS_PER_HOUR = getattr(config, "POSTS_PER_HOUR", 2)
+
+# With nothing crossing the threshold, still respond to the best candidate after this many seconds
+MAX_IDLE = getattr(config, "SCHEDULER_MAX_IDLE", 1800)
+
+# Candidates older than this (seconds since posting) are dropped from the queue
+MAX_CANDIDATE_AGE = getattr(config, "MAX_CANDIDATE_AGE", 3 * 3600)
+
+
+class SourcePoller:
+    """
+    Polling schedule for one source (an X List). Tracks an exponentially weighted average
+    of new tweets per second and sets the interval so a poll picks up about
+    TARGET_NEW_PER_POLL new tweets: busy lists are polled often, quiet ones rarely.
+    """
+
+    def __init__(self, source, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL,
+                 target_new=TARGET_NEW_PER_POLL, alpha=0.3):
+        self.source = source
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new = target_new
+        self.alpha = alpha
+        self.rate = None  # EWMA of new tweets per second
+        self.interval = min_interval
+        self.last_polled = None
+        self.next_poll_at = 0.0
+
+    def freshness_hours(self, now=None):
+        """
+        Age window to ask the list for: the time since the last poll with 50% overlap
+        (the per-list since_id drops the repeats), or the longest interval on the first poll.
+        """
+        now = now or time.time()
+        gap = self.max_interval if self.last_polled is None else now - self.last_polled
+        return min(gap * 1.5, MAX_CANDIDATE_AGE) / 3600
+
+    def record(self, new_items, now=None):
+        """Updates the arrival-rate estimate after a poll and schedules the next one."""
+        now = now or time.time()
+        if self.last_polled is not None:
+            observed = new_items / max(1.0, now - self.last_polled)
+            self.rate = observed if self.rate is None else self.alpha * observed + (1 - self.alpha) * self.rate
+        self.last_polled = now
+        if self.rate:
+            self.interval = min(self.max_interval, max(self.min_interval, self.target_new / self.rate))
+        elif self.rate is not None:
+            self.interval = self.max_interval  # Nothing new at all lately
+        self.next_poll_at = now + self.interval
+
+    def record_failure(self, now=None):
+        """Backs off after a failed poll."""
+        now = now or time.time()
+        self.interval = min(self.max_interval, self.interval * 2)
+        self.next_poll_at = now + self.interval
+
+    def defer(self, retry_at, now=None):
+        """
+        Reschedules a poll the rate limit put off for when the budget is back. Nothing was
+        read, so the arrival-rate estimate and the interval stay as they were.
+        """
+        now = now or time.time()
+        self.next_poll_at = max(now, retry_at)
+
+
+class CandidateQueue:
+    """
+    Priority queue of candidate tweets by engagement velocity (highest first). Each tweet
+    ID is queued once; re-pushing it replaces the old entry. Entries older than `max_age`
+    are dropped, and the queue holds at most `maxsize` candidates.
+    """
+
+    def __init__(self, max_age=MAX_CANDIDATE_AGE, maxsize=1000):
+        self.max_age = max_age
+        self.maxsize = maxsize
+        self._heap = []  # (-velocity, sequence, tweet_id)
+        self._entries = {}  # tweet_id -> (sequence, tweet, created_at timestamp or NaN)
+        self._sequence = itertools.count()
+
+    def push_many(self, tweets, now=None):
+        """Queues tweets, scoring them in one vectorized pass (see ranking.score)."""
+        if not tweets:
+            return
+        now = now or time.time()
+        velocities = ranking.score(tweets, now)
+        created_at = ranking.parse_created_at([tweet.get("created_at") for tweet in tweets])
+        for tweet, velocity, created in zip(tweets, velocities, created_at):
+            self._push(tweet, float(velocity), float(created))
+
+    def push(self, tweet, now=None):
+        self.push_many([tweet], now)
+
+    def _push(self, tweet, velocity, created_at):
+        tweet["velocity"] = velocity
+        sequence = next(self._sequence)
+        self._entries[tweet["id"]] = (sequence, tweet, created_at)
+        heapq.heappush(self._heap, (-velocity, sequence, tweet["id"]))
+        if len(self._entries) > self.maxsize:
+            self._drop_slowest()
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            # Too many replaced/dropped entries: rebuild so memory stays bounded
+            self._heap = [item for item in self._heap if self._entries.get(item[2], (None,))[0] == item[1]]
+            heapq.heapify(self._heap)
+
+    def _drop_slowest(self):
+        slowest = min(self._entries, key=lambda tweet_id: self._entries[tweet_id][1]["velocity"])
+        del self._entries[slowest]
+
+    def _clean_top(self, now):
+        while self._heap:
+            _, sequence, tweet_id = self._heap[0]
+            entry = self._entries.get(tweet_id)
+            if entry is None or entry[0] != sequence:
+                heapq.heappop(self._heap)  # Replaced or dropped
+            elif not math.isnan(entry[2]) and now - entry[2] > self.max_age:
+                heapq.heappop(self._heap)
+                del self._entries[tweet_id]
+            else:
+                return entry[1]
+        return None
+
+    def peek(self, now=None):
+        """The fastest-moving candidate, or None."""
+        return self._clean_top(now or time.time())
+
+    def pop(self, now=None):
+        tweet = self._clean_top(now or time.time())
+        if tweet is not None:
+            heapq.heappop(self._heap)
+            del self._entries[tweet["id"]]
+        return tweet
+
+    def snapshot(self):
+        """Queued candidates as [tweet, created_at], including their velocity."""
+        return [
+            [tweet, None if math.isnan(created_at) else created_at] for _, tweet, created_at in self._entries.values()
+        ]
+
+    def restore(self, entries):
+        """Queues candidates from snapshot() with their saved velocity."""
+        for tweet, created_at in entries:
+            self._push(tweet, tweet["velocity"], math.nan if created_at is None else created_at)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PostingBudget:
+    """At most `per_hour` posts in any rolling hour."""
+
+    def __init__(self, per_hour=POSTS_PER_HOUR):
+        self.per_hour = per_hour
+        self._posts = deque()
+
+    def _expire(self, now):
+        while self._posts and now - self._posts[0] >= 3600:
+            self._posts.popleft()
+
+    def remaining(self, now=None):
+        now = now or time.time()
+        self._expire(now)
+        return max(0, self.per_hour - len(self._posts))
+
+    def next_available(self, now=None):
+        """When the next post fits in the budget (now, if it already does)."""
+        now = now or time.time()
+        return now if self.remaining(now) else self._posts[0] + 3600
+
+    def record(self, now=None):
+        self._posts.append(now or time.time())
+
+    def snapshot(self):
+        return list(self._posts)
+
+    def restore(self, posts):
+        self._posts.extend(posts)
+
+
+class Scheduler:
+    """
+    Event-driven replacement for a fixed poll-and-sleep loop:
+
+        scheduler.poll_due()              # poll the sources whose interval elapsed
+        for tweet in scheduler.take_ready():
+            ...                           # generate; call scheduler.record_post() when queued
+        time.sleep(scheduler.sleep_time())
+
+    `fetch(source, hours)` returns new, unseen tweets for one source, or raises
+    rate_limit.RateLimited if the source's budget is spent; the sources that are due are
+    fetched concurrently, at most `max_workers` at a time. A candidate is
+    released as soon as its engagement velocity crosses `threshold` and the hourly budget
+    allows; if nothing crosses it for `max_idle` seconds, the best candidate is released.
+    """
+
+    def __init__(self, sources, fetch, threshold=VELOCITY_THRESHOLD, posts_per_hour=POSTS_PER_HOUR,
+                 max_idle=MAX_IDLE, max_workers=8):
+        self.pollers = {source: SourcePoller(source) for source in sources}
+        self.fetch = fetch
+        self.max_workers = max_workers
+        self.threshold = threshold
+        self.max_idle = max_idle
+        self.queue = CandidateQueue()
+        self.budget = PostingBudget(posts_per_hour)
+        self.last_release = time.time()
+
+    def poll_due(self, now=None):
+        """
+        Polls every source that is due, all in one concurrent batch, and queues what they
+        return. Returns the number of new candidates.
+        """
+        now = now or time.time()
+        due = [poller for poller in self.pollers.values() if poller.next_poll_at <= now]
+        if not due:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(due))) as executor:
+            futures = [
+                (poller, executor.submit(self.fetch, poller.source, poller.freshness_hours(now))) for poller in due
+            ]
+
+        added = 0
+        for poller, future in futures:
+            try:
+                tweets = future.result()
+            except rate_limit.RateLimited as e:
+                poller.defer(e.retry_at, now)
+                print(f"Polling {poller.source} deferred by the rate limit for {poller.next_poll_at - now:.0f}s.")
+                continue
+            except Exception as e:
+                print(f"Error polling source {poller.source}: {e}")
+                poller.record_failure(now)
+                continue
+            self.queue.push_many(tweets, now)
+            added += len(tweets)
+            poller.record(len(tweets), now)
+            print(f"Polled {poller.source}: {len(tweets)} new, next poll in {poller.interval:.0f}s.")
+        return added
+
+    def take_ready(self, limit=20, now=None):
+        """
+        Removes and returns the candidates that should be handled now, fastest first:
+        everything above the velocity threshold (up to `limit`), or the single best one
+        once the scheduler has been idle for `max_idle`. Empty while the budget is spent.
+        """
+        now = now or time.time()
+        if not self.budget.remaining(now):
+            return []
+        ready = []
+        while len(ready) < limit:
+            top = self.queue.peek(now)
+            if top is None or top["velocity"] < self.threshold:
+                break
+            ready.append(self.queue.pop(now))
+        if not ready and now - self.last_release >= self.max_idle and self.queue.peek(now) is not None:
+            print(f"No candidate crossed {self.threshold} interactions/min in {self.max_idle}s; taking the best one.")
+            ready.append(self.queue.pop(now))
+        if ready:
+            self.last_release = now
+        return ready
+
+    def record_post(self, now=None):
+        self.budget.record(now)
+
+    def snapshot(self):
+        """Polling schedules, queued candidates, posts this hour and the idle timer (see restore)."""
+        return {
+            "pollers": {
+                source: {"rate": poller.rate, "interval": poller.interval, "last_polled": poller.last_polled,
+                         "next_poll_at": poller.next_poll_at}
+                for source, poller in self.pollers.items()
+            },
+            "queue": self.queue.snapshot(),
+            "posts": self.budget.snapshot(),
+            "last_release": self.last_release,
+        }
+
+    def restore(self, state):
+        """Picks up where a previous run's scheduler stopped. Sources no longer configured are ignored."""
+        for source, saved in state["pollers"].items():
+            poller = self.pollers.get(source)
+            if poller is not None:
+                poller.rate = saved["rate"]
+                poller.interval = saved["interval"]
+                poller.last_polled = saved["last_polled"]
+                poller.next_poll_at = saved["next_poll_at"]
+        self.queue.restore(state["queue"])
+        self.budget.restore(state["posts"])
+        self.last_release = state["last_release"]
+
+    def sleep_time(self, now=None):
+        """Seconds until something can happen: the next poll, or the budget freeing up for waiting candidates."""
+        now = now or time.time()
+        wake = min(poller.next_poll_at for poller in self.pollers.values())
+        top = self.queue.peek(now)
+        if top is not None:
+            ready_at = self.last_release + self.max_idle if top["velocity"] < self.threshold else now
+            wake = min(wake, max(ready_at, self.budget.next_available(now)))
+        return max(1.0, wake - now)
@@ -0,0 +1,155 @@
+import base64
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+import config
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter. Membership tests may return false positives (at roughly
+    `error_rate` once `capacity` items were added) but never false negatives.
+    """
+
+    def __init__(self, capacity=100_000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+
+class SeenStore:
+    """
+    Persistent record of items (Reddit submissions, tweets) that were already handled.
+
+    Items are stored in SQLite with an expiry time so the table stays bounded, and an
+    in-memory Bloom filter sits in front of it: most lookups are for new items, which the
+    filter rejects without touching disk. Expired rows are purged and the filter rebuilt
+    every `purge_interval` seconds, which keeps memory flat for long-running workers. The
+    first purge happens on first use, unless restore() loads the filter from a snapshot.
+    """
+
+    def __init__(self, path=None, ttl=None, capacity=100_000, error_rate=0.001, purge_interval=3600):
+        self.path = path or getattr(config, "SEEN_STORE_PATH", "seen_items.db")
+        self.ttl = ttl if ttl is not None else getattr(config, "SEEN_STORE_TTL", 7 * 24 * 3600)
+        self.purge_interval = purge_interval
+        self.bloom = BloomFilter(capacity, error_rate)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS seen_items (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._last_purge = float("-inf")
+
+    @staticmethod
+    def _key(namespace, item_id):
+        return f"{namespace}:{item_id}"
+
+    def seen(self, namespace, item_id):
+        """Returns True if the item was marked as seen and hasn't expired."""
+        key = self._key(namespace, item_id)
+        with self._lock:
+            self._maybe_purge()
+            if key not in self.bloom:
+                return False
+            row = self._db.execute(
+                "SELECT expires_at FROM seen_items WHERE key = ?", (key,)
+            ).fetchone()
+            return bool(row and row[0] > time.time())
+
+    def add(self, namespace, item_id, ttl=None):
+        """Marks an item as seen for `ttl` seconds (defaults to the store TTL)."""
+        key = self._key(namespace, item_id)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO seen_items (key, expires_at) VALUES (?, ?)", (key, expires_at)
+            )
+            self._db.commit()
+            self.bloom.add(key)
+
+    def check_and_add(self, namespace, item_id):
+        """Marks an item as seen and returns whether it had already been seen."""
+        already_seen = self.seen(namespace, item_id)
+        if not already_seen:
+            self.add(namespace, item_id)
+        return already_seen
+
+    def purge(self):
+        """Deletes expired rows and rebuilds the Bloom filter from the remaining ones."""
+        with self._lock:
+            self._purge()
+
+    def _maybe_purge(self):
+        if time.time() - self._last_purge >= self.purge_interval:
+            self._purge()
+
+    def _purge(self):
+        now = time.time()
+        self._db.execute("DELETE FROM seen_items WHERE expires_at <= ?", (now,))
+        self._db.commit()
+        self.bloom.clear()
+        for (key,) in self._db.execute("SELECT key FROM seen_items"):
+            self.bloom.add(key)
+        self._last_purge = now
+
+    def _version(self):
+        # Callers hold _lock. Changes whenever rows are added, replaced or purged.
+        return list(self._db.execute("SELECT COUNT(*), MAX(rowid) FROM seen_items").fetchone())
+
+    def snapshot(self):
+        """The Bloom filter and last purge time, tagged with the table version; None before first use."""
+        with self._lock:
+            if self._last_purge == float("-inf"):
+                return None
+            return {
+                "bits": base64.b64encode(self.bloom.bits).decode("ascii"),
+                "num_bits": self.bloom.num_bits,
+                "count": self.bloom.count,
+                "last_purge": self._last_purge,
+                "version": self._version(),
+            }
+
+    def restore(self, state):
+        """
+        Loads the Bloom filter from snapshot() instead of rebuilding it from the table. Returns
+        False, leaving the rebuild to first use, if the table changed since (e.g. another process wrote to it).
+        """
+        with self._lock:
+            if not state or state["num_bits"] != self.bloom.num_bits or state["version"] != self._version():
+                return False
+            self.bloom.bits = bytearray(base64.b64decode(state["bits"]))
+            self.bloom.count = state["count"]
+            self._last_purge = state["last_purge"]
+            return True
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM seen_items").fetchone()[0]
+
+
+# Shared store used by reddit_fetcher, x_poster and main
+seen_items = SeenStore()
@@ -0,0 +1,91 @@
+"""
+State carried from one run to the next, for one-shot runs (python main.py run-once).
+
+A long-running process keeps its since_ids, seen-item Bloom filter, near-duplicate
+indexes, caches, rate-limit buckets, model latencies and scheduler in memory. A one-shot
+run saves them to SNAPSHOT_PATH (gzip-compressed JSON) when it exits and loads them when
+the next one starts, so the next run picks up where the last one stopped without
+rebuilding anything or asking the APIs again. The file is replaced atomically; a missing,
+unreadable or outdated snapshot just means a cold start.
+"""
+import gzip
+import json
+import os
+import time
+import config
+import dedup
+import model_router
+import rate_limit
+import x_poster
+from openai_api import image_cache
+from seen_store import seen_items
+
+SNAPSHOT_PATH = getattr(config, "SNAPSHOT_PATH", "snapshot.json.gz")
+
+# Bumped whenever the layout of a part changes; older snapshots are ignored
+VERSION = 1
+
+
+def parts(scheduler=None, research_cache=None):
+    """
+    name -> (snapshot, restore) for each piece of state kept between runs: the shared
+    ones, plus the given scheduler and research cache.
+    """
+    objects = {
+        "seen_items": seen_items,
+        "candidates": dedup.candidates,
+        "posts": dedup.posts,
+        "image_cache": image_cache,
+        "research_cache": research_cache,
+        "governor": rate_limit.governor,
+        "router": model_router.router,
+        "scheduler": scheduler,
+    }
+    state = {name: (obj.snapshot, obj.restore) for name, obj in objects.items() if obj is not None}
+    state["since_ids"] = (x_poster.since_ids_snapshot, x_poster.restore_since_ids)
+    return state
+
+
+def save(state_parts, path=SNAPSHOT_PATH):
+    """Writes a snapshot of every part. Returns True on success."""
+    try:
+        state = {"version": VERSION, "saved_at": time.time()}
+        state.update({name: snapshot() for name, (snapshot, _) in state_parts.items()})
+        temp_path = f"{path}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8", compresslevel=5) as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+        return True
+    except Exception as e:
+        print(f"Could not save snapshot to {path}: {e}")
+        return False
+
+
+def load(state_parts, path=SNAPSHOT_PATH):
+    """
+    Restores every part found in the snapshot at `path`. Returns True if the snapshot was
+    loaded; parts that fail to restore are rebuilt as on a cold start.
+    """
+    if not os.path.exists(path):
+        print(f"No snapshot at {path}; starting cold.")
+        return False
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            state = json.load(f)
+    except Exception as e:
+        print(f"Could not read snapshot {path}: {e}")
+        return False
+    if state.get("version") != VERSION:
+        print(f"Ignoring snapshot {path} from another version.")
+        return False
+
+    for name, (_, restore) in state_parts.items():
+        if state.get(name) is None:
+            continue
+        try:
+            if restore(state[name]) is False:
+                print(f"Snapshot of {name} is out of date; rebuilding it.")
+        except Exception as e:
+            print(f"Could not restore {name} from snapshot: {e}")
+    print(f"Loaded snapshot from {time.time() - state['saved_at']:.0f}s ago.")
+    return True
@@ -0,0 +1,314 @@
+"""
+Local stand-ins for the OpenAI, Perplexity, X and image-host endpoints the bot talks to,
+used by benchmark.py to run the pipeline with no network access.
+
+One threaded HTTP server answers every upstream on a separate route prefix:
+    /openai/v1/chat/completions     OpenAI chat completions (plain and streamed)
+    /perplexity/chat/completions    Perplexity chat completions
+    /x/2/lists/<id>/tweets          X v2 list tweets
+    /x/2/tweets                     X v2 create tweet
+    /images/<name>.jpg              media downloads
+
+Each upstream has its own latency, jitter, error rate and payload size (see StubConfig).
+"""
+import itertools
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECTIONS = [
+    "Brief overview of the topic",
+    "Latest developments in the news",
+    "Financial/economic implications",
+    "Popular consensus",
+    "Key arguments for and against the consensus",
+    "Conclusion",
+]
+
+_FILLER = ("hoomans keep refreshing the charts while the market sniffs around for a new narrative "
+           "and everybody has a very confident opinion about what happens next ")
+
+
+class StubConfig:
+    """
+    Behaviour of one stubbed upstream.
+
+    latency_ms: mean response delay; jitter_ms: +/- uniform jitter around it.
+    error_rate: probability (0-1) of answering with a 500.
+    payload: completion characters (openai/perplexity), tweets per page (x) or bytes (images).
+    """
+
+    def __init__(self, latency_ms=100, jitter_ms=0, error_rate=0.0, payload=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.payload = payload
+
+    def delay(self):
+        return max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+
+DEFAULT_CONFIGS = {
+    "openai": StubConfig(latency_ms=300, jitter_ms=100, payload=160),
+    "perplexity": StubConfig(latency_ms=1500, jitter_ms=500, payload=3000),
+    "x": StubConfig(latency_ms=100, jitter_ms=30, payload=20),
+    "images": StubConfig(latency_ms=50, jitter_ms=20, payload=200_000),
+}
+
+
+def _text(length):
+    return (_FILLER * (length // len(_FILLER) + 1))[:length]
+
+
+def _unique_text(length):
+    """Filler-like text with numbered words, so separate texts aren't near-duplicates (see dedup)."""
+    words = random.choices(_FILLER.split(), k=length // 6 + 1)
+    return " ".join(f"{word}{random.randrange(1000)}" for word in words)[:length]
+
+
+def _png(size_bytes):
+    """A valid RGB PNG of roughly `size_bytes` (random pixels, stored uncompressed)."""
+    side = max(1, int((size_bytes / 3) ** 0.5))
+    raw = b"".join(b"\x00" + os.urandom(side * 3) for _ in range(side))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 0))
+            + chunk(b"IEND", b""))
+
+
+class StubState:
+    """Shared state of the stub server: configs, topic/media pools and counters."""
+
+    def __init__(self, configs=None, topic_pool=None, media_pool=None, media_per_tweet=1):
+        self.configs = {**DEFAULT_CONFIGS, **(configs or {})}
+        self.topic_pool = topic_pool  # None: every tweet gets a unique topic
+        self.media_pool = media_pool  # None: every media URL is unique
+        self.media_per_tweet = media_per_tweet
+        self.base_url = None
+        self._ids = itertools.count(int(time.time() * 1000) << 22)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.requests = {name: 0 for name in self.configs}
+
+    def next_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def next_index(self):
+        with self._lock:
+            return next(self._counter)
+
+    def count(self, service):
+        with self._lock:
+            self.requests[service] += 1
+
+    def topic(self):
+        index = self.next_index()
+        if self.topic_pool:
+            index %= self.topic_pool
+        return f"Story number {index} about markets and memes"
+
+    def media_url(self):
+        index = self.next_index()
+        if self.media_pool:
+            index %= self.media_pool
+        return f"{self.base_url}/images/{index}.jpg"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection pools are exercised
+    state = None  # set on the per-server subclass
+
+    def log_message(self, format, *args):
+        pass
+
+    def _service(self):
+        return self.path.lstrip("/").split("/", 1)[0]
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _send(self, status, payload, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self, service):
+        """Applies latency and error injection. Returns False if an error was sent."""
+        config = self.state.configs[service]
+        self.state.count(service)
+        time.sleep(config.delay())
+        if random.random() < config.error_rate:
+            self._send(500, {"error": {"message": "injected stub error", "type": "server_error"}})
+            return False
+        return True
+
+    def do_GET(self):
+        service = self._service()
+        if service not in self.state.configs:
+            self._send(404, {"error": "unknown route"})
+            return
+        if not self._simulate(service):
+            return
+        if service == "images":
+            self._send(200, _png(self.state.configs["images"].payload), "image/png")
+        elif re.match(r"^/x/2/lists/[^/]+/tweets", self.path):
+            self._send(200, self._list_tweets())
+        else:
+            self._send(404, {"error": "unknown route"})
+
+    def do_POST(self):
+        service = self._service()
+        if service not in self.state.configs:
+            self._send(404, {"error": "unknown route"})
+            return
+        body = self._body()
+        if not self._simulate(service):
+            return
+        if service == "x" and self.path.startswith("/x/2/tweets"):
+            self._send(201, {"data": {"id": str(self.state.next_id()), "text": body.get("text", "")}})
+        elif service in ("openai", "perplexity") and self.path.endswith("/chat/completions"):
+            text = self._completion_text(service, body)
+            if body.get("stream"):
+                self._stream(body.get("model", ""), text)
+            else:
+                self._send(200, self._completion(body.get("model", ""), body.get("messages", []), text))
+        else:
+            self._send(404, {"error": "unknown route"})
+
+    def _completion_text(self, service, body):
+        messages = body.get("messages", [])
+        prompt = json.dumps(messages)
+        payload = self.state.configs[service].payload
+        if service == "perplexity":
+            per_section = max(20, payload // len(SECTIONS))
+            return "\n\n".join(f"**{section}**: {_text(per_section)}" for section in SECTIONS)
+        if body.get("response_format", {}).get("type") == "json_object":
+            count = len(re.findall(r"### Candidate \d+ ###", prompt))
+            return json.dumps({"candidates": [
+                {"index": i, "topic": self.state.topic(), "method": random.choice(["reply", "quote", "standalone"]),
+                 "relevance": round(random.random(), 2)}
+                for i in range(count)
+            ]})
+        if "image_url" in prompt:
+            return "A dog looking at a candlestick chart. " + _text(payload)
+        if "reply, quote, or standalone" in prompt:
+            method = random.choice(["reply", "quote", "standalone"])
+            # The speculative-mode method prompt asks for the method only
+            return method if "At the bottom" not in prompt else f"{self.state.topic()}\n{method}"
+        return "much wow. " + _unique_text(payload)
+
+    @staticmethod
+    def _completion(model, messages, text):
+        prompt_tokens = len(json.dumps(messages)) // 4
+        completion_tokens = len(text) // 4
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def _stream(self, model, text):
+        """Sends the completion as server-sent events in chunked encoding, one word per event."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for word in re.findall(r"\S+\s*", text):
+                chunk = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                time.sleep(0.002)  # ~token inter-arrival time
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # The client cut the stream off early
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _list_tweets(self):
+        count = self.state.configs["x"].payload
+        now = datetime.now(timezone.utc)
+        tweets, media = [], []
+        ids = sorted((self.state.next_id() for _ in range(count)), reverse=True)
+        for i, tweet_id in enumerate(ids):
+            created_at = now - timedelta(seconds=10 * i)
+            tweet = {
+                "id": str(tweet_id),
+                "text": f"Tweet {tweet_id}: {_unique_text(120)}",
+                "author_id": "1",
+                "created_at": created_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "public_metrics": {
+                    "like_count": random.randint(0, 500),
+                    "retweet_count": random.randint(0, 100),
+                    "reply_count": random.randint(0, 50),
+                    "quote_count": random.randint(0, 20),
+                    "impression_count": random.randint(100, 50_000),
+                },
+            }
+            keys = []
+            for _ in range(self.state.media_per_tweet):
+                key = f"3_{self.state.next_id()}"
+                keys.append(key)
+                media.append({"media_key": key, "type": "photo", "url": self.state.media_url()})
+            if keys:
+                tweet["attachments"] = {"media_keys": keys}
+            tweets.append(tweet)
+        return {
+            "data": tweets,
+            "includes": {"users": [{"id": "1", "username": "stub_author", "name": "Stub"}], "media": media},
+            "meta": {"result_count": len(tweets)},
+        }
+
+
+class StubServer:
+    """Runs the stub upstreams on a local port in a background thread."""
+
+    def __init__(self, state=None, host="127.0.0.1", port=0):
+        self.state = state or StubState()
+        handler = type("StubHandler", (_Handler,), {"state": self.state})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://{host}:{self.server.server_address[1]}"
+        self.state.base_url = self.base_url
+        self._thread = None
+
+    def url(self, service):
+        """Base URL to configure for an upstream, e.g. url("openai") for the OpenAI client."""
+        return f"{self.base_url}/openai/v1" if service == "openai" else f"{self.base_url}/{service}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="stub-server")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
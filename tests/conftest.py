@@ -0,0 +1,15 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Throwaway config so the modules import without real credentials or files on disk
+config = types.ModuleType("config")
+config.OPENAI_API_KEY = config.PERPLEXITY_API_KEY = "test"
+config.X_BEARER_TOKEN = config.X_API_KEY = config.X_API_SECRET = "test"
+config.X_ACCESS_TOKEN = config.X_ACCESS_SECRET = "test"
+config.REDDIT_CLIENT_ID = config.REDDIT_CLIENT_SECRET = config.REDDIT_USER_AGENT = "test"
+config.METRICS_PORT = None
+config.SEEN_STORE_PATH = config.OUTBOX_PATH = ":memory:"
+sys.modules["config"] = config
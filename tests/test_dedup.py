@@ -0,0 +1,71 @@
+import time
+import dedup
+from dedup import NearDuplicateIndex
+
+SAME_STORY = [
+    ("SEC approves spot Ethereum ETFs", "SEC has approved spot Ether ETFs"),
+    ("Tesla stock drops 10% after earnings miss", "RT @cnbc: Tesla stock drops 10% after earnings miss! https://t.co/x"),
+    ("Fed holds rates steady, signals cuts later this year", "Fed keeps rates unchanged and signals cuts later this year"),
+    ("fed raises interest rates by 25 basis points", "BREAKING: fed raises interest rates by 25 basis points, more to come"),
+]
+
+# Same template, different entity, number or direction
+DIFFERENT_STORIES = [
+    ("Nvidia shares rise after earnings beat", "Amazon shares rise after earnings beat"),
+    ("nvidia shares rise after earnings beat", "amazon shares rise after earnings beat"),
+    ("Fed raises rates", "ECB raises rates"),
+    ("Fed raises rates", "Fed cuts rates"),
+    ("Tesla stock drops 10% after earnings miss", "Apple stock drops 5% after earnings miss"),
+    ("Inflation cools to 3.1% in November", "Inflation cools to 3.4% in December"),
+]
+
+UNRELATED = [
+    "Apple announces new iPhone at September event",
+    "Oil prices fall on OPEC production news",
+    "Nvidia becomes the most valuable company in the world",
+    "Japan's yen slides past 150 per dollar",
+    "Disney to cut 7,000 jobs in restructuring",
+]
+
+
+def test_rephrasings_are_duplicates():
+    for a, b in SAME_STORY:
+        index = NearDuplicateIndex()
+        index.add(a, "first")
+        assert index.find(b) == "first", (a, b)
+
+
+def test_same_template_different_stories_are_not():
+    for a, b in DIFFERENT_STORIES:
+        index = NearDuplicateIndex()
+        index.add(a, "first")
+        assert index.find(b) is None, (a, b)
+
+
+def test_unrelated_stories_are_not():
+    index = NearDuplicateIndex()
+    for i, text in enumerate(UNRELATED):
+        assert index.check_and_add(text, i) is None
+
+
+def test_check_and_add_keeps_the_first_version():
+    index = NearDuplicateIndex()
+    assert index.check_and_add("SEC approves spot Ethereum ETFs", "first") is None
+    assert index.check_and_add("SEC has approved spot Ether ETFs", "second") == "first"
+    assert index.find("SEC approves spot Ethereum ETFs", key="first") is None
+
+
+def test_entries_expire_with_the_window():
+    index = NearDuplicateIndex(window=60)
+    index.add("SEC approves spot Ethereum ETFs", "old", now=time.time() - 120)
+    assert index.find("SEC has approved spot Ether ETFs") is None
+
+
+def test_snapshot_round_trip_and_old_format():
+    index = NearDuplicateIndex()
+    index.add("SEC approves spot Ethereum ETFs", "sec")
+    restored = NearDuplicateIndex()
+    assert restored.restore(index.snapshot()) is not False
+    assert restored.find("SEC has approved spot Ether ETFs") == "sec"
+    assert restored.find("SEC approves spot Solana ETFs") is None
+    assert NearDuplicateIndex().restore({"bits": dedup.FINGERPRINT_BITS, "entries": [[1, time.time(), "sec"]]}) is False
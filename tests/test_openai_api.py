@@ -0,0 +1,22 @@
+from openai_api import TWEET_CHAR_TARGET, _stop_point
+
+LEAD = "x" * (TWEET_CHAR_TARGET - 10)
+
+
+def test_stream_stops_at_first_sentence_end_past_target():
+    text = LEAD + " Inflation rose 3.5% today. Markets"
+    assert _stop_point(text, 270) == text.index("today.") + len("today.")
+
+
+def test_stream_waits_for_whitespace_after_the_period():
+    assert _stop_point(LEAD + " Inflation rose 3.", 270) is None
+    assert _stop_point(LEAD + " Inflation rose 3.5", 270) is None
+
+
+def test_sentence_ends_before_target_do_not_stop():
+    assert _stop_point("Fed holds rates. Markets rally. ", 270) is None
+
+
+def test_budget_and_paragraph_still_stop():
+    assert _stop_point("x" * 300, 270) == 300
+    assert _stop_point("First paragraph\n\nSecond", 270) == len("First paragraph\n\nSecond")
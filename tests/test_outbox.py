@@ -0,0 +1,74 @@
+import asyncio
+import time
+from outbox import BACKOFF_BASE, Outbox, OutboxWorker
+from rate_limit import RateLimited
+from x_poster import classify_post_error
+
+
+def _row(outbox, row_id):
+    return outbox._db.execute(
+        "SELECT status, attempts, next_attempt_at FROM outbox WHERE id = ?", (row_id,)
+    ).fetchone()
+
+
+def test_enqueue_is_idempotent():
+    outbox = Outbox(":memory:")
+    assert outbox.enqueue("1", "reply", "hello")
+    assert not outbox.enqueue("1", "reply", "hello again")
+    assert len(outbox) == 1
+
+
+def test_claimed_row_is_leased_until_it_expires():
+    outbox = Outbox(":memory:", lease_timeout=300)
+    outbox.enqueue("1", "reply", "hello")
+    [row] = outbox.claim()
+    assert outbox.claim() == []
+
+    expired = Outbox(":memory:", lease_timeout=0)
+    expired.enqueue("1", "reply", "hello")
+    [row] = expired.claim()
+    assert [again["id"] for again in expired.claim()] == [row["id"]]
+
+
+def test_retryable_failure_backs_off():
+    outbox = Outbox(":memory:", max_attempts=3)
+    outbox.enqueue("1", "reply", "hello")
+    [row] = outbox.claim()
+    before = time.time()
+    assert outbox.mark_failed(row["id"], "timeout") == "pending"
+    status, attempts, next_attempt_at = _row(outbox, row["id"])
+    assert attempts == 1
+    assert before <= next_attempt_at <= time.time() + BACKOFF_BASE
+
+
+def test_row_fails_after_max_attempts():
+    outbox = Outbox(":memory:", max_attempts=2)
+    outbox.enqueue("1", "reply", "hello")
+    row_id = outbox.claim()[0]["id"]
+    assert outbox.mark_failed(row_id, "timeout", retry_at=0) == "pending"
+    assert outbox.claim()[0]["id"] == row_id
+    assert outbox.mark_failed(row_id, "timeout") == "failed"
+    assert _row(outbox, row_id)[:2] == ("failed", 2)
+    assert len(outbox) == 0
+
+
+def test_non_retryable_failure_fails_at_once():
+    outbox = Outbox(":memory:")
+    outbox.enqueue("1", "reply", "hello")
+    row_id = outbox.claim()[0]["id"]
+    assert outbox.mark_failed(row_id, "forbidden", retryable=False) == "failed"
+
+
+def test_rate_limit_deferral_does_not_use_an_attempt():
+    outbox = Outbox(":memory:", max_attempts=1)
+    outbox.enqueue("1", "reply", "hello")
+    row = outbox.claim()[0]
+    retry_at = time.time() + 60
+
+    def publish(method, source_id, text):
+        raise RateLimited("create_tweet", retry_at)
+
+    worker = OutboxWorker(outbox, publish, classify_post_error)
+    asyncio.run(worker.post(row))
+    assert _row(outbox, row["id"]) == ("pending", 0, retry_at)
+    assert outbox.next_due() == retry_at
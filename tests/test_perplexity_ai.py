@@ -0,0 +1,15 @@
+from perplexity_ai import normalize_topic
+
+
+def test_normalize_topic_drops_case_punctuation_and_filler():
+    assert normalize_topic("The Fed raises rates!") == normalize_topic("fed   raises rates")
+
+
+def test_normalize_topic_keeps_non_latin_topics_apart():
+    keys = {normalize_topic("日本銀行が利上げ"), normalize_topic("Банк России повысил ставку"), normalize_topic("The new")}
+    assert "" not in keys
+    assert len(keys) == 3
+
+
+def test_normalize_topic_keeps_word_order():
+    assert normalize_topic("Apple sues Google") != normalize_topic("Google sues Apple")
@@ -0,0 +1,92 @@
+import threading
+import time
+import pytest
+from rate_limit import RateLimited
+from scheduler import Scheduler, SourcePoller
+
+
+def _tweets(source, n):
+    created_at = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+    return [
+        {"id": f"{source}-{i}", "text": f"tweet {i}", "created_at": created_at, "public_metrics": {"like_count": i}}
+        for i in range(n)
+    ]
+
+
+def test_first_poll_keeps_the_min_interval():
+    poller = SourcePoller("list", min_interval=60, max_interval=1800, target_new=10)
+    poller.record(50, now=1000.0)
+    assert poller.rate is None
+    assert poller.interval == 60
+    assert poller.next_poll_at == 1060.0
+
+
+def test_interval_follows_arrival_rate():
+    poller = SourcePoller("list", min_interval=60, max_interval=1800, target_new=10, alpha=1.0)
+    poller.record(0, now=1000.0)
+    poller.record(10, now=1300.0)  # 10 new in 300s: 10 more take 300s
+    assert poller.interval == pytest.approx(300)
+    poller.record(1000, now=1400.0)  # Busy: clamped to the minimum
+    assert poller.interval == 60
+    poller.record(0, now=1460.0)  # Nothing new: back off to the maximum
+    assert poller.interval == 1800
+    assert poller.next_poll_at == 1460.0 + 1800
+
+
+def test_failure_doubles_interval_up_to_max():
+    poller = SourcePoller("list", min_interval=60, max_interval=200)
+    poller.record_failure(now=1000.0)
+    assert poller.interval == 120
+    assert poller.next_poll_at == 1120.0
+    poller.record_failure(now=1000.0)
+    assert poller.interval == 200
+
+
+def test_defer_keeps_interval_and_rate():
+    poller = SourcePoller("list", min_interval=60, max_interval=1800, alpha=1.0)
+    poller.record(0, now=1000.0)
+    poller.record(10, now=1300.0)
+    interval, rate = poller.interval, poller.rate
+    poller.defer(1500.0, now=1400.0)
+    assert poller.next_poll_at == 1500.0
+    assert (poller.interval, poller.rate, poller.last_polled) == (interval, rate, 1300.0)
+
+
+def test_poll_due_fetches_due_sources_concurrently():
+    both_fetching = threading.Barrier(2, timeout=5)
+
+    def fetch(source, hours):
+        both_fetching.wait()  # Breaks (and raises) unless both sources are fetched at once
+        return _tweets(source, 2)
+
+    scheduler = Scheduler(["a", "b"], fetch)
+    assert scheduler.poll_due() == 4
+    assert len(scheduler.queue) == 4
+    assert all(poller.last_polled is not None for poller in scheduler.pollers.values())
+
+
+def test_poll_due_only_polls_due_sources():
+    fetched = []
+    scheduler = Scheduler(["a", "b"], lambda source, hours: fetched.append(source) or [])
+    scheduler.pollers["b"].next_poll_at = time.time() + 600
+    scheduler.poll_due()
+    assert fetched == ["a"]
+
+
+def test_poll_due_defers_rate_limited_source_and_backs_off_failures():
+    now = time.time()
+
+    def fetch(source, hours):
+        if source == "limited":
+            raise RateLimited("list_tweets", now + 42)
+        if source == "broken":
+            raise ConnectionError("down")
+        return _tweets(source, 1)
+
+    scheduler = Scheduler(["limited", "broken", "ok"], fetch)
+    assert scheduler.poll_due(now) == 1
+    limited, broken = scheduler.pollers["limited"], scheduler.pollers["broken"]
+    assert limited.next_poll_at == now + 42
+    assert limited.interval == limited.min_interval
+    assert limited.last_polled is None
+    assert broken.interval == 2 * broken.min_interval
@@ -0,0 +1,23 @@
+from token_budget import compact_research, count_tokens
+
+RESEARCH = "\n".join([
+    "**Latest Developments**: " + " ".join(f"Shares moved {i}% in session {i}." for i in range(200)),
+    "**Popular Consensus**: Most analysts expect the rally to continue.",
+    "**Key Arguments**: Bulls point to earnings; bears point to valuations.",
+    "**Conclusion**: The move is likely to stick.",
+])
+
+
+def test_long_top_section_does_not_crowd_out_the_rest():
+    compact = compact_research(RESEARCH, budget=100)
+    assert count_tokens(compact) <= 100
+    assert compact.startswith("Latest Developments: Shares moved 0%")
+    assert "Popular Consensus: Most analysts expect the rally to continue." in compact
+    assert "Key Arguments: Bulls point to earnings; bears point to valuations." in compact
+
+
+def test_leftover_budget_goes_to_the_top_section():
+    compact = compact_research(RESEARCH, budget=300)
+    latest = compact.splitlines()[0]
+    assert count_tokens(latest) > 150
+    assert "Conclusion: The move is likely to stick." in compact
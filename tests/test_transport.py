@@ -0,0 +1,112 @@
+import asyncio
+import time
+import types
+import pytest
+import transport
+from rate_limit import RateLimited
+from transport import CircuitBreaker, CircuitOpenError
+
+
+def test_breaker_opens_after_threshold():
+    circuit = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    circuit.record_failure()
+    assert circuit.state == "closed"
+    circuit.record_failure()
+    assert circuit.state == "open"
+    with pytest.raises(CircuitOpenError):
+        circuit.allow()
+
+
+def test_success_resets_failures():
+    circuit = CircuitBreaker("test", failure_threshold=2)
+    circuit.record_failure()
+    circuit.record_success()
+    circuit.record_failure()
+    assert circuit.state == "closed"
+
+
+def test_half_open_lets_one_trial_through():
+    circuit = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    circuit.record_failure()
+    assert circuit.state == "half-open"
+    assert circuit.allow() is True
+    with pytest.raises(CircuitOpenError):
+        circuit.allow()
+
+
+def test_trial_outcome_closes_or_reopens():
+    circuit = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    circuit.record_failure()
+    circuit.allow()
+    circuit.record_success()
+    assert circuit.state == "closed"
+    assert circuit.allow() is False
+
+    circuit.record_failure()
+    circuit.reset_timeout = 30
+    circuit.opened_at = time.monotonic() - 31
+    circuit.allow()
+    circuit.record_failure()
+    assert circuit.state == "open"
+
+
+def test_cancelled_trial_reopens_circuit(monkeypatch):
+    circuit = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    monkeypatch.setitem(transport._breakers, "test-upstream", circuit)
+    monkeypatch.setitem(transport.UPSTREAMS, "test-upstream", {"retries": 0})
+    circuit.record_failure()
+    circuit.opened_at = time.monotonic() - 31  # Half-open
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def run():
+        task = asyncio.ensure_future(transport.call_async("test-upstream", slow))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert circuit.state == "open"
+    assert not circuit._trial_in_flight
+    circuit.opened_at = time.monotonic() - 31
+    assert circuit.allow() is True  # A new trial is possible once the timeout passes again
+
+
+def test_cancelled_call_on_closed_circuit_is_not_a_failure(monkeypatch):
+    circuit = CircuitBreaker("test", failure_threshold=1)
+    monkeypatch.setitem(transport._breakers, "test-upstream", circuit)
+    monkeypatch.setitem(transport.UPSTREAMS, "test-upstream", {"retries": 0})
+
+    async def run():
+        task = asyncio.ensure_future(transport.call_async("test-upstream", asyncio.sleep, 10))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert circuit.state == "closed"
+
+
+def test_x_rate_limit_is_deferred_not_retried(monkeypatch):
+    monkeypatch.setitem(transport._breakers, "test-x", CircuitBreaker("test-x"))
+    monkeypatch.setitem(transport.UPSTREAMS, "test-x", {"retries": 2, "defer_rate_limits": True})
+    reset_at = time.time() + 600
+    request = types.SimpleNamespace(method="GET")
+    response = types.SimpleNamespace(status_code=429, headers={"x-rate-limit-reset": str(reset_at)},
+                                     request=request, url="https://api.twitter.com/2/lists/1/tweets")
+    calls = []
+
+    def get_list_tweets():
+        calls.append(1)
+        error = Exception("Too Many Requests")
+        error.response = response
+        raise error
+
+    with pytest.raises(RateLimited) as raised:
+        transport.call("test-x", get_list_tweets)
+    assert len(calls) == 1
+    assert (raised.value.endpoint, raised.value.retry_at) == ("list_tweets", reset_at)
+    assert transport.breaker("test-x").state == "closed"
@@ -0,0 +1,158 @@
+import functools
+import re
+import config
+
+# Token budget for the research insights pasted into the Step 3 tweet prompt
+RESEARCH_TOKEN_BUDGET = getattr(config, "RESEARCH_TOKEN_BUDGET", 400)
+
+# Research sections in the order they are kept when trimming to the budget
+SECTION_PRIORITY = getattr(config, "RESEARCH_SECTION_PRIORITY", [
+    "latest developments",
+    "popular consensus",
+    "key arguments",
+    "conclusion",
+    "financial implications",
+    "overview",
+])
+
+# Smallest share of the budget each kept section gets before the rest goes out by priority;
+# only as many sections are kept as the budget can give this share
+MIN_SECTION_TOKENS = getattr(config, "RESEARCH_MIN_SECTION_TOKENS", 25)
+
+# Heading keywords for each section of the research summary requested in perplexity_ai
+_SECTION_KEYWORDS = {
+    "overview": ("overview",),
+    "latest developments": ("latest development", "recent development", "latest news"),
+    "financial implications": ("financial", "economic"),
+    # Checked before "popular consensus": "Key arguments for and against the consensus"
+    "key arguments": ("argument", "for and against"),
+    "popular consensus": ("consensus",),
+    "conclusion": ("conclusion",),
+}
+
+# Markdown/list decoration that may surround a heading, e.g. "### 2. **Latest developments:**"
+_HEADING_DECORATION = re.compile(r"^[\s#*\-\d.)]+|[\s*:#]+$")
+
+
+@functools.lru_cache(maxsize=8)
+def get_encoding(model="gpt-4o-mini"):
+    """
+    Returns the (cached) tiktoken encoding for a model, or None when tiktoken isn't installed
+    or can't load the encoding (tiktoken downloads it on first use).
+    """
+    try:
+        import tiktoken
+    except ImportError:  # tiktoken is optional; without it counts are estimated at ~4 characters per token
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"Could not load tiktoken encoding for {model}, estimating token counts instead: {e}")
+        return None
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """Counts the tokens in `text` for the given model."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text, max_tokens, model="gpt-4o-mini"):
+    """Cuts `text` to at most `max_tokens` tokens, backing off to the last sentence or word boundary."""
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(model)
+    if encoding is None:
+        if len(text) <= max_tokens * 4:
+            return text
+        head = text[:max_tokens * 4]
+    else:
+        tokens = encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        head = encoding.decode(tokens[:max_tokens])
+
+    sentence_end = max(head.rfind(". "), head.rfind("! "), head.rfind("? "), head.rfind("\n"))
+    if sentence_end >= len(head) // 2:
+        return head[:sentence_end + 1].rstrip()
+    return head.rsplit(" ", 1)[0].rstrip() + "…"
+
+
+def _section_for_heading(line):
+    """Returns the section name if `line` looks like one of the research headings."""
+    # A heading line may carry inline content after a colon, e.g. "**Conclusion**: text"
+    raw, _, inline = line.strip().partition(":")
+    heading = _HEADING_DECORATION.sub("", raw)
+    if not heading or len(heading) > 60:
+        return None
+    # With inline content, only treat it as a heading if it is marked up like one
+    if inline.strip() and raw == heading:
+        return None
+    heading = heading.lower()
+    for section, keywords in _SECTION_KEYWORDS.items():
+        if any(keyword in heading for keyword in keywords):
+            return section
+    return None
+
+
+def extract_sections(research):
+    """
+    Splits a research summary into its sections. Returns {section name: text}; text
+    before the first recognised heading is ignored. Empty if no headings are found.
+    """
+    sections = {}
+    current = None
+    for line in research.splitlines():
+        section = _section_for_heading(line)
+        if section:
+            current = section
+            inline = line.partition(":")[2].strip("* \t")
+            sections.setdefault(current, [])
+            if inline:
+                sections[current].append(inline)
+            continue
+        if current and line.strip():
+            sections[current].append(line.strip())
+    return {name: "\n".join(lines) for name, lines in sections.items() if lines}
+
+
+def compact_research(research, budget=RESEARCH_TOKEN_BUDGET, priority=None, model="gpt-4o-mini"):
+    """
+    Trims research results to `budget` tokens before they go into the tweet prompt. Each
+    kept section gets at least MIN_SECTION_TOKENS and the rest of the budget goes to the
+    most useful sections first (see SECTION_PRIORITY). Falls back to truncating the whole
+    text when the sections can't be identified.
+    """
+    if not research or count_tokens(research, model) <= budget:
+        return research
+
+    sections = extract_sections(research)
+    if not sections:
+        return truncate_tokens(research, budget, model)
+
+    names = [name for name in priority or SECTION_PRIORITY if name in sections]
+    names = names[:max(1, budget // MIN_SECTION_TOKENS)]
+    headers = {name: f"{name.title()}: " for name in names}
+    # Tokens each section needs in full, counting its header and the joining newline
+    needed = {name: count_tokens(headers[name] + sections[name], model) + 1 for name in names}
+
+    # Every kept section gets its minimum share first, so a long top section can't crowd out the rest
+    share = min(MIN_SECTION_TOKENS, budget // len(names))
+    allotted = {name: min(needed[name], share) for name in names}
+    remaining = budget - sum(allotted.values())
+    for name in names:
+        extra = min(needed[name] - allotted[name], remaining)
+        allotted[name] += extra
+        remaining -= extra
+
+    parts = []
+    for name in names:
+        text = truncate_tokens(sections[name], allotted[name] - count_tokens(headers[name], model) - 1, model)
+        if text:
+            parts.append(headers[name] + text)
+    return "\n".join(parts)
@@ -0,0 +1,437 @@
+import asyncio
+import functools
+import random
+import threading
+import time
+import weakref
+import config
+
+# httpx, requests, the OpenAI SDK and cassette (which builds on httpx and requests) are
+# imported on first use: they make up most of the start-up time, and a run that finds
+# nothing due never needs them.
+
+# Per-upstream transport settings: timeouts in seconds, retry budget, backoff and breaker
+# thresholds, connection pool size and API base URL (None keeps the library default).
+# defer_rate_limits turns a 429 into rate_limit.RateLimited (retry at the reported reset)
+# instead of retrying it, so the governor, scheduler and outbox reschedule the call.
+# Override any of them with config.TRANSPORT_SETTINGS, e.g. {"images": {"read": 10}}.
+UPSTREAMS = {
+    "openai": {"connect": 5, "read": 60, "retries": 2, "pool": 20, "base_url": None},
+    "perplexity": {"connect": 5, "read": 120, "retries": 2, "pool": 10, "base_url": "https://api.perplexity.ai"},
+    "images": {"connect": 5, "read": 20, "retries": 2, "pool": 20},
+    "x": {"connect": 5, "read": 30, "retries": 2, "pool": 10, "base_url": None, "defer_rate_limits": True},
+    "reddit": {"connect": 5, "read": 30, "retries": 2, "pool": 10},
+}
+_DEFAULTS = {
+    "backoff_base": 0.5, "backoff_max": 8, "failure_threshold": 5, "reset_timeout": 30, "base_url": None,
+    "defer_rate_limits": False,
+}
+for _name, _overrides in getattr(config, "TRANSPORT_SETTINGS", {}).items():
+    UPSTREAMS.setdefault(_name, {}).update(_overrides)
+
+# Hosts tweepy hard-codes; requests to them are redirected when the upstream has a base_url
+_LIBRARY_HOSTS = {"x": "https://api.twitter.com"}
+
+# Status codes worth retrying; writes (idempotent=False) only retry 429s
+_RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+@functools.cache
+def _network_errors():
+    """(errors raised before the request reached the server, all network errors)."""
+    import httpx
+    import requests
+    from openai import APIConnectionError
+    never_sent = (httpx.ConnectError, httpx.ConnectTimeout, requests.exceptions.ConnectTimeout)
+    network = (httpx.TransportError, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+               APIConnectionError)
+    return never_sent, network
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class DownloadRejected(ValueError):
+    """Raised when a download is too large or has an unexpected content type."""
+
+
+def settings(name):
+    """Returns the transport settings for an upstream, with defaults filled in."""
+    return {**_DEFAULTS, **UPSTREAMS[name]}
+
+
+def timeout(name, connect=None, read=None):
+    """Builds an httpx.Timeout for an upstream, optionally overriding connect/read for one call."""
+    import httpx
+    upstream = settings(name)
+    return httpx.Timeout(
+        connect=connect or upstream["connect"],
+        read=read or upstream["read"],
+        write=read or upstream["read"],
+        pool=connect or upstream["connect"],
+    )
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker. After `failure_threshold` consecutive failures the
+    circuit opens and calls fail fast for `reset_timeout` seconds; then a single trial
+    call is let through (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """
+        Raises CircuitOpenError unless a call may go through right now. Returns True if the
+        call is the half-open trial, whose outcome must always be recorded.
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+        raise CircuitOpenError(f"Circuit for '{self.name}' is open; skipping call.")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name):
+    """Returns the shared circuit breaker for an upstream."""
+    with _breakers_lock:
+        if name not in _breakers:
+            upstream = settings(name)
+            _breakers[name] = CircuitBreaker(name, upstream["failure_threshold"], upstream["reset_timeout"])
+        return _breakers[name]
+
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    return status
+
+
+def is_retryable(exc, idempotent=True):
+    """Whether a failed call may be retried: network errors and transient HTTP statuses."""
+    import cassette
+    if cassette.is_miss(exc):
+        return False  # Replaying: asking again won't find a recording either
+    status = _status_code(exc)
+    if status is not None:
+        return status == 429 or (idempotent and status in _RETRYABLE_STATUS)
+    never_sent, network = _network_errors()
+    if isinstance(exc, never_sent):
+        # The request never reached the server, so even a write is safe to resend
+        return True
+    return idempotent and isinstance(exc, network)
+
+
+def _deferred(name, exc):
+    """rate_limit.RateLimited for a 429 from an upstream that defers rate limits, else None."""
+    if not settings(name)["defer_rate_limits"] or _status_code(exc) != 429:
+        return None
+    import rate_limit
+    response = getattr(exc, "response", None)
+    request = getattr(response, "request", None)
+    endpoint = None
+    if request is not None:
+        endpoint = rate_limit.endpoint_for(request.method, str(response.url))
+    endpoint = endpoint or name
+    headers = getattr(response, "headers", None) or {}
+    try:
+        retry_at = float(headers["x-rate-limit-reset"])
+    except (KeyError, TypeError, ValueError):
+        # No reset reported: wait out the endpoint's whole window
+        retry_at = time.time() + rate_limit.DEFAULT_LIMITS.get(endpoint, (0, 15 * 60))[1]
+    return rate_limit.RateLimited(endpoint, retry_at)
+
+
+def backoff_delay(name, attempt):
+    """Full-jitter exponential backoff for the given retry attempt (0-based)."""
+    upstream = settings(name)
+    return random.uniform(0, min(upstream["backoff_max"], upstream["backoff_base"] * 2 ** attempt))
+
+
+def call(name, fn, *args, idempotent=True, **kwargs):
+    """
+    Calls `fn(*args, **kwargs)` against an upstream with bounded retries, jittered
+    exponential backoff and the upstream's circuit breaker. Set idempotent=False for
+    writes (e.g. creating a tweet) so only failures that never reached the server are retried.
+    Upstreams with defer_rate_limits raise rate_limit.RateLimited on a 429 instead of retrying.
+    """
+    circuit = breaker(name)
+    retries = settings(name)["retries"]
+    for attempt in range(retries + 1):
+        trial = circuit.allow()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            deferred = _deferred(name, e)
+            if deferred is not None:
+                # The upstream answered; retrying before the reset would only burn the window
+                circuit.record_success()
+                raise deferred from e
+            retryable = is_retryable(e, idempotent)
+            # Only upstream trouble (network errors, 5xx, 429) counts against the breaker;
+            # any other error still proves the upstream is reachable
+            if is_retryable(e):
+                circuit.record_failure()
+            else:
+                circuit.record_success()
+            if not retryable or attempt == retries:
+                raise
+            time.sleep(backoff_delay(name, attempt))
+        except BaseException:
+            # Interrupted before an outcome: a trial counts as failed so the circuit re-opens
+            # instead of waiting forever for a result that never comes
+            if trial:
+                circuit.record_failure()
+            raise
+        else:
+            circuit.record_success()
+            return result
+
+
+async def call_async(name, fn, *args, idempotent=True, **kwargs):
+    """Async counterpart of call; `fn` is a coroutine function."""
+    circuit = breaker(name)
+    retries = settings(name)["retries"]
+    for attempt in range(retries + 1):
+        trial = circuit.allow()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            deferred = _deferred(name, e)
+            if deferred is not None:
+                # The upstream answered; retrying before the reset would only burn the window
+                circuit.record_success()
+                raise deferred from e
+            retryable = is_retryable(e, idempotent)
+            # Only upstream trouble (network errors, 5xx, 429) counts against the breaker;
+            # any other error still proves the upstream is reachable
+            if is_retryable(e):
+                circuit.record_failure()
+            else:
+                circuit.record_success()
+            if not retryable or attempt == retries:
+                raise
+            await asyncio.sleep(backoff_delay(name, attempt))
+        except BaseException:
+            # Cancelled (hedging, stage timeouts, discarded drafts) before an outcome: a trial
+            # counts as failed so the circuit re-opens instead of staying stuck half-open
+            if trial:
+                circuit.record_failure()
+            raise
+        else:
+            circuit.record_success()
+            return result
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+# Async clients are bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _limits(name):
+    import httpx
+    pool = settings(name)["pool"]
+    return httpx.Limits(max_connections=pool, max_keepalive_connections=pool)
+
+
+def _http_client(name):
+    # Callers hold _clients_lock
+    import httpx
+    import cassette
+    key = ("http", name)
+    if key not in _clients:
+        # Recorded to / replayed from the cassette when CASSETTE_MODE is set
+        _clients[key] = httpx.Client(timeout=timeout(name), follow_redirects=True,
+                                     transport=cassette.wrap_transport(httpx.HTTPTransport(limits=_limits(name))))
+    return _clients[key]
+
+
+def get_http_client(name):
+    """Returns the shared keep-alive httpx.Client for an upstream."""
+    with _clients_lock:
+        return _http_client(name)
+
+
+def get_async_http_client(name):
+    """Returns the keep-alive httpx.AsyncClient for an upstream on the running event loop."""
+    import httpx
+    import cassette
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = httpx.AsyncClient(
+            timeout=timeout(name), follow_redirects=True,
+            transport=cassette.wrap_async_transport(httpx.AsyncHTTPTransport(limits=_limits(name))),
+        )
+    return clients[name]
+
+
+@functools.cache
+def _timeout_session_class():
+    # Defined on first use so requests is only imported once a session is needed
+    import requests
+    import cassette
+
+    class TimeoutSession(requests.Session):
+        """
+        requests.Session with a pooled adapter and default (connect, read) timeouts. When
+        `rewrite` is a (from_prefix, to_prefix) pair, matching URLs are sent to the new prefix.
+        """
+
+        def __init__(self, connect, read, pool, rewrite=None):
+            super().__init__()
+            self.default_timeout = (connect, read)
+            self.rewrite = rewrite
+            adapter = cassette.http_adapter(pool_connections=4, pool_maxsize=pool)
+            self.mount("https://", adapter)
+            self.mount("http://", adapter)
+
+        def request(self, method, url, **kwargs):
+            kwargs.setdefault("timeout", self.default_timeout)
+            if self.rewrite and url.startswith(self.rewrite[0]):
+                url = self.rewrite[1] + url[len(self.rewrite[0]):]
+            return super().request(method, url, **kwargs)
+
+    return TimeoutSession
+
+
+def get_requests_session(name, key=None):
+    """
+    Returns the shared keep-alive requests.Session for an upstream (used by tweepy and PRAW).
+    Pass a `key` (e.g. an account name) for a separate session with its own response hooks.
+    """
+    with _clients_lock:
+        key = ("requests", name) if key is None else ("requests", name, key)
+        if key not in _clients:
+            upstream = settings(name)
+            rewrite = None
+            if upstream["base_url"] and name in _LIBRARY_HOSTS:
+                rewrite = (_LIBRARY_HOSTS[name], upstream["base_url"].rstrip("/"))
+            _clients[key] = _timeout_session_class()(upstream["connect"], upstream["read"], upstream["pool"], rewrite)
+        return _clients[key]
+
+
+def get_openai_client():
+    """Returns the shared OpenAI client. Retries are handled by call(), not the SDK."""
+    from openai import OpenAI
+    with _clients_lock:
+        if "openai" not in _clients:
+            _clients["openai"] = OpenAI(api_key=config.OPENAI_API_KEY, base_url=settings("openai")["base_url"],
+                                        max_retries=0, http_client=_http_client("openai"))
+        return _clients["openai"]
+
+
+def get_perplexity_client():
+    """Returns the shared Perplexity client (OpenAI-compatible API)."""
+    from openai import OpenAI
+    with _clients_lock:
+        if "perplexity" not in _clients:
+            _clients["perplexity"] = OpenAI(api_key=config.PERPLEXITY_API_KEY, base_url=settings("perplexity")["base_url"],
+                                            max_retries=0, http_client=_http_client("perplexity"))
+        return _clients["perplexity"]
+
+
+def get_async_openai_client():
+    """Returns the AsyncOpenAI client for the running event loop."""
+    from openai import AsyncOpenAI
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if "openai_sdk" not in clients:
+        clients["openai_sdk"] = AsyncOpenAI(api_key=config.OPENAI_API_KEY, base_url=settings("openai")["base_url"],
+                                            max_retries=0, http_client=get_async_http_client("openai"))
+    return clients["openai_sdk"]
+
+
+def get_async_perplexity_client():
+    """Returns the async Perplexity client for the running event loop."""
+    from openai import AsyncOpenAI
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if "perplexity_sdk" not in clients:
+        clients["perplexity_sdk"] = AsyncOpenAI(api_key=config.PERPLEXITY_API_KEY,
+                                                base_url=settings("perplexity")["base_url"],
+                                                max_retries=0, http_client=get_async_http_client("perplexity"))
+    return clients["perplexity_sdk"]
+
+
+def _check_download(url, headers, max_bytes, content_types):
+    content_type = headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_types and content_type not in content_types:
+        raise DownloadRejected(f"Unexpected content type '{content_type}' for {url}")
+    length = headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise DownloadRejected(f"{url} is {length} bytes, over the {max_bytes} byte cap")
+    return content_type
+
+
+def download_capped(url, max_bytes, content_types=None, connect=None, read=None):
+    """
+    Streams a download over the pooled image client, checking Content-Type and
+    Content-Length before reading the body and aborting as soon as more than `max_bytes`
+    arrive. Returns (body, content_type); raises DownloadRejected for oversized or
+    unexpected content.
+    """
+    def get():
+        with get_http_client("images").stream("GET", url, timeout=timeout("images", connect, read)) as response:
+            response.raise_for_status()
+            content_type = _check_download(url, response.headers, max_bytes, content_types)
+            body = bytearray()
+            for chunk in response.iter_bytes():
+                body += chunk
+                if len(body) > max_bytes:
+                    raise DownloadRejected(f"{url} exceeded the {max_bytes} byte cap")
+            return bytes(body), content_type
+    return call("images", get)
+
+
+async def download_capped_async(url, max_bytes, content_types=None, connect=None, read=None):
+    """Async counterpart of download_capped."""
+    async def get():
+        client = get_async_http_client("images")
+        async with client.stream("GET", url, timeout=timeout("images", connect, read)) as response:
+            response.raise_for_status()
+            content_type = _check_download(url, response.headers, max_bytes, content_types)
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) > max_bytes:
+                    raise DownloadRejected(f"{url} exceeded the {max_bytes} byte cap")
+            return bytes(body), content_type
+    return await call_async("images", get)
@@ -1,7 +1,13 @@
-import tweepy
-import datetime
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from openai_api import analyze_image_with_openai
-from tweepy import TweepyException
+from seen_store import seen_items
+import dedup
+import metrics
+import ranking
+import rate_limit
+import transport
 from config import (
     X_BEARER_TOKEN,
     X_API_KEY,
@@ -10,20 +16,90 @@ from config import (
     X_ACCESS_SECRET,
 )
 
-# Initialize the Tweepy client
-client = tweepy.Client(
-    bearer_token=X_BEARER_TOKEN,
-    consumer_key=X_API_KEY,
-    consumer_secret=X_API_SECRET,
-    access_token=X_ACCESS_TOKEN,
-    access_token_secret=X_ACCESS_SECRET,
-    return_type=dict,
-    wait_on_rate_limit=True,
+# Name of the account configured by the X_* settings in config
+DEFAULT_ACCOUNT = "default"
+
+
+class Account:
+    """
+    One X account: its tweepy client, request session and rate-limit governor. Accounts
+    never share a governor, so each one keeps its own read and write budgets. The client
+    (and tweepy itself) is only loaded on first use.
+    """
+
+    def __init__(self, name, bearer_token, consumer_key, consumer_secret, access_token, access_token_secret,
+                 governor=None):
+        self.name = name
+        self.governor = governor or rate_limit.RateLimitGovernor()
+        self._credentials = {
+            "bearer_token": bearer_token,
+            "consumer_key": consumer_key,
+            "consumer_secret": consumer_secret,
+            "access_token": access_token,
+            "access_token_secret": access_token_secret,
+        }
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                import tweepy
+                client = tweepy.Client(
+                    **self._credentials,
+                    return_type=dict,
+                    wait_on_rate_limit=False,  # The governor plans around limits instead of sleeping in tweepy
+                )
+                # Route X traffic through a keep-alive session with connect/read timeouts
+                key = None if self.name == DEFAULT_ACCOUNT else self.name
+                client.session = transport.get_requests_session("x", key=key)
+                # Keep the governor in sync with the x-rate-limit-* headers of every response
+                client.session.hooks["response"].append(self.governor.observe_response)
+                self._client = client
+            return self._client
+
+    @classmethod
+    def from_config(cls, settings):
+        """
+        Builds an account from a config dict with "name", "access_token" and
+        "access_token_secret"; the app credentials default to the ones in config.
+        """
+        return cls(
+            settings["name"],
+            settings.get("bearer_token", X_BEARER_TOKEN),
+            settings.get("api_key", X_API_KEY),
+            settings.get("api_secret", X_API_SECRET),
+            settings["access_token"],
+            settings["access_token_secret"],
+        )
+
+
+# The account from config, used whenever no account is given
+default_account = Account(
+    DEFAULT_ACCOUNT, X_BEARER_TOKEN, X_API_KEY, X_API_SECRET, X_ACCESS_TOKEN, X_ACCESS_SECRET,
+    governor=rate_limit.governor,
 )
 
 
+def __getattr__(name):
+    # x_poster.client: the default account's client, created on first access
+    if name == "client":
+        return default_account.client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Namespace for tweet IDs in the shared seen-item store
+SEEN_NAMESPACE = "tweet"
+
+# Newest tweet ID ingested per list, so each poll only picks up new tweets
+list_since_ids = {}
+_since_ids_lock = threading.Lock()
+
+
 def post_to_x(tweet_data):
     """Post a standalone tweet."""
+    from tweepy import TweepyException
     try:
         # If tweet_data is a dictionary, extract the tweet text
         if isinstance(tweet_data, dict):
@@ -35,17 +111,24 @@ def post_to_x(tweet_data):
         if len(tweet) > 270:  # Twitter's character limit
             tweet = tweet[:270]
 
-        response = client.create_tweet(text=tweet)
+        if not rate_limit.governor.try_acquire("create_tweet"):
+            print(f"Tweet creation rate limit reached; not posting: {tweet}")
+            return None
+
+        with metrics.observe("create_tweet"):
+            response = transport.call("x", default_account.client.create_tweet, text=tweet, idempotent=False)
         if "data" in response:
             print(f"Tweet posted successfully: {tweet}")
-        else:
-            print("Failed to post tweet.")
-    except tweepy.TweepyException as e:
+            return response["data"]["id"]
+        print("Failed to post tweet.")
+    except (TweepyException, rate_limit.RateLimited) as e:
         print(f"Error posting tweet: {e}")
+    return None
 
 
 def reply_to_x(tweet_id, reply_text):
     """Reply to a tweet."""
+    from tweepy import TweepyException
     try:
         # If reply_text is a dictionary, extract the tweet text
         if isinstance(reply_text, dict):
@@ -57,25 +140,35 @@ def reply_to_x(tweet_id, reply_text):
         if len(reply) > 270:  # Twitter's character limit
             reply = reply[:270]
 
-        response = client.create_tweet(
-            text=reply, 
-            in_reply_to_tweet_id=tweet_id
-        )
+        if not rate_limit.governor.try_acquire("create_tweet"):
+            print(f"Tweet creation rate limit reached; not replying to Tweet ID {tweet_id}.")
+            return None
+
+        with metrics.observe("create_tweet"):
+            response = transport.call(
+                "x",
+                default_account.client.create_tweet,
+                text=reply,
+                in_reply_to_tweet_id=tweet_id,
+                idempotent=False
+            )
         
         if "data" in response:
             print(f"Replied to Tweet ID {tweet_id} with: {reply}")
-        else:
-            print("Failed to post reply.")
-            print(f"Response details: {response}")
+            return response["data"]["id"]
+        print("Failed to post reply.")
+        print(f"Response details: {response}")
     
-    except tweepy.TweepyException as e:
+    except (TweepyException, rate_limit.RateLimited) as e:
         print(f"Error replying to tweet: {e}")
         # If possible, log the full error details
         print(f"Error details: {str(e)}")
+    return None
 
 
 def quote_tweet(tweet_id, quote_text):
     """Quote a tweet."""
+    from tweepy import TweepyException
     try:
         # If quote_text is a dictionary, extract the tweet text
         if isinstance(quote_text, dict):
@@ -87,97 +180,255 @@ def quote_tweet(tweet_id, quote_text):
         if len(quote) > 270:  # Twitter's character limit
             quote = quote[:270]
 
-        response = client.create_tweet(
-            text=quote, 
-            quote_tweet_id=tweet_id
-        )
+        if not rate_limit.governor.try_acquire("create_tweet"):
+            print(f"Tweet creation rate limit reached; not quoting Tweet ID {tweet_id}.")
+            return None
+
+        with metrics.observe("create_tweet"):
+            response = transport.call(
+                "x",
+                default_account.client.create_tweet,
+                text=quote,
+                quote_tweet_id=tweet_id,
+                idempotent=False
+            )
         if "data" in response:
             print(f"Quoted Tweet ID {tweet_id} with: {quote}")
-        else:
-            print("Failed to post quote.")
-    except tweepy.TweepyException as e:
+            return response["data"]["id"]
+        print("Failed to post quote.")
+    except (TweepyException, rate_limit.RateLimited) as e:
         print(f"Error quoting tweet: {e}")
+    return None
 
 
-def fetch_most_interacted_tweet(list_id, hours=0.38, max_calls=1):
-    """Fetch the most interacted-with tweet from an X List and analyze its media."""
-    try:
-        # Correct datetime usage to get UTC time minus the timedelta
-        time_limit = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
-        tweets = []
+def publish(method, source_id, text, account=None):
+    """
+    Posts generated text as a standalone tweet, reply or quote of `source_id` and returns
+    the new tweet's ID. Unlike post_to_x, reply_to_x and quote_tweet, errors are raised so
+    the outbox worker can decide whether to retry.
+    """
+    from tweepy import TweepyException
+    account = account or default_account
+    kwargs = {
+        "reply": {"in_reply_to_tweet_id": source_id},
+        "quote": {"quote_tweet_id": source_id},
+    }.get(method, {})
+    account.governor.acquire_or_raise("create_tweet")
+    with metrics.observe("create_tweet"):
+        response = transport.call("x", account.client.create_tweet, text=text[:270], idempotent=False, **kwargs)
+    if "data" not in response:
+        raise TweepyException(f"No tweet in create_tweet response: {response}")
+    print(f"Posted {method} as {account.name} (source {source_id}): {text[:270]}")
+    return response["data"]["id"]
+
+
+def classify_post_error(exc):
+    """
+    Maps a publish() failure to an outbox outcome: ("sent", None) for duplicate content
+    (already posted, e.g. before a crash), ("defer", reset_time) for rate limits,
+    ("retry", None) for transient errors and ("fail", None) for other client errors.
+    """
+    if isinstance(exc, rate_limit.RateLimited):
+        return "defer", exc.retry_at
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status == 403 and "duplicate" in str(exc).lower():
+        return "sent", None
+    if status == 429:
+        reset = getattr(response, "headers", {}).get("x-rate-limit-reset")
+        return "defer", float(reset) if reset else None
+    if status is not None and 400 <= status < 500:
+        return "fail", None
+    return "retry", None
+
 
-        for _ in range(max_calls):
+def _since_key(list_id, account):
+    return list_id if account.name == DEFAULT_ACCOUNT else f"{account.name}:{list_id}"
+
+
+def fetch_list_tweets(list_id, hours=0.38, max_pages=5, page_size=100, account=None):
+    """
+    Fetch new tweets from an X List, following `next_token` across pages.
+
+    The list endpoint has no since_id parameter, so the newest tweet ID seen per list is
+    tracked in `list_since_ids` and paging stops as soon as a page reaches tweets that were
+    already ingested (or older than `hours`). Media and author lookups are merged from the
+    `includes` of every page, and each returned tweet carries "author_handle", "media" and
+    "list_id". Each account reads with its own client and tracks its own since_ids.
+
+    Raises rate_limit.RateLimited when the list endpoint has no budget (or X answers 429) for the first page;
+    a poll cut short on a later page returns the pages already read.
+    """
+    account = account or default_account
+    since_key = _since_key(list_id, account)
+    time_limit = time.time() - hours * 3600
+    since_id = list_since_ids.get(since_key)
+    tweets = []
+    media_lookup = {}
+    users_lookup = {}
+    pagination_token = None
+
+    for page in range(max_pages):
+        # Skip the rest of this poll rather than block when the list endpoint is out of budget
+        # (by the governor's count or a 429 from X)
+        try:
+            account.governor.acquire_or_raise("list_tweets")
             # Make sure to expand "author_id" to get user details (author handle)
-            response = client.get_list_tweets(
-                id=list_id,
-                max_results=5,
-                tweet_fields=["created_at", "public_metrics", "text", "attachments"],
-                media_fields=["url"],  # Ensure media information is included
-                expansions=["attachments.media_keys", "author_id"],  # Expand media keys and author_id
-                user_fields=["username"],  # Fetch username (author's handle)
-                pagination_token=None
-            )
+            with metrics.observe("get_list_tweets"):
+                response = transport.call(
+                    "x",
+                    account.client.get_list_tweets,
+                    id=list_id,
+                    max_results=page_size,
+                    tweet_fields=["created_at", "public_metrics", "text", "attachments"],
+                    media_fields=["url"],  # Ensure media information is included
+                    expansions=["attachments.media_keys", "author_id"],  # Expand media keys and author_id
+                    user_fields=["username"],  # Fetch username (author's handle)
+                    pagination_token=pagination_token
+                )
+        except rate_limit.RateLimited as e:
+            if page == 0:
+                raise
+            print(f"List tweets rate limit reached; deferring the rest of list {list_id} for "
+                  f"{e.retry_at - time.time():.0f}s.")
+            break
+
+        includes = response.get("includes", {})
+        media_lookup.update({media["media_key"]: media for media in includes.get("media", [])})
+        users_lookup.update({user["id"]: user["username"] for user in includes.get("users", [])})
+
+        page = response.get("data", [])
+        created_at = ranking.parse_created_at([tweet.get("created_at") for tweet in page])
+        reached_known = False
+        for tweet, created in zip(page, created_at):
+            if (since_id and int(tweet["id"]) <= since_id) or created < time_limit:
+                reached_known = True
+                continue
+            tweets.append(tweet)
+
+        pagination_token = response.get("meta", {}).get("next_token")
+        if reached_known or not pagination_token:
+            break
+
+    if tweets:
+        with _since_ids_lock:
+            newest = max(int(tweet["id"]) for tweet in tweets)
+            list_since_ids[since_key] = max(newest, list_since_ids.get(since_key, 0))
+
+    for tweet in tweets:
+        tweet["list_id"] = list_id
+        # Extract the author handle
+        tweet["author_handle"] = users_lookup.get(tweet.get("author_id"), "unknown")
+        # Extract media URLs if available
+        media_keys = tweet.get("attachments", {}).get("media_keys", [])
+        tweet["media"] = [
+            media_lookup[key]["url"] for key in media_keys
+            if key in media_lookup and "url" in media_lookup[key]
+        ]
+
+    return tweets
+
+
+def fetch_candidate_tweets(list_ids, hours=0.38, max_pages=5, page_size=100, top_k=10, max_workers=8,
+                           account=None):
+    """
+    Poll several X Lists concurrently and return up to `top_k` new tweets (all of them for
+    top_k=None) ranked by engagement velocity (see ranking.score), highest first. Tweets that appear in more than one list are
+    returned once, tweets already handled (see mark_tweet_seen) are dropped, and lists
+    that fail to load are skipped. Retweets and rephrasings of a story already fetched
+    recently (see dedup.candidates) are dropped too, before any LLM call is spent on them.
+    Raises rate_limit.RateLimited (the earliest retry) if the rate limit deferred every list.
+    """
+    from tweepy import TweepyException
+    if isinstance(list_ids, str):
+        list_ids = [list_ids]
+
+    candidates = {}
+    deferred = []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(list_ids)) or 1) as executor:
+        futures = {
+            executor.submit(fetch_list_tweets, list_id, hours, max_pages, page_size, account): list_id
+            for list_id in list_ids
+        }
+        for future in as_completed(futures):
+            try:
+                for tweet in future.result():
+                    if not seen_items.seen(SEEN_NAMESPACE, tweet["id"]):
+                        candidates.setdefault(tweet["id"], tweet)
+            except rate_limit.RateLimited as e:
+                print(f"Deferring list {futures[future]}: {e}")
+                deferred.append(e)
+            except TweepyException as e:
+                print(f"Error fetching tweets for list {futures[future]}: {e}")
+            except Exception as e:
+                print(f"Unexpected error fetching list {futures[future]}: {e}")
+    if deferred and len(deferred) == len(list_ids):
+        # Nothing was read: let the caller reschedule rather than count an empty poll
+        raise min(deferred, key=lambda e: e.retry_at)
 
-            if "data" in response:
-                tweets.extend(response["data"])
-            else:
-                break
+    # Time-decayed engagement velocity over every list's tweets in one vectorized pass
+    ranked = ranking.top_k(candidates.values())
 
-        if not tweets:
+    # Walk best first so the most engaging version of a story is the one kept
+    unique = []
+    for tweet in ranked:
+        duplicate = dedup.candidates.check_and_add(tweet["text"], f"{SEEN_NAMESPACE}:{tweet['id']}")
+        if duplicate:
+            # Not marked seen: the list's since_id already keeps it from coming back here
+            print(f"Skipping Tweet ID {tweet['id']}: near-duplicate of {duplicate}.")
+            continue
+        unique.append(tweet)
+        if top_k is not None and len(unique) == top_k:
+            break
+    return unique
+
+
+def since_ids_snapshot():
+    """Copy of list_since_ids, for snapshot.save()."""
+    with _since_ids_lock:
+        return dict(list_since_ids)
+
+
+def restore_since_ids(since_ids):
+    """Loads since_ids saved by since_ids_snapshot(), keeping the newer ID where both have one."""
+    with _since_ids_lock:
+        for key, since_id in since_ids.items():
+            list_since_ids[key] = max(since_id, list_since_ids.get(key, 0))
+
+
+def is_tweet_seen(tweet_id):
+    """Whether a tweet was already handled, by any account."""
+    return seen_items.seen(SEEN_NAMESPACE, tweet_id)
+
+
+def mark_tweet_seen(tweet_id):
+    """Records a tweet as handled so later polls (and restarts) don't pick it again."""
+    seen_items.add(SEEN_NAMESPACE, tweet_id)
+
+
+def fetch_most_interacted_tweet(list_id, hours=0.38, max_calls=1):
+    """Fetch the most interacted-with new tweet from one or more X Lists and analyze its media."""
+    try:
+        candidates = fetch_candidate_tweets(list_id, hours=hours, max_pages=max_calls, top_k=1)
+        if not candidates:
             print(f"No tweets found in list: {list_id}")
             return None
 
-        # Create a lookup for media and users based on expansions
-        media_lookup = {media["media_key"]: media for media in response.get("includes", {}).get("media", [])}
-        users_lookup = {user["id"]: user["username"] for user in response.get("includes", {}).get("users", [])}
-
-        most_interacted_tweet = None
-        highest_interaction_score = 0
-
-        for tweet in tweets:
-            # Use datetime.datetime.strptime() to parse the date correctly
-            created_at = datetime.datetime.strptime(tweet["created_at"], "%Y-%m-%dT%H:%M:%S.%fZ")
-            if created_at >= time_limit:
-                metrics = tweet.get("public_metrics", {})
-                interaction_score = (
-                    metrics.get("like_count", 0) +
-                    metrics.get("retweet_count", 0) +
-                    metrics.get("reply_count", 0)
-                )
+        most_interacted_tweet = candidates[0]
+        media_urls = most_interacted_tweet["media"]
 
-                if interaction_score > highest_interaction_score:
-                    most_interacted_tweet = tweet
-                    highest_interaction_score = interaction_score
-
-        if most_interacted_tweet:
-            # Extract the author handle
-            author_id = most_interacted_tweet.get("author_id")
-            author_handle = users_lookup.get(author_id, "unknown")  # Default to "unknown" if not found
-            most_interacted_tweet["author_handle"] = author_handle  # Add author handle to the tweet data
-
-            # Extract media URLs if available
-            media_keys = most_interacted_tweet.get("attachments", {}).get("media_keys", [])
-            media_urls = []
-            for key in media_keys:
-                # Check for "url" field in the media object
-                if key in media_lookup and "url" in media_lookup[key]:
-                    media_urls.append(media_lookup[key]["url"])
-            most_interacted_tweet["media"] = media_urls  # Add media URLs to tweet data
-            
-            # Step 4: If media exists, analyze the image(s)
-            if media_urls:
-                for media_url in media_urls:
-                    print(f"Downloading and analyzing image from {media_url}")
-                    image_analysis = analyze_image_with_openai(media_url)  # Use the function from main.py
-                    print(f"Image analysis result: {image_analysis}")
-            else:
-                print("No media in the tweet, skipping image analysis.")
+        # Step 4: If media exists, analyze the image(s). Results land in the shared
+        # image cache, so generate_tweet reuses them instead of calling the model again.
+        if media_urls:
+            for media_url in media_urls:
+                print(f"Downloading and analyzing image from {media_url}")
+                image_analysis = analyze_image_with_openai(media_url)
+                print(f"Image analysis result: {image_analysis}")
+        else:
+            print("No media in the tweet, skipping image analysis.")
 
         return most_interacted_tweet
 
-    except TweepyException as e:
-        print(f"Error fetching tweets for list {list_id}: {e}")
-        return None
     except Exception as e:
         print(f"Unexpected error: {e}")
-        return None
\ No newline at end of file
+        return None